@@ -18,7 +18,6 @@ This module provides all the predefined variables.
 
 import datetime
 import os
-import pkg_resources
 import sys
 import tempfile
 
@@ -29,8 +28,12 @@ APP_NAME = "Packstack"
 
 FILE_YUM_VERSION_LOCK = "/etc/yum/pluginconf.d/versionlock.list"
 
-PACKSTACK_SRC_DOC = pkg_resources.resource_filename(
-    pkg_resources.Requirement.parse('packstack'), 'docs/packstack.rst'
+# docs are next to the packstack package both in source tree and in
+# installed distribution, pkg_resources is not used as it is slow to import
+PACKSTACK_SRC_DOC = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__)))),
+    'docs', 'packstack.rst'
 )
 if os.path.exists(PACKSTACK_SRC_DOC):
     PACKSTACK_DOC = PACKSTACK_SRC_DOC
@@ -30,20 +30,15 @@ class SshTarballTransferMixin(object):
     """
     def _transfer(self, pack_path, pack_dest, res_dir):
         node = self.node
-        args = locals()
-        # copy and extract tarball
-        script = utils.ScriptRunner()
-        script.append("scp %(pack_path)s root@%(node)s:%(pack_dest)s"
-                      % args)
-        script.append("ssh -o StrictHostKeyChecking=no "
-                      "-o UserKnownHostsFile=/dev/null root@%(node)s "
-                      "tar -C %(res_dir)s -xpzf %(pack_dest)s" % args)
-        try:
-            script.execute()
-        except ScriptRuntimeError as ex:
+        # tarball is streamed to the node and extracted on the fly
+        with open(pack_path, 'rb') as pack:
+            rc, out, err = utils.get_transport(node).put_stream(
+                node, 'tar -C %s -xpzf -' % res_dir, pack
+            )
+        if rc:
             # TO-DO: change to appropriate exception
             raise RuntimeError('Failed to copy resources to node %s. '
-                               'Reason: %s' % (node, ex))
+                               'Reason: %s' % (node, err))
 
     def _pack_resources(self):
         randpart = uuid.uuid4().hex[:8]
@@ -362,14 +357,10 @@ class PackstackDrone(SshTarballTransferMixin, Drone):
         recipe_base = os.path.basename(recipe)
         log = os.path.join(self.recipe_dir,
                            recipe_base.replace(".finished", ".log"))
-        local = utils.ScriptRunner()
-        local.append('scp -o StrictHostKeyChecking=no '
-                     '-o UserKnownHostsFile=/dev/null '
-                     'root@%s:%s %s' % (self.node, recipe, log))
         try:
             # once a remote puppet run has finished, we retrieve
             # the log file and check it for errors
-            local.execute(log=False)
+            utils.get_transport(self.node).get_file(self.node, recipe, log)
             # if we got to this point the puppet apply has finished
             return True
         except utils.ScriptRuntimeError as e:
@@ -47,7 +47,8 @@ class Step(object):
 
         # execute and report state
         try:
-            self.function(config, messages)
+            with utils.timing.span(self.title, 'step'):
+                self.function(config, messages)
         except Exception as ex:
             logger.debug(traceback.format_exc())
             state = utils.state_message(self.title, 'ERROR', 'red')
@@ -105,5 +106,6 @@ class Sequence(object):
         if self.title:
             sys.stdout.write('%s\n' % self.title)
             sys.stdout.flush()
-        for step in self.steps.itervalues():
-            step.run(config=config, messages=messages)
+        with utils.timing.span(self.title or self.name, 'sequence'):
+            for step in self.steps.itervalues():
+                step.run(config=config, messages=messages)
@@ -25,6 +25,7 @@ __all__ = (
 
     'NetworkError',
     'ScriptRuntimeError',
+    'MultiHostError',
 )
 
 
@@ -80,6 +81,22 @@ class ScriptRuntimeError(PackStackError):
     pass
 
 
+class MultiHostError(PackStackError):
+    """
+    Raised when utils.run_on_hosts fails on one or more hosts. Attribute
+    errors contains exception raised for each failed host, attribute
+    results contains results of the succeeded ones.
+    """
+    def __init__(self, errors, results=None):
+        msg = '\n'.join(['%s: %s' % (host, err)
+                         for host, err in errors.items()])
+        super(MultiHostError, self).__init__(
+            'Failed on host(s) %s:\n%s' % (', '.join(errors.keys()), msg)
+        )
+        self.errors = errors
+        self.results = results if results is not None else {}
+
+
 class ExecuteRuntimeError(PackStackError):
     """Raised when utils.execute does not end successfully."""
 
@@ -12,7 +12,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import netaddr
 import os
 import uuid
 
@@ -34,6 +33,7 @@ def process_cidr(param, param_name, config=None):
     if '/' not in param:
         # we need to skip this if single IP address has been given
         return param
+    import netaddr
     try:
         return str(netaddr.IPNetwork(param).cidr)
     except Exception as ex:
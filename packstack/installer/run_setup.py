@@ -672,6 +672,9 @@ def remove_remote_var_dirs(options, config, messages):
     Removes the temp directories on remote hosts,
     doesn't remove data on localhost
     """
+    if config.get('DRY_RUN'):
+        # nothing has been created on hosts during dry run
+        return
     for host in filtered_hosts(config):
         try:
             host_dir = config['HOST_DETAILS'][host]['tmpdir']
@@ -697,6 +700,13 @@ def remove_remote_var_dirs(options, config, messages):
             messages.append(utils.color_text(msg, 'red'))
 
 
+def stop_package_cache():
+    """
+    Stops the package cache, which does not outlive this run.
+    """
+    utils.package_cache.stop()
+
+
 def remove_temp_files():
     """
     Removes any temporary files generated during
@@ -712,6 +722,20 @@ def remove_temp_files():
             controller.MESSAGES.append(utils.color_text(msg, 'red'))
 
 
+def write_timing_report():
+    """
+    Writes timing report of this run next to the log file
+    """
+    try:
+        paths = utils.timing.write(basedefs.DIR_LOG)
+    except Exception as e:
+        logging.error('Failed to write timing report.')
+        logging.exception(e)
+        return
+    logging.info('Timing report of this run was written to %s'
+                 % ', '.join(paths))
+
+
 def generateAnswerFile(outputFile, overrides={}):
     sep = os.linesep
     fmt = ("%(comment)s%(separator)s%(conf_name)s=%(default_value)s"
@@ -815,6 +839,15 @@ def initCmdLineParser():
     parser.add_option("-o", "--options", action="store_true", dest="options", help="Print details on options available in answer file(rst format)")
     parser.add_option("-d", "--debug", action="store_true", default=False, help="Enable debug in logging")
     parser.add_option("-y", "--dry-run", action="store_true", default=False, help="Don't execute, just generate manifests")
+    parser.add_option("--max-parallel", type="int", default=utils.parallel.DEFAULT_LIMIT,
+                      help="Maximum number of hosts which are being prepared in parallel, at least 1")
+    parser.add_option("--facts-cache-ttl", type="int", default=86400,
+                      help="Number of seconds for which discovered host facts are reused if the host has not been rebooted, 0 disables the cache")
+    parser.add_option("--transport", type="choice", default="openssh",
+                      choices=sorted(utils.transport.TRANSPORTS),
+                      help="Transport used for running commands on hosts and copying files to them: openssh (default), paramiko or local")
+    parser.add_option("--no-local-shortcut", action="store_true", default=False,
+                      help="Use the transport also for the host running Packstack instead of running commands on it directly")
 
     # For each group, create a group option
     for group in controller.getAllGroups():
@@ -905,7 +938,9 @@ def countCmdLineFlags(options, flag):
     counter = 0
     # make sure only flag was supplied
     for key, value in options.__dict__.items():
-        if key in (flag, 'debug', 'timeout', 'dry_run', 'default_password'):
+        if key in (flag, 'debug', 'timeout', 'dry_run', 'default_password',
+                   'max_parallel', 'facts_cache_ttl', 'transport',
+                   'no_local_shortcut'):
             next
         # If anything but flag was called, increment
         elif value:
@@ -945,6 +980,11 @@ def main():
     options = ""
 
     try:
+        # version is known without loading any plugin
+        if '--version' in sys.argv[1:]:
+            initCmdLineParser().print_version()
+            raise SystemExit
+
         # Load Plugins
         loadPlugins()
         initPluginsConfig()
@@ -959,6 +999,9 @@ def main():
             printOptions()
             raise SystemExit
 
+        if options.max_parallel < 1:
+            raise FlagValidationError('--max-parallel has to be at least 1')
+
         # Initialize logging
         logFile = initLogging(options.debug)
 
@@ -968,6 +1011,11 @@ def main():
 
         controller.CONF['DEFAULT_EXEC_TIMEOUT'] = options.timeout
         controller.CONF['DRY_RUN'] = options.dry_run
+        controller.CONF['MAX_PARALLEL'] = options.max_parallel
+        controller.CONF['FACTS_CACHE_TTL'] = options.facts_cache_ttl
+        controller.CONF['TRANSPORT'] = options.transport
+        utils.set_transport(options.transport,
+                            local_shortcut=not options.no_local_shortcut)
         controller.CONF['DIR_LOG'] = basedefs.DIR_LOG
 
         # If --gen-answer-file was supplied, do not run main
@@ -1022,7 +1070,11 @@ def main():
 
     finally:
         remove_remote_var_dirs(options, controller.CONF, controller.MESSAGES)
+        stop_package_cache()
+        # shut down pooled connections, nothing will be run remotely now
+        utils.close_transports()
         remove_temp_files()
+        write_timing_report()
 
         # Always print user params to log
         _printAdditionalMessages()
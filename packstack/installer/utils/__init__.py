@@ -18,7 +18,12 @@ from .network import get_localhost_ip
 from .network import host2ip
 from .network import force_ip
 from .network import device_from_ip
+from .network import reverse_lookup
+from .parallel import run_on_hosts
+from .pkgcache import PackageCache
+from .pkgcache import package_cache
 from .shell import execute
+from .shell import RemoteFollower
 from .shell import ScriptRunner
 from .shortcuts import host_iter
 from .shortcuts import hosts
@@ -30,12 +35,31 @@ from .strings import color_text
 from .strings import mask_string
 from .strings import state_format
 from .strings import state_message
+from .timing import Timing
+from .timing import timing
+from .transport import Transport
+from .transport import OpenSshTransport
+from .transport import LocalTransport
+from .transport import ParamikoTransport
+from .transport import SshConnectionPool
+from .transport import ssh_command
+from .transport import ssh_pool
+from .transport import get_transport
+from .transport import set_transport
+from .transport import is_local_host
+from .transport import close_transports
 
 
 __all__ = ('SortedDict',
            'retry',
            'get_localhost_ip', 'host2ip', 'force_ip', 'device_from_ip',
-           'ScriptRunner', 'execute',
+           'reverse_lookup',
+           'run_on_hosts', 'PackageCache', 'package_cache',
+           'RemoteFollower', 'ScriptRunner', 'execute',
            'host_iter', 'hosts', 'get_current_user', 'get_current_username',
            'split_hosts', 'COLORS', 'color_text', 'mask_string',
-           'state_format', 'state_message')
+           'state_format', 'state_message', 'Timing', 'timing',
+           'Transport', 'OpenSshTransport', 'LocalTransport',
+           'ParamikoTransport', 'SshConnectionPool', 'ssh_pool',
+           'ssh_command', 'get_transport', 'set_transport', 'is_local_host',
+           'close_transports')
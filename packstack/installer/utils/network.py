@@ -12,12 +12,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-netaddr_available = True
-try:
-    import netaddr
-except ImportError:
-    netaddr_available = False
-
 import re
 import socket
 import logging
@@ -26,10 +20,20 @@ from .shell import execute
 from .shell import ScriptRunner
 
 
+_localhost_ip = []
+
+
 def get_localhost_ip():
     """
-    Returns IP address of localhost.
+    Returns IP address of localhost, it is discovered only once. Plugins
+    use it for default values of many parameters.
     """
+    if not _localhost_ip:
+        _localhost_ip.append(_discover_localhost_ip())
+    return _localhost_ip[0]
+
+
+def _discover_localhost_ip():
     # TO-DO: Will probably need to find better way to find out localhost
     #        address.
 
@@ -95,11 +99,38 @@ def host2ip(hostname, allow_localhost=False):
         raise NetworkError('Unknown error appeared: %s' % repr(ex))
 
 
-def is_ipv6(host):
-    if not netaddr_available:
+_reverse_cache = {}
+
+
+def reverse_lookup(address):
+    """
+    Returns (hostname, aliases, addresses) tuple of given address as
+    returned by socket.gethostbyaddr, results are cached. Addresses without
+    reverse DNS record are returned as (address, [], []).
+    """
+    if address not in _reverse_cache:
+        try:
+            _reverse_cache[address] = socket.gethostbyaddr(address)
+        except (socket.herror, socket.gaierror):
+            _reverse_cache[address] = (address, [], [])
+    return _reverse_cache[address]
+
+
+def _netaddr():
+    """
+    Returns netaddr module, it is imported only when first needed.
+    """
+    try:
+        import netaddr
+    except ImportError:
         raise ImportError(
             "netaddr module unavailable, install with pip install netaddr"
         )
+    return netaddr
+
+
+def is_ipv6(host):
+    netaddr = _netaddr()
     host = host.strip()
     try:
         return netaddr.IPAddress(host.strip('[]')).version == 6
@@ -109,10 +140,7 @@ def is_ipv6(host):
 
 
 def is_ipv4(host):
-    if not netaddr_available:
-        raise ImportError(
-            "netaddr module unavailable, install with pip install netaddr"
-        )
+    netaddr = _netaddr()
     host = host.strip()
     try:
         return netaddr.IPAddress(host).version == 4
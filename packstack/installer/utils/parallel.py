@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import Queue
+import threading
+import traceback
+
+from ..exceptions import MultiHostError
+from .datastructures import SortedDict
+
+
+DEFAULT_LIMIT = 16
+
+
+def run_on_hosts(func, hosts, limit=None):
+    """
+    Runs func(host) for every host in hosts using at most limit worker
+    threads. Returns SortedDict of results keyed by host in the order
+    in which hosts were given. If func raised exception on any host,
+    MultiHostError containing errors of all failed hosts and results
+    of the others is raised after all hosts are processed.
+    """
+    hosts = list(hosts)
+    limit = limit if limit is not None else DEFAULT_LIMIT
+    if limit < 1:
+        raise ValueError('Limit has to be positive number.')
+
+    queue = Queue.Queue()
+    for host in hosts:
+        queue.put(host)
+    results = {}
+    errors = {}
+
+    def worker():
+        while True:
+            try:
+                host = queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[host] = func(host)
+            except Exception as ex:
+                logging.debug('Failed to run %s on host %s:\n%s' %
+                              (getattr(func, '__name__', func), host,
+                               traceback.format_exc()))
+                errors[host] = ex
+
+    workers = []
+    for i in range(min(limit, len(hosts))):
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+        workers.append(thread)
+    for thread in workers:
+        # join with timeout, so that KeyboardInterrupt is not blocked
+        while thread.is_alive():
+            thread.join(0.5)
+
+    ordered = SortedDict([(host, results[host])
+                          for host in hosts if host in results])
+    if errors:
+        raise MultiHostError(SortedDict([(host, errors[host])
+                                         for host in hosts
+                                         if host in errors]),
+                             results=ordered)
+    return ordered
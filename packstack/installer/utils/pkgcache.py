@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import BaseHTTPServer
+import errno
+import logging
+import os
+import re
+import select
+import shutil
+import socket
+import SocketServer
+import tempfile
+import threading
+import urllib2
+import urlparse
+
+
+# packages and checksum named repository metadata never change their
+# content, everything else (repomd.xml, mirror lists, ...) is passed
+# through
+re_cacheable = re.compile(r'(\.d?rpm|/repodata/[0-9a-f]{32,}-[^/]+)$')
+
+# hosts fetch packages through the cache only if they can reach it and do
+# not use a proxy of their own; the proxy is passed to each yum run instead
+# of being written to yum.conf, so nothing is left behind on hosts
+YUM_PROXY_MARKER = '##packstack-package-cache'
+YUM_PROXY_CHECK = ("if grep -q '^proxy=' /etc/yum.conf; then "
+                   "echo 'yum uses proxy configured on the host'; "
+                   "elif curl -sf -m 10 -o /dev/null %(url)s/; then "
+                   "echo '%(marker)s'; "
+                   "else echo 'Package cache %(url)s is not reachable'; fi")
+
+CHUNK_SIZE = 64 * 1024
+# HTTPS is tunneled only to the standard port, so the cache cannot be used
+# as a relay to arbitrary services
+CONNECT_PORTS = ('443',)
+
+
+class _ProxyServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _ProxyServer6(_ProxyServer):
+    address_family = socket.AF_INET6
+
+
+class _ProxyHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.0'
+    # headers relayed between client and upstream
+    request_headers = ('Range', 'If-Modified-Since', 'Accept')
+    response_headers = ('Content-Type', 'Content-Length', 'Content-Range',
+                        'Last-Modified', 'ETag')
+
+    def log_message(self, fmt, *args):
+        logging.debug('Package cache: %s' % (fmt % args))
+
+    def _check_client(self):
+        """
+        Returns True if the client is one of deployment hosts, otherwise
+        answers with an error and returns False.
+        """
+        if self.server.cache.is_client(self.client_address[0]):
+            return True
+        self.send_error(403, 'Not a deployment host')
+        return False
+
+    def do_GET(self):
+        if not self._check_client():
+            return
+        cache = self.server.cache
+        url = self.path
+        if not url.startswith('http://'):
+            # health check of the cache itself
+            self._send_headers(200, {'Content-Type': 'text/plain'})
+            if self.command != 'HEAD':
+                self.wfile.write('packstack package cache\n')
+            return
+        path = cache.cache_path(url)
+        if path is None or self.command != 'GET':
+            self._pass_through(url)
+            return
+        # lock is held only while the file is being fetched, file in place
+        # is complete as it is renamed there when fully downloaded, so it
+        # is served to all hosts in parallel
+        if not os.path.isfile(path):
+            with cache.lock_for(path):
+                if not os.path.isfile(path):
+                    cache.miss()
+                    self._fetch(url, path)
+                    return
+        cache.hit()
+        self._send_file(path)
+
+    do_HEAD = do_GET
+
+    def do_CONNECT(self):
+        # HTTPS is tunneled as it is, no caching is possible there
+        if not self._check_client():
+            return
+        host, sep, port = self.path.rpartition(':')
+        if port not in CONNECT_PORTS:
+            self.send_error(403, 'Tunneling is allowed only to port(s) %s'
+                            % ', '.join(CONNECT_PORTS))
+            return
+        try:
+            upstream = socket.create_connection((host, int(port)), 30)
+        except (socket.error, ValueError) as ex:
+            self.send_error(502, str(ex))
+            return
+        self.send_response(200, 'Connection established')
+        self.end_headers()
+        sockets = [self.connection, upstream]
+        try:
+            while True:
+                readable, _, broken = select.select(sockets, [], sockets, 60)
+                if broken or not readable:
+                    break
+                for sock in readable:
+                    data = sock.recv(CHUNK_SIZE)
+                    if not data:
+                        return
+                    other = upstream if sock is self.connection else \
+                        self.connection
+                    other.sendall(data)
+        except socket.error:
+            pass
+        finally:
+            upstream.close()
+            self.close_connection = 1
+
+    def _send_headers(self, code, headers):
+        self.send_response(code)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+
+    def _send_file(self, path):
+        self._send_headers(200, {
+            'Content-Type': 'application/octet-stream',
+            'Content-Length': os.path.getsize(path),
+        })
+        with open(path, 'rb') as fp:
+            shutil.copyfileobj(fp, self.wfile, CHUNK_SIZE)
+
+    def _open(self, url, relay=()):
+        headers = dict([(key, self.headers[key])
+                        for key in relay if key in self.headers])
+        request = urllib2.Request(url, headers=headers)
+        if self.command == 'HEAD':
+            request.get_method = lambda: 'HEAD'
+        try:
+            return urllib2.urlopen(request, timeout=60)
+        except urllib2.HTTPError as ex:
+            # error responses are relayed to the client as they are
+            return ex
+        except (urllib2.URLError, socket.error) as ex:
+            self.send_error(502, str(getattr(ex, 'reason', ex)))
+
+    def _relay_headers(self, response):
+        headers = dict([(key, response.info()[key])
+                        for key in self.response_headers
+                        if key in response.info()])
+        self._send_headers(response.getcode(), headers)
+
+    def _pass_through(self, url):
+        response = self._open(url, self.request_headers)
+        if response is None:
+            return
+        try:
+            self._relay_headers(response)
+            if self.command != 'HEAD':
+                shutil.copyfileobj(response, self.wfile, CHUNK_SIZE)
+        finally:
+            response.close()
+
+    def _fetch(self, url, path):
+        # range requests are answered by whole file to fill the cache
+        response = self._open(url)
+        if response is None:
+            return
+        try:
+            if response.getcode() != 200:
+                self._relay_headers(response)
+                shutil.copyfileobj(response, self.wfile, CHUNK_SIZE)
+                return
+            self._relay_headers(response)
+            directory = os.path.dirname(path)
+            if not os.path.isdir(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError as ex:
+                    if ex.errno != errno.EEXIST:
+                        raise
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.part')
+            client = self.wfile
+            try:
+                with os.fdopen(fd, 'wb') as tmp:
+                    for chunk in iter(lambda: response.read(CHUNK_SIZE), ''):
+                        tmp.write(chunk)
+                        if client is None:
+                            continue
+                        try:
+                            client.write(chunk)
+                        except socket.error:
+                            # client went away, but we still fill the cache
+                            # for the other hosts
+                            client = None
+                os.rename(tmp_path, path)
+            except Exception:
+                os.unlink(tmp_path)
+                raise
+        finally:
+            response.close()
+
+
+class PackageCache(object):
+    """
+    Caching HTTP proxy running on the deploy host. Hosts fetch packages
+    through it, so that each package is downloaded from upstream mirror
+    only once per deployment and not at all on repeated deployments.
+    Concurrent requests for the same package wait for the one download.
+    Only hosts added by add_client are served.
+    """
+
+    def __init__(self):
+        self.cache_dir = None
+        self.url = None
+        self.clients = set()
+        self.addresses = set()
+        self.hits = 0
+        self.misses = 0
+        self._server = None
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._server is not None
+
+    def start(self, address, port, cache_dir):
+        """
+        Starts serving on given address and port in a background thread
+        and returns URL of the proxy.
+        """
+        if self.running:
+            return self.url
+        self.cache_dir = cache_dir
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, 0o700)
+        server_cls = _ProxyServer6 if ':' in address else _ProxyServer
+        self._server = server_cls((address, int(port)), _ProxyHandler)
+        self._server.cache = self
+        port = self._server.server_address[1]
+        host = '[%s]' % address if ':' in address else address
+        self.url = 'http://%s:%d' % (host, port)
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        logging.debug('Package cache is listening on %s' % self.url)
+        return self.url
+
+    def stop(self):
+        """
+        Stops serving. Cached packages are kept for next runs.
+        """
+        if not self.running:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+        logging.debug('Package cache served %d package(s) from cache, '
+                      '%d from upstream' % (self.hits, self.misses))
+
+    def add_client(self, host):
+        """
+        Allows given deployment host to use the cache.
+        """
+        try:
+            addresses = set(info[4][0] for info in
+                            socket.getaddrinfo(host, None))
+        except socket.gaierror:
+            addresses = set([host])
+        with self._lock:
+            self.clients.add(host)
+            self.addresses.update(addresses)
+
+    def is_client(self, address):
+        """
+        Returns True if given address belongs to one of deployment hosts.
+        """
+        if address.startswith('::ffff:') and '.' in address:
+            # IPv4 client connected to IPv6 socket
+            address = address[len('::ffff:'):]
+        with self._lock:
+            return address in self.addresses
+
+    def yum_check_command(self):
+        """
+        Returns shell command checking whether yum on a host can use the
+        cache, its output is then passed to is_usable.
+        """
+        return YUM_PROXY_CHECK % {'url': self.url, 'marker': YUM_PROXY_MARKER}
+
+    def is_usable(self, output):
+        """
+        Returns True if output of yum_check_command says the cache can be
+        used.
+        """
+        return YUM_PROXY_MARKER in output.splitlines()
+
+    def yum_options(self):
+        """
+        Returns list of yum options making it fetch packages through the
+        cache.
+        """
+        return ['--setopt=proxy=%s' % self.url]
+
+    def cache_path(self, url):
+        """
+        Returns path in cache for given URL or None if the URL should not
+        be cached.
+        """
+        parsed = urlparse.urlsplit(url)
+        if parsed.query or not re_cacheable.search(parsed.path):
+            return None
+        parts = [p for p in parsed.path.split('/') if p not in ('', '.', '..')]
+        return os.path.join(self.cache_dir, parsed.netloc.replace(':', '_'),
+                            *parts)
+
+    def lock_for(self, path):
+        with self._lock:
+            return self._locks.setdefault(path, threading.Lock())
+
+    def hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+
+
+package_cache = PackageCache()
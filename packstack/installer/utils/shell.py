@@ -16,12 +16,15 @@ import re
 import os
 import types
 import logging
+import threading
 import subprocess
 
 from ..exceptions import ExecuteRuntimeError
 from ..exceptions import NetworkError
 from ..exceptions import ScriptRuntimeError
 from .strings import mask_string
+from .timing import timing
+from .transport import get_transport
 
 
 block_fmt = ("\n============= %(title)s ==========\n%(content)s\n"
@@ -70,6 +73,68 @@ def execute(cmd, workdir=None, can_fail=True, mask_list=None,
     return proc.returncode, out
 
 
+class RemoteFollower(object):
+    """
+    Follows file on remote host over one long-lived ssh channel. Every line
+    appended to the file is put to given queue as (host, line) tuple, end of
+    the stream is signalled by (host, None) tuple. Lines already present in
+    the file when the follower starts are reported too.
+    """
+    _cmd = ('touch %(path)s; tail -n +1 -F %(path)s 2> /dev/null & '
+            'pid=$!; cat > /dev/null; kill $pid')
+
+    def __init__(self, host, path, queue):
+        self.host = host
+        self.path = path
+        self.queue = queue
+        self.alive = False
+        self._proc = None
+        self._reader = None
+        self._remote = True
+
+    def start(self):
+        # remote tail is killed once our end of stdin gets closed
+        transport = get_transport(self.host)
+        self._remote = transport.remote
+        self._proc = transport.spawn(self.host,
+                                     self._cmd % {'path': self.path})
+        self.alive = True
+        self._reader = threading.Thread(target=self._read)
+        self._reader.daemon = True
+        self._reader.start()
+
+    def _read(self):
+        received = 0
+        try:
+            for line in iter(self._proc.stdout.readline, ''):
+                received += len(line)
+                line = line.strip()
+                if line:
+                    self.queue.put((self.host, line))
+        finally:
+            if self._remote:
+                timing.count_ssh(self.host, received=received,
+                                 round_trips=0)
+            self.alive = False
+            self.queue.put((self.host, None))
+
+    def stop(self):
+        """
+        Stops following the remote file.
+        """
+        if self._proc is None:
+            return
+        try:
+            self._proc.stdin.close()
+        except IOError:
+            pass
+        self._reader.join(5)
+        if self._proc.poll() is None:
+            self._proc.terminate()
+        self._proc.wait()
+        self._proc = None
+
+
 class ScriptRunner(object):
     _pkg_search = 'rpm -q --whatprovides'
 
@@ -93,27 +158,18 @@ class ScriptRunner(object):
             logging.info("[%s] Executing script:\n%s" %
                          (self.ip or 'localhost', masked))
 
-        _PIPE = subprocess.PIPE  # pylint: disable=E1101
-        if self.ip:
-            cmd = ["ssh", "-o", "StrictHostKeyChecking=no",
-                          "-o", "UserKnownHostsFile=/dev/null",
-                          "root@%s" % self.ip, "bash -x"]
-        else:
-            cmd = ["bash", "-x"]
-        environ = os.environ
-        environ['LANG'] = 'en_US.UTF8'
-        obj = subprocess.Popen(cmd, stdin=_PIPE, stdout=_PIPE, stderr=_PIPE,
-                               close_fds=True, shell=False, env=environ)
-
         script = "function t(){ exit $? ; } \n trap t ERR \n" + script
-        out, err = obj.communicate(script)
+        category = 'remote' if self.ip else 'local'
+        with timing.span(masked.split('\n', 1)[0][:80], category,
+                         host=self.ip, commands=len(self.script)):
+            rc, out, err = get_transport(self.ip).run_script(self.ip, script)
         masked_out = mask_string(out, mask_list, repl_list)
         masked_err = mask_string(err, mask_list, repl_list)
         if log:
             logging.debug(block_fmt % {'title': 'STDOUT',
                                        'content': masked_out})
 
-        if obj.returncode:
+        if rc:
             if log:
                 logging.debug(block_fmt % {'title': 'STDERR',
                                            'content': masked_err})
@@ -126,7 +182,7 @@ class ScriptRunner(object):
                            'stdout: %s\nstderr: %s' %
                            (masked_out, masked_err))
                     raise ScriptRuntimeError(msg, stdout=out, stderr=err)
-        return obj.returncode, out
+        return rc, out
 
     def template(self, src, dst, varsdict):
         with open(src) as fp:
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+
+REPORT_FILE = 'timing.json'
+TRACE_FILE = 'timing.trace.json'
+
+
+class Timing(object):
+    """
+    Collects wall time spans of sequences, steps, remote commands and
+    puppet runs together with per-host SSH round trip and traffic counters.
+    Collected data can be written as JSON report and as trace file loadable
+    by chrome://tracing or Perfetto.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.origin = time.time()
+        self.spans = []
+        self.ssh = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, category, start, end, host=None, lane=None,
+            **args):
+        """
+        Records span which started and ended at given times. Spans are
+        shown in lanes of the threads which recorded them unless other lane
+        is given.
+        """
+        span = {'name': name, 'category': category,
+                'start': start - self.origin, 'duration': end - start,
+                'host': host,
+                'lane': lane or threading.current_thread().name}
+        if args:
+            span['args'] = args
+        with self._lock:
+            self.spans.append(span)
+
+    @contextlib.contextmanager
+    def span(self, name, category, host=None, lane=None, **args):
+        """
+        Records span of the wrapped block, failed blocks are recorded
+        with status 'error'.
+        """
+        start = time.time()
+        status = 'ok'
+        try:
+            yield
+        except BaseException:
+            status = 'error'
+            raise
+        finally:
+            self.add(name, category, start, time.time(), host=host,
+                     lane=lane, status=status, **args)
+
+    def count_ssh(self, host, sent=0, received=0, round_trips=1):
+        """
+        Adds SSH round trips and bytes transferred to/from given host.
+        """
+        with self._lock:
+            counters = self.ssh.setdefault(host, {'round_trips': 0,
+                                                  'bytes_sent': 0,
+                                                  'bytes_received': 0})
+            counters['round_trips'] += round_trips
+            counters['bytes_sent'] += sent
+            counters['bytes_received'] += received
+
+    def count(self, name, value=1):
+        """
+        Adds value to named counter, e.g. cache hits.
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self):
+        """
+        Returns dict with all recorded spans ordered by start time, SSH
+        counters, other counters and total time spent in each category.
+        """
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span['start'])
+            ssh = dict((host, dict(counters))
+                       for host, counters in self.ssh.items())
+            counters = dict(self.counters)
+        totals = {}
+        for span in spans:
+            totals[span['category']] = (totals.get(span['category'], 0) +
+                                        span['duration'])
+        return {'started': self.origin,
+                'duration': time.time() - self.origin,
+                'totals': totals,
+                'ssh': ssh,
+                'counters': counters,
+                'spans': spans}
+
+    def chrome_trace(self):
+        """
+        Returns recorded spans in Trace Event Format.
+        """
+        lanes = {}
+        events = []
+        for span in self.report()['spans']:
+            if span['lane'] not in lanes:
+                lanes[span['lane']] = len(lanes) + 1
+                events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1,
+                               'tid': lanes[span['lane']],
+                               'args': {'name': span['lane']}})
+            args = dict(span.get('args', {}))
+            if span['host']:
+                args['host'] = span['host']
+            events.append({'name': span['name'], 'cat': span['category'],
+                           'ph': 'X', 'pid': 1, 'tid': lanes[span['lane']],
+                           'ts': int(span['start'] * 1e6),
+                           'dur': int(span['duration'] * 1e6),
+                           'args': args})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write(self, directory):
+        """
+        Writes JSON report and trace file to given directory and returns
+        their paths.
+        """
+        paths = []
+        for filename, data in ((REPORT_FILE, self.report()),
+                               (TRACE_FILE, self.chrome_trace())):
+            path = os.path.join(directory, filename)
+            with open(path, 'w') as fp:
+                json.dump(data, fp, indent=1, sort_keys=True)
+            paths.append(path)
+        return paths
+
+
+timing = Timing()
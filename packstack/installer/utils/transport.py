@@ -0,0 +1,644 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import logging
+import os
+import pipes
+import re
+import shutil
+import socket
+import StringIO
+import subprocess
+import tempfile
+import threading
+import time
+
+from ..exceptions import NetworkError
+from ..exceptions import ScriptRuntimeError
+from .timing import timing
+
+try:
+    import paramiko
+except ImportError:
+    paramiko = None
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _environ():
+    environ = dict(os.environ)
+    environ['LANG'] = 'en_US.UTF8'
+    return environ
+
+
+class SshConnectionPool(object):
+    """
+    Keeps one multiplexed OpenSSH master connection (ControlMaster) per
+    host, so that every ssh/scp call to the host after the first one skips
+    the TCP and key exchange handshakes. Masters are started lazily on first
+    use, health-checked from time to time and stopped by close_all().
+    """
+    _base_opts = ["-o", "StrictHostKeyChecking=no",
+                  "-o", "UserKnownHostsFile=/dev/null"]
+
+    def __init__(self, persist=900, check_interval=30):
+        self.persist = persist
+        self.check_interval = check_interval
+        self._control_dir = None
+        # host -> {'path': control socket, 'alive': bool, 'checked': time}
+        self._masters = {}
+        self._host_locks = {}
+        self._lock = threading.Lock()
+
+    def _host_lock(self, host):
+        with self._lock:
+            if self._control_dir is None:
+                self._control_dir = tempfile.mkdtemp(prefix='packstack-ssh-')
+            return self._host_locks.setdefault(host, threading.Lock())
+
+    def _run(self, args):
+        devnull = open(os.devnull, 'r+')
+        try:
+            proc = subprocess.Popen(args, stdin=devnull, stdout=devnull,
+                                    stderr=devnull, close_fds=True)
+            proc.communicate()
+        finally:
+            devnull.close()
+        return proc.returncode
+
+    def control_path(self, host):
+        """
+        Returns path to the control socket of given host's master
+        connection.
+        """
+        name = hashlib.sha1(host).hexdigest()[:16]
+        return os.path.join(self._control_dir, name)
+
+    def _start(self, host, path):
+        if os.path.exists(path):
+            # stale socket left behind by a dead master
+            os.unlink(path)
+        timing.count_ssh(host)
+        rc = self._run(["ssh"] + self._base_opts +
+                       ["-o", "ControlMaster=yes",
+                        "-o", "ControlPath=%s" % path,
+                        "-o", "ControlPersist=%d" % self.persist,
+                        "-N", "-f", "root@%s" % host])
+        if rc:
+            logging.debug('Failed to start SSH master connection to %s, '
+                          'falling back to direct connections.' % host)
+        return rc == 0
+
+    def check(self, host):
+        """
+        Returns True if master connection to given host is alive.
+        """
+        master = self._masters.get(host)
+        if not master:
+            return False
+        rc = self._run(["ssh", "-o", "ControlPath=%s" % master['path'],
+                        "-O", "check", "root@%s" % host])
+        return rc == 0
+
+    def options(self, host):
+        """
+        Returns list of ssh command line options which make ssh/scp reuse
+        the master connection to given host. Master is (re)started if it
+        does not exist yet or if it did not pass the health check.
+        """
+        with self._host_lock(host):
+            master = self._masters.get(host)
+            now = time.time()
+            if master is None:
+                path = self.control_path(host)
+                master = {'path': path, 'alive': self._start(host, path),
+                          'checked': now}
+                self._masters[host] = master
+            elif now - master['checked'] > self.check_interval:
+                if not (master['alive'] and self.check(host)):
+                    master['alive'] = self._start(host, master['path'])
+                master['checked'] = now
+        if not master['alive']:
+            return []
+        return ["-o", "ControlPath=%s" % master['path']]
+
+    def close(self, host):
+        """
+        Stops master connection to given host.
+        """
+        with self._host_lock(host):
+            master = self._masters.pop(host, None)
+            if master and master['alive']:
+                self._run(["ssh", "-o", "ControlPath=%s" % master['path'],
+                           "-O", "exit", "root@%s" % host])
+
+    def close_all(self):
+        """
+        Stops all master connections and removes their control sockets.
+        """
+        for host in list(self._masters.keys()):
+            self.close(host)
+        with self._lock:
+            if self._control_dir:
+                shutil.rmtree(self._control_dir, ignore_errors=True)
+                self._control_dir = None
+
+
+ssh_pool = SshConnectionPool()
+
+
+def ssh_command(host, command, pool=None):
+    """
+    Returns argument list of ssh command running command on given host
+    over pooled connection.
+    """
+    cmd = ["ssh", "-o", "StrictHostKeyChecking=no",
+                  "-o", "UserKnownHostsFile=/dev/null"]
+    cmd.extend((pool or ssh_pool).options(host))
+    cmd.extend(["root@%s" % host, command])
+    return cmd
+
+
+class Transport(object):
+    """
+    Base class of transports used to run commands on hosts and to move
+    data to and from them. Transports count SSH round trips and bytes
+    transferred for the timing report.
+    """
+    name = None
+    remote = True
+
+    def run_script(self, host, script):
+        """
+        Runs given bash script on host and returns tuple of return code,
+        stdout and stderr.
+        """
+        rc, out, err = self._run(host, 'bash -x', script)
+        if self.remote:
+            timing.count_ssh(host, sent=len(script),
+                             received=len(out) + len(err))
+        return rc, out, err
+
+    def put_stream(self, host, command, stream):
+        """
+        Runs given command on host with content of file object stream as
+        its standard input. Returns tuple of return code, stdout and
+        stderr.
+        """
+        counter = _CountingReader(stream)
+        rc, out, err = self._run(host, command, counter)
+        if self.remote:
+            timing.count_ssh(host, sent=counter.count,
+                             received=len(out) + len(err))
+        return rc, out, err
+
+    def put_file(self, host, local_path, remote_path):
+        """
+        Copies local file to given path on host. Raises ScriptRuntimeError
+        on failure.
+        """
+        with open(local_path, 'rb') as stream:
+            rc, out, err = self.put_stream(
+                host, 'cat > %s' % pipes.quote(remote_path), stream
+            )
+        if rc:
+            raise ScriptRuntimeError('Failed to copy %s to %s:%s: %s'
+                                     % (local_path, host, remote_path, err),
+                                     stdout=out, stderr=err)
+
+    def get_file(self, host, remote_path, local_path):
+        """
+        Copies file from host to local path. Raises ScriptRuntimeError if
+        the file could not be retrieved.
+        """
+        with open(local_path, 'wb') as target:
+            rc, err = self._get(host, remote_path, target)
+        if rc:
+            os.unlink(local_path)
+            raise ScriptRuntimeError('Failed to retrieve %s:%s: %s'
+                                     % (host, remote_path, err), stderr=err)
+        if self.remote:
+            timing.count_ssh(host, received=os.path.getsize(local_path))
+
+    def spawn(self, host, command):
+        """
+        Starts long running command on host, typically tail following
+        a remote file. Returns process-like object with stdin and stdout
+        pipes and poll, wait and terminate methods.
+        """
+        if self.remote:
+            timing.count_ssh(host)
+        return self._spawn(host, command)
+
+    def close(self, host):
+        """
+        Closes connections to given host.
+        """
+
+    def close_all(self):
+        """
+        Closes all connections.
+        """
+
+    def _run(self, host, command, stdin):
+        proc = subprocess.Popen(self._command(host, command),
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, close_fds=True,
+                                env=_environ())
+        if isinstance(stdin, basestring):
+            out, err = proc.communicate(stdin)
+            return proc.returncode, out, err
+
+        # stream input without holding it whole in memory
+        output = {}
+
+        def read(name):
+            output[name] = getattr(proc, name).read()
+
+        readers = [threading.Thread(target=read, args=(name,))
+                   for name in ('stdout', 'stderr')]
+        for reader in readers:
+            reader.daemon = True
+            reader.start()
+        _pump(stdin, proc.stdin)
+        for reader in readers:
+            reader.join()
+        return proc.wait(), output['stdout'], output['stderr']
+
+    def _get(self, host, remote_path, target):
+        devnull = open(os.devnull)
+        try:
+            proc = subprocess.Popen(
+                self._command(host, 'cat %s' % pipes.quote(remote_path)),
+                stdin=devnull, stdout=target, stderr=subprocess.PIPE,
+                close_fds=True, env=_environ()
+            )
+            out, err = proc.communicate()
+        finally:
+            devnull.close()
+        return proc.returncode, err
+
+    def _spawn(self, host, command):
+        devnull = open(os.devnull, 'w')
+        try:
+            return subprocess.Popen(self._command(host, command),
+                                    stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE, stderr=devnull,
+                                    close_fds=True, env=_environ())
+        finally:
+            devnull.close()
+
+    def _command(self, host, command):
+        raise NotImplementedError()
+
+
+class OpenSshTransport(Transport):
+    """
+    Runs ssh client as subprocess over pooled master connections.
+    """
+    name = 'openssh'
+
+    def __init__(self, pool=None):
+        self.pool = pool or ssh_pool
+
+    def _command(self, host, command):
+        return ssh_command(host, command, pool=self.pool)
+
+    def close(self, host):
+        self.pool.close(host)
+
+    def close_all(self):
+        self.pool.close_all()
+
+
+class LocalTransport(Transport):
+    """
+    Runs commands locally, usable for the host running Packstack when
+    Packstack runs as root.
+    """
+    name = 'local'
+    remote = False
+
+    def _command(self, host, command):
+        if command == 'bash -x':
+            return ['bash', '-x']
+        return ['bash', '-c', command]
+
+    def put_stream(self, host, command, stream):
+        try:
+            stream.fileno()
+        except (AttributeError, IOError):
+            return super(LocalTransport, self).put_stream(host, command,
+                                                          stream)
+        # real files are read by the command directly
+        proc = subprocess.Popen(self._command(host, command), stdin=stream,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, close_fds=True,
+                                env=_environ())
+        out, err = proc.communicate()
+        return proc.returncode, out, err
+
+    def put_file(self, host, local_path, remote_path):
+        try:
+            if os.path.lexists(remote_path):
+                os.unlink(remote_path)
+            os.link(local_path, remote_path)
+        except OSError:
+            # different file system or no permission to link
+            try:
+                shutil.copy2(local_path, remote_path)
+            except (IOError, OSError) as ex:
+                raise ScriptRuntimeError('Failed to copy %s to %s: %s'
+                                         % (local_path, remote_path, ex))
+
+    def _get(self, host, remote_path, target):
+        try:
+            with open(remote_path, 'rb') as source:
+                shutil.copyfileobj(source, target, CHUNK_SIZE)
+        except IOError as ex:
+            return 1, str(ex)
+        return 0, ''
+
+
+class ParamikoTransport(Transport):
+    """
+    Runs commands over in-process SSH connections (paramiko), one pooled
+    connection per host. Every command is run in separate channel of the
+    connection, so no process is forked locally.
+    """
+    name = 'paramiko'
+
+    def __init__(self, username='root', timeout=30):
+        if paramiko is None:
+            raise ImportError(
+                "paramiko module unavailable, install with "
+                "pip install paramiko"
+            )
+        self.username = username
+        self.timeout = timeout
+        self._clients = {}
+        self._host_locks = {}
+        self._lock = threading.Lock()
+
+    def _client(self, host):
+        with self._lock:
+            lock = self._host_locks.setdefault(host, threading.Lock())
+        with lock:
+            client = self._clients.get(host)
+            transport = client and client.get_transport()
+            if transport is None or not transport.is_active():
+                timing.count_ssh(host)
+                client = paramiko.SSHClient()
+                # equivalent of StrictHostKeyChecking=no used with OpenSSH
+                client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+                try:
+                    client.connect(host, username=self.username,
+                                   timeout=self.timeout)
+                except (paramiko.SSHException, socket.error) as ex:
+                    raise NetworkError('Failed to connect to %s: %s'
+                                       % (host, ex))
+                self._clients[host] = client
+            return client
+
+    def _channel(self, host, command):
+        try:
+            channel = self._client(host).get_transport().open_session()
+            channel.exec_command(command)
+        except (paramiko.SSHException, socket.error) as ex:
+            raise NetworkError('Failed to run command on %s: %s'
+                               % (host, ex))
+        return channel
+
+    def _run(self, host, command, stdin):
+        if isinstance(stdin, basestring):
+            stdin = StringIO.StringIO(stdin)
+        channel = self._channel(host, command)
+        err = []
+
+        def write():
+            try:
+                _pump(stdin, _ChannelStdin(channel))
+            except socket.error:
+                pass
+
+        def read_err():
+            err.extend(iter(lambda: channel.recv_stderr(CHUNK_SIZE), ''))
+
+        threads = [threading.Thread(target=write),
+                   threading.Thread(target=read_err)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        out = ''.join(iter(lambda: channel.recv(CHUNK_SIZE), ''))
+        for thread in threads:
+            thread.join()
+        rc = channel.recv_exit_status()
+        channel.close()
+        return rc, out, ''.join(err)
+
+    def _get(self, host, remote_path, target):
+        channel = self._channel(host, 'cat %s' % pipes.quote(remote_path))
+        channel.shutdown_write()
+        for chunk in iter(lambda: channel.recv(CHUNK_SIZE), ''):
+            target.write(chunk)
+        err = ''.join(iter(lambda: channel.recv_stderr(CHUNK_SIZE), ''))
+        rc = channel.recv_exit_status()
+        channel.close()
+        return rc, err
+
+    def _spawn(self, host, command):
+        return _ChannelProcess(self._channel(host, command))
+
+    def close(self, host):
+        client = self._clients.pop(host, None)
+        if client is not None:
+            client.close()
+
+    def close_all(self):
+        for host in list(self._clients.keys()):
+            self.close(host)
+
+
+class _ChannelStdin(object):
+    """
+    Write end of channel, closing it sends EOF to the remote command.
+    """
+    def __init__(self, channel):
+        self.channel = channel
+
+    def write(self, data):
+        self.channel.sendall(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.channel.shutdown_write()
+
+
+class _ChannelProcess(object):
+    """
+    subprocess.Popen lookalike of command running in paramiko channel.
+    """
+    def __init__(self, channel):
+        self.channel = channel
+        self.stdin = _ChannelStdin(channel)
+        self.stdout = channel.makefile('rb')
+        self.returncode = None
+
+    def poll(self):
+        if self.returncode is None and self.channel.exit_status_ready():
+            self.returncode = self.channel.recv_exit_status()
+        return self.returncode
+
+    def wait(self):
+        if self.returncode is None:
+            self.returncode = self.channel.recv_exit_status()
+        return self.returncode
+
+    def terminate(self):
+        self.channel.close()
+
+
+class _CountingReader(object):
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.count += len(data)
+        return data
+
+
+def _pump(source, target):
+    try:
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), ''):
+            target.write(chunk)
+    except IOError:
+        # remote command exited without reading all of its input
+        pass
+    finally:
+        try:
+            target.close()
+        except IOError:
+            pass
+
+
+TRANSPORTS = {
+    'openssh': OpenSshTransport,
+    'paramiko': ParamikoTransport,
+    'local': LocalTransport,
+}
+_transport = OpenSshTransport()
+_local = LocalTransport()
+# when True, commands for the host running Packstack are run locally
+_local_shortcut = True
+_local_hosts = {}
+_local_addresses = None
+_local_lock = threading.Lock()
+# address of each interface in output of 'ip -o addr'
+re_ip_addr = re.compile(r'\binet6?\s+([0-9a-fA-F.:]+)(?:/\d+)?')
+
+
+def set_transport(name, local_shortcut=True):
+    """
+    Makes transport of given name used for all hosts. Unless local_shortcut
+    is False, the host running Packstack is reached by local transport
+    whenever Packstack runs as root.
+    """
+    global _transport, _local_shortcut
+    if name not in TRANSPORTS:
+        raise ValueError('Unknown transport %s, use one of: %s'
+                         % (name, ', '.join(sorted(TRANSPORTS))))
+    if _transport.name != name:
+        _transport.close_all()
+        _transport = TRANSPORTS[name]()
+    _local_shortcut = local_shortcut
+
+
+def is_local_host(host):
+    """
+    Returns True if given host address belongs to this machine, i.e. it is
+    a loopback address or it is assigned to one of the machine's network
+    interfaces. Results are cached.
+    """
+    global _local_addresses
+    with _local_lock:
+        if host not in _local_hosts:
+            if _local_addresses is None:
+                _local_addresses = interface_addresses()
+            _local_hosts[host] = any(
+                _is_loopback(address) or address in _local_addresses
+                for address in _resolve(host)
+            )
+        return _local_hosts[host]
+
+
+def interface_addresses():
+    """
+    Returns set of addresses assigned to network interfaces of this
+    machine as listed by 'ip -o addr'.
+    """
+    try:
+        proc = subprocess.Popen(['ip', '-o', 'addr'], stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, close_fds=True)
+        out, err = proc.communicate()
+    except OSError:
+        return set()
+    if proc.returncode:
+        return set()
+    return set(_normalize(match.group(1))
+               for match in re_ip_addr.finditer(out))
+
+
+def _resolve(host):
+    host = host.strip('[]')
+    try:
+        return set(_normalize(info[4][0])
+                   for info in socket.getaddrinfo(host, None))
+    except socket.error:
+        return set()
+
+
+def _normalize(address):
+    # link-local addresses may carry zone index
+    return address.split('%', 1)[0].lower()
+
+
+def _is_loopback(address):
+    return address.startswith('127.') or address == '::1'
+
+
+def get_transport(host=None):
+    """
+    Returns transport used for given host, commands without host and
+    commands for the host running Packstack are run locally.
+    """
+    if not host:
+        return _local
+    if (_local_shortcut and _transport.remote and os.geteuid() == 0 and
+            is_local_host(host)):
+        return _local
+    return _transport
+
+
+def close_transports():
+    """
+    Closes connections of all transports in use.
+    """
+    _transport.close_all()
+    _local.close_all()
@@ -23,6 +23,7 @@ import logging
 
 from . import utils
 
+from .exceptions import MultiHostError
 from .exceptions import ParamValidationError
 
 
@@ -36,6 +37,12 @@ __all__ = ('ParamValidationError', 'validate_integer', 'validate_float',
            'validate_writeable_directory')
 
 
+# seconds to wait for answer of probed host
+PROBE_TIMEOUT = 5
+# maximum number of hosts probed at once
+PROBE_LIMIT = 256
+
+
 def validate_integer(param, options=None):
     """
     Raises ParamValidationError if given param is not integer.
@@ -225,13 +232,33 @@ def validate_ping(param, options=None):
     if not param:
         return
     options = options or []
-    rc, out = utils.execute(['/bin/ping', '-c', '1', str(param)],
+    key = (param, None)
+    if key in _reachable:
+        return
+    rc, out = utils.execute(['/bin/ping', '-c', '1',
+                             '-W', str(PROBE_TIMEOUT), str(param)],
                             can_fail=False)
     if rc != 0:
         logging.debug('validate_ping(%s, options=%s) failed.' %
                       (param, options))
         msg = 'Given host is unreachable: %s'
         raise ParamValidationError(msg % param)
+    _reachable.add(key)
+
+
+def _validate_hosts(validator, param, msg):
+    """
+    Runs validator for all comma separated hosts given in param
+    concurrently. Raises ParamValidationError listing all failed hosts.
+    """
+    hosts = [host.strip() for host in param.split(",") if host.strip()]
+    if not hosts:
+        return
+    try:
+        utils.run_on_hosts(validator, hosts,
+                           limit=min(len(hosts), PROBE_LIMIT))
+    except MultiHostError as ex:
+        raise ParamValidationError(msg % ', '.join(ex.errors.keys()))
 
 
 def validate_multi_ping(param, options=None):
@@ -240,24 +267,25 @@ def validate_multi_ping(param, options=None):
     do not answer to ICMP echo request.
     """
     options = options or []
-    for host in param.split(","):
-        validate_ping(host.strip())
+    _validate_hosts(validate_ping, param,
+                    'Given hosts are unreachable: %s')
 
 
-_tested_ports = []
+# (host, port) pairs which have been reached, port is None for ICMP echo
+_reachable = set()
 
 
 def touch_port(host, port):
     """
     Check that provided host is listening on provided port.
     """
-    key = "%s:%d" % (host, port)
-    if key in _tested_ports:
+    key = (host, port)
+    if key in _reachable:
         return
-    sock = socket.create_connection((host, port))
+    sock = socket.create_connection((host, port), PROBE_TIMEOUT)
     sock.shutdown(socket.SHUT_RDWR)
     sock.close()
-    _tested_ports.append(key)
+    _reachable.add(key)
 
 
 def validate_ssh(param, options=None):
@@ -283,8 +311,8 @@ def validate_multi_ssh(param, options=None):
     in param do not listen on port 22.
     """
     options = options or []
-    for host in param.split(","):
-        validate_ssh(host)
+    _validate_hosts(validate_ssh, param,
+                    'Given hosts do not listen on port 22: %s')
 
 
 def validate_sshkey(param, options=None):
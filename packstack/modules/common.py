@@ -12,8 +12,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import netaddr
-
 from ..installer import utils
 
 
@@ -42,6 +40,18 @@ def filtered_hosts(config, exclude=True, dbhost=True):
     return result
 
 
+def for_each_host(config, func, hosts=None):
+    """
+    Runs func(host) in parallel for every host in hosts or, if hosts is not
+    given, for every host returned by filtered_hosts. Number of hosts
+    processed at once is limited by MAX_PARALLEL config value. Returns
+    SortedDict of results keyed by host.
+    """
+    if hosts is None:
+        hosts = sorted(filtered_hosts(config))
+    return utils.run_on_hosts(func, hosts, limit=config.get('MAX_PARALLEL'))
+
+
 def is_all_in_one(config):
     """
     Returns True if packstack is running allinone setup, otherwise
@@ -63,8 +73,9 @@ def cidr_to_ifname(cidr, host, config):
             'Cannot translate CIDR to interface, invalid parameters '
             'were given.'
         )
-    info = config['HOST_DETAILS'][host]
+    import netaddr
 
+    info = config['HOST_DETAILS'][host]
     result = []
     for item in cidr.split(','):
         translated = []
@@ -17,7 +17,10 @@
 # limitations under the License.
 #
 
-from docutils import core
+import json
+import os
+
+from packstack.installer import basedefs
 
 
 # ------------------ helpers to locate option list ------------------ #
@@ -56,6 +59,58 @@ def _iter_options(section):
                 yield key_node.nodeValue, val_node.nodeValue
 
 
+# ------------------------ parsed usage cache ------------------------ #
+# parsing rst with docutils is the slowest part of Packstack startup, so
+# parsed option texts are cached on disk until the rst file changes
+USAGE_CACHE = os.path.join(basedefs.PACKSTACK_VAR_DIR, 'usage.json')
+
+
+def _source_id(path):
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_mtime, stat.st_size]
+
+
+def _load_cached_usage(path, opt_title, cache_file=USAGE_CACHE):
+    try:
+        with open(cache_file) as fp:
+            cached = json.load(fp)
+        if (cached['source'] == _source_id(path) and
+                cached['title'] == opt_title):
+            return cached['usage']
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+def _store_cached_usage(path, opt_title, usage, cache_file=USAGE_CACHE):
+    try:
+        with open(cache_file, 'w') as fp:
+            json.dump({'source': _source_id(path), 'title': opt_title,
+                       'usage': usage}, fp)
+    except (IOError, OSError):
+        # cache is only an optimization
+        pass
+
+
+def parse_usage(path, opt_title='OPTIONS', cache_file=USAGE_CACHE):
+    """
+    Returns dict of USAGE texts of options parsed from given rst file.
+    """
+    usage = _load_cached_usage(path, opt_title, cache_file=cache_file)
+    if usage is not None:
+        return usage
+    from docutils import core
+
+    usage = {}
+    tree = core.publish_doctree(
+        source=open(path).read().decode('utf-8'), source_path=path
+    )
+    for key, value in _iter_options(_get_options(tree, opt_title)):
+        usage.setdefault(key, value)
+    _store_cached_usage(path, opt_title, usage, cache_file=cache_file)
+    return usage
+
+
 # ----------------------------- interface --------------------------- #
 _rst_cache = {}
 
@@ -70,11 +125,7 @@ def update_params_usage(path, params, opt_title='OPTIONS', sectioned=True):
             param['USAGE'] = rst[param['CONF_NAME']]
 
     if not _rst_cache:
-        tree = core.publish_doctree(
-            source=open(path).read().decode('utf-8'), source_path=path
-        )
-        for key, value in _iter_options(_get_options(tree, opt_title)):
-            _rst_cache.setdefault(key, value)
+        _rst_cache.update(parse_usage(path, opt_title))
 
     if sectioned:
         for section in params.values():
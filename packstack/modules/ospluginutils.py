@@ -11,12 +11,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
 import os
-import yaml
+import re
+import threading
 
-from OpenSSL import crypto
 from time import time
 from packstack.installer import basedefs
+from packstack.installer import exceptions
 from packstack.installer import utils
 from packstack.installer.setup_controller import Controller
 
@@ -24,65 +26,284 @@ controller = Controller()
 
 PUPPET_DIR = os.path.join(basedefs.DIR_PROJECT_DIR, "puppet")
 PUPPET_TEMPLATE_DIR = os.path.join(PUPPET_DIR, "templates")
-HIERA_DEFAULTS_YAML = os.path.join(basedefs.HIERADATA_DIR, "defaults.yaml")
+HIERA_DEFAULTS_YAML = "defaults.yaml"
 # For compatibility with hiera >= 3.0
-HIERA_COMMON_YAML = os.path.join(basedefs.HIERADATA_DIR, "common.yaml")
+HIERA_COMMON_YAML = "common.yaml"
+# keys looked up by hiera functions in manifests and Packstack module
+re_hiera_key = re.compile(r'''hiera(?:_array|_hash|_undef)?\(\s*\[?\s*'''
+                          r'''['"](\w+)['"]''')
 
 
 class ManifestFiles(object):
+    """
+    Registry of manifests to be applied. Manifest file names have form
+    <host>_<name>.pp, data of each manifest is kept as list of fragments
+    joined only when the manifest is written. Manifests are indexed by
+    host, by the last underscore separated part of the name and by marker.
+    Values which differ between hosts are kept in per-host hieradata, so
+    hosts of the same role get identical manifests which are written and
+    shipped only once.
+    """
+
     def __init__(self):
         self.filelist = []
         self.data = {}
+        self.requires = {}
+        self.markers = {}
+        self.by_host = {}
+        self.by_name = {}
+        self.by_marker = {}
+        self.host_hiera = {}
         self.global_data = None
 
     # continuous manifest file that have the same marker can be
     # installed in parallel, if on different servers
-    def addFile(self, filename, marker, data=''):
-        self.data[filename] = self.data.get(filename, '') + '\n' + data
-        for f, p in self.filelist:
-            if f == filename:
-                return
+    def addFile(self, filename, marker, data='', requires=None):
+        if filename in self.markers:
+            self.data[filename].append(data)
+            # same as marker, dependencies are given by the first call,
+            # following calls can only add required manifests
+            if requires and self.requires[filename] is not None:
+                self.requires[filename].extend(requires)
+            return
 
+        self.data[filename] = [data]
         self.filelist.append((filename, marker))
+        self.markers[filename] = marker
+        self.requires[filename] = (list(requires) if requires is not None
+                                   else None)
+        self.by_host.setdefault(self.getHost(filename), []).append(filename)
+        self.by_name.setdefault(filename.rsplit('_', 1)[-1],
+                                []).append(filename)
+        self.by_marker.setdefault(marker, []).append(filename)
 
     def getFiles(self):
         return [f for f in self.filelist]
 
+    def getHost(self, filename):
+        """
+        Returns host to which given manifest belongs.
+        """
+        return filename.split('_', 1)[0]
+
+    def getHostFiles(self, host):
+        """
+        Returns list of manifests of given host in order of addition.
+        """
+        return list(self.by_host.get(host, []))
+
+    def getNamedFiles(self, name):
+        """
+        Returns list of manifests whose file name ends with '_' + name
+        (e.g. 'nova.pp' gives both 1.1.1.1_nova.pp and 1.1.1.1_api_nova.pp)
+        in order of addition.
+        """
+        return list(self.by_name.get(name, []))
+
+    def getMarkerFiles(self, marker):
+        """
+        Returns list of manifests added with given marker.
+        """
+        return list(self.by_marker.get(marker, []))
+
+    def setHostHiera(self, host, key, value):
+        """
+        Sets hiera value of given key only for given host, it takes
+        precedence over the value from config.
+        """
+        self.host_hiera.setdefault(host, {})[key] = value
+
+    def getDependencies(self):
+        """
+        Returns dict mapping each manifest to set of manifests which have to
+        be applied before it. Manifest added without requires waits for all
+        manifests with preceding markers (global barrier). Manifest added
+        with requires waits only for its host's manifests with preceding
+        markers and for the required manifests. Host of the manifest is given
+        by the file name prefix.
+        """
+        deps = {}
+        previous = []
+        previous_by_host = {}
+        group = []
+        lastmarker = None
+        for filename, marker in self.filelist:
+            if lastmarker is not None and lastmarker != marker:
+                previous.extend(group)
+                for i in group:
+                    previous_by_host.setdefault(self.getHost(i),
+                                                []).append(i)
+                group = []
+            lastmarker = marker
+            group.append(filename)
+
+            requires = self.requires[filename]
+            if requires is None:
+                deps[filename] = set(previous)
+                continue
+            host = self.getHost(filename)
+            deps[filename] = set(
+                previous_by_host.get(host, []) +
+                [i for i in requires if i in self.data and i != filename]
+            )
+        return deps
+
     def writeManifests(self):
         """
         Write out the manifest data to disk, this should only be called once
         write before the puppet manifests are copied to the various servers
         """
         if not self.global_data:
-            with open(os.path.join(PUPPET_TEMPLATE_DIR, "global.pp")) as gfp:
-                self.global_data = gfp.read() % controller.CONF
+            self.global_data = templates.render("global.pp",
+                                                controller.CONF)
         os.mkdir(basedefs.PUPPET_MANIFEST_DIR, 0o700)
-        for fname, data in self.data.items():
+        # manifests with the same content are hard links to the first one
+        # written, so they are stored only once in the manifests bundle
+        written = {}
+        for fname, fragments in sorted(self.data.items()):
             path = os.path.join(basedefs.PUPPET_MANIFEST_DIR, fname)
+            content = '\n'.join(fragments)
+            if content in written:
+                os.link(written[content], path)
+                utils.timing.count('manifests_linked')
+                continue
             fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
             with os.fdopen(fd, 'w') as fp:
-                fp.write(self.global_data + data)
+                fp.write(''.join([self.global_data, '\n', content]))
+            written[content] = path
+            utils.timing.count('manifests_written')
+
+
 manifestfiles = ManifestFiles()
 
 
+# %(key)s placeholders and %% escapes of manifest templates
+re_placeholder = re.compile(r'%(%|\((\w+)\))')
+
+
+class TemplateCache(object):
+    """
+    Loads each manifest template only once. Config keys referenced by
+    each template are found on load, so rendering looks up only those.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._templates = {}
+
+    def get(self, name):
+        """
+        Returns tuple of template text and list of config keys used in it.
+        """
+        try:
+            template = self._templates[name]
+        except KeyError:
+            utils.timing.count('template_cache_misses')
+            with open(os.path.join(self.directory, name)) as fp:
+                text = fp.read()
+            keys = sorted(set(match.group(2)
+                              for match in re_placeholder.finditer(text)
+                              if match.group(2)))
+            template = self._templates[name] = (text, keys)
+        else:
+            utils.timing.count('template_cache_hits')
+        return template
+
+    def render(self, name, config):
+        """
+        Returns template of given name filled with values from config.
+        """
+        text, keys = self.get(name)
+        return text % dict((key, config[key]) for key in keys)
+
+
+templates = TemplateCache(PUPPET_TEMPLATE_DIR)
+
+
 def getManifestTemplate(template_name):
     if not template_name.endswith(".pp"):
         template_name += ".pp"
-    with open(os.path.join(PUPPET_TEMPLATE_DIR, template_name)) as fp:
-        return fp.read() % controller.CONF
+    return templates.render(template_name, controller.CONF)
 
 
-def appendManifestFile(manifest_name, data, marker=''):
-    manifestfiles.addFile(manifest_name, marker, data)
+def appendManifestFile(manifest_name, data, marker='', requires=None):
+    manifestfiles.addFile(manifest_name, marker, data, requires=requires)
+
+
+def setHostHieraValue(host, key, value):
+    manifestfiles.setHostHiera(host, key, value)
+
+
+_module_hiera_keys = None
+# hiera keys found in each manifest fragment, fragments of shared role
+# manifests are scanned only once
+_fragment_hiera_keys = {}
+
+
+def module_hiera_keys():
+    """
+    Returns set of hiera keys used by Packstack's own Puppet module, these
+    are needed on every host.
+    """
+    global _module_hiera_keys
+    if _module_hiera_keys is None:
+        keys = set()
+        for root, dirs, files in os.walk(os.path.join(PUPPET_DIR, 'modules',
+                                                      'packstack')):
+            for name in files:
+                with open(os.path.join(root, name)) as fp:
+                    keys.update(re_hiera_key.findall(fp.read()))
+        _module_hiera_keys = keys
+    return _module_hiera_keys
 
 
-def generateHieraDataFile():
+def hiera_data(host, config):
+    """
+    Returns dict of config values looked up by hiera in manifests of given
+    host together with values set only for that host. Manifests have to be
+    complete, so this should be called after writeManifests.
+    """
+    keys = set(module_hiera_keys())
+    keys.update(re_hiera_key.findall(manifestfiles.global_data or ''))
+    for filename in manifestfiles.getHostFiles(host):
+        for fragment in manifestfiles.data[filename]:
+            try:
+                keys.update(_fragment_hiera_keys[fragment])
+            except KeyError:
+                found = _fragment_hiera_keys[fragment] = frozenset(
+                    re_hiera_key.findall(fragment))
+                keys.update(found)
+    data = dict((key, config[key]) for key in keys if key in config)
+    data.update(manifestfiles.host_hiera.get(host, {}))
+    return data
+
+
+def hiera_data_dir(host):
+    """
+    Returns local directory with hieradata of given host.
+    """
+    return os.path.join(basedefs.HIERADATA_DIR, host)
+
+
+def generateHieraDataFile(hosts):
+    """
+    Writes hieradata of each of given hosts to its own directory. Host's
+    hieradata contain only values its manifests look up.
+    """
+    import yaml
+    # LibYAML based dumper is much faster when available
+    dumper = getattr(yaml, 'CDumper', yaml.Dumper)
+
     os.mkdir(basedefs.HIERADATA_DIR, 0o700)
-    with open(HIERA_DEFAULTS_YAML, 'w') as outfile:
-        outfile.write(yaml.dump(controller.CONF,
-                                explicit_start=True,
-                                default_flow_style=False))
-    os.symlink(HIERA_DEFAULTS_YAML, HIERA_COMMON_YAML)
+    for host in hosts:
+        directory = hiera_data_dir(host)
+        os.mkdir(directory, 0o700)
+        with open(os.path.join(directory, HIERA_DEFAULTS_YAML), 'w') as fp:
+            yaml.dump(hiera_data(host, controller.CONF), fp,
+                      Dumper=dumper, explicit_start=True,
+                      default_flow_style=False)
+        os.symlink(HIERA_DEFAULTS_YAML,
+                   os.path.join(directory, HIERA_COMMON_YAML))
 
 
 def createFirewallResources(hiera_key, default_value='{}'):
@@ -90,24 +311,175 @@ def createFirewallResources(hiera_key, default_value='{}'):
     return "create_resources(packstack::firewall, %s)\n\n" % hiera_function
 
 
-def generate_ssl_cert(config, host, service, ssl_key_file, ssl_cert_file):
+# supported elliptic curves by their key size, crypto libraries are imported
+# only when keys are generated
+EC_CURVES = {256: 'SECP256R1', 384: 'SECP384R1', 521: 'SECP521R1'}
+DEFAULT_KEY_SIZES = {'rsa': 4096, 'ec': 256}
+# shorter RSA keys are too weak to be used
+MIN_RSA_KEY_SIZE = 2048
+
+
+def ssl_key_params(config):
     """
-    Wrapper on top of openssl
+    Returns (algorithm, size) tuple of SSL keys configured in config.
     """
-    # We have to check whether the certificate already exists
-    cert_dir = os.path.join(config['CONFIG_SSL_CERT_DIR'], 'certs')
-    local_cert_name = host + os.path.basename(ssl_cert_file)
-    local_cert_path = os.path.join(cert_dir, local_cert_name)
-    if not os.path.exists(local_cert_path):
-        ca_file = open(config['CONFIG_SSL_CACERT_FILE'], 'rt').read()
-        ca_key_file = open(config['CONFIG_SSL_CACERT_KEY_FILE'], 'rt').read()
-        ca_key = crypto.load_privatekey(crypto.FILETYPE_PEM, ca_key_file)
-        ca = crypto.load_certificate(crypto.FILETYPE_PEM, ca_file)
-
-        k = crypto.PKey()
-        k.generate_key(crypto.TYPE_RSA, 4096)
+    algorithm = config.get('CONFIG_SSL_KEY_ALGORITHM') or 'rsa'
+    size = int(config.get('CONFIG_SSL_KEY_SIZE') or
+               DEFAULT_KEY_SIZES[algorithm])
+    if algorithm == 'ec' and size not in EC_CURVES:
+        raise exceptions.ParamValidationError(
+            'Unsupported EC key size %s, use one of: %s'
+            % (size, ', '.join(str(i) for i in sorted(EC_CURVES)))
+        )
+    if algorithm == 'rsa' and size < MIN_RSA_KEY_SIZE:
+        raise exceptions.ParamValidationError(
+            'RSA key size %s is too small, use at least %s'
+            % (size, MIN_RSA_KEY_SIZE)
+        )
+    return algorithm, size
+
+
+def generate_key(algorithm='rsa', size=4096):
+    """
+    Returns new private key of given algorithm ('rsa' or 'ec') and size
+    in PEM format.
+    """
+    if algorithm == 'ec':
+        from cryptography.hazmat.backends import default_backend
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import ec
+
+        curve = getattr(ec, EC_CURVES[size])
+        key = ec.generate_private_key(curve(), default_backend())
+        return key.private_bytes(serialization.Encoding.PEM,
+                                 serialization.PrivateFormat.TraditionalOpenSSL,
+                                 serialization.NoEncryption())
+    from OpenSSL import crypto
+
+    key = crypto.PKey()
+    key.generate_key(crypto.TYPE_RSA, size)
+    return crypto.dump_privatekey(crypto.FILETYPE_PEM, key)
+
+
+def signature_digest(key):
+    """
+    Returns digest used for signing certificates by given key.
+    """
+    from OpenSSL import crypto
+
+    return 'sha1' if key.type() == crypto.TYPE_RSA else 'sha256'
+
+
+class KeyPool(object):
+    """
+    Generates private keys in pool of worker processes, because key
+    generation is CPU bound. Keys can be generated in advance by prewarm().
+    Workers are forked, so the pool should be started by prewarm() before
+    Packstack starts any threads.
+    """
+
+    def __init__(self, algorithm='rsa', size=4096):
+        self.algorithm = algorithm
+        self.size = size
+        self._workers = None
+        self._ready = collections.deque()
+        self._lock = threading.Lock()
+
+    def configure(self, algorithm, size):
+        """
+        Sets algorithm and size of generated keys, keys generated in
+        advance with other parameters are dropped.
+        """
+        with self._lock:
+            if (algorithm, size) != (self.algorithm, self.size):
+                self._ready.clear()
+            self.algorithm, self.size = algorithm, size
+
+    def _start(self):
+        if self._workers is None:
+            import multiprocessing
+            self._workers = multiprocessing.Pool()
+
+    def _submit(self):
+        self._start()
+        return self._workers.apply_async(generate_key,
+                                         (self.algorithm, self.size))
+
+    def prewarm(self, count):
+        """
+        Starts worker processes and generation of count keys in
+        background, count 0 only starts the workers.
+        """
+        with self._lock:
+            self._start()
+            for i in range(count):
+                self._ready.append(self._submit())
+
+    def request(self):
+        """
+        Returns AsyncResult of private key in PEM format, pre-generated
+        keys are used first.
+        """
+        with self._lock:
+            if self._ready:
+                return self._ready.popleft()
+            return self._submit()
+
+    def close(self):
+        """
+        Stops worker processes, unused pre-generated keys are dropped.
+        """
+        with self._lock:
+            if self._workers is not None:
+                self._workers.terminate()
+                self._workers.join()
+                self._workers = None
+            self._ready.clear()
+
+
+class CertificateFactory(object):
+    """
+    Collects certificates requested by plugins and files to be delivered
+    to hosts. Keys of requested certificates are generated concurrently,
+    certificates are signed and all files are delivered by flush(), one
+    session per host.
+    """
+
+    def __init__(self):
+        self.keys = KeyPool()
+        self._pending = utils.SortedDict()
+        self._files = utils.SortedDict()
+
+    def request(self, config, host, service, ssl_key_file, ssl_cert_file):
+        """
+        Requests certificate of service on host signed by CA given in
+        config. Certificates already present in CONFIG_SSL_CERT_DIR are not
+        generated again.
+        """
+        cert_dir = os.path.join(config['CONFIG_SSL_CERT_DIR'], 'certs')
+        local_cert_name = host + os.path.basename(ssl_cert_file)
+        local_cert_path = os.path.join(cert_dir, local_cert_name)
+        if os.path.exists(local_cert_path) or \
+                local_cert_path in self._pending:
+            return
+        self._pending[local_cert_path] = {
+            'host': host, 'service': service, 'key_file': ssl_key_file,
+            'cert_file': ssl_cert_file, 'key': self.keys.request(),
+        }
+
+    def deliver(self, content, path, host):
+        """
+        Schedules delivery of file with given content to path on host.
+        """
+        self._files.setdefault(host, utils.SortedDict())[path] = content
+
+    def _sign(self, config, request, ca, ca_key):
+        from OpenSSL import crypto
+
+        k = crypto.load_privatekey(crypto.FILETYPE_PEM,
+                                   request['key'].get())
         mail = config['CONFIG_SELFSIGN_CACERT_SUBJECT_MAIL']
-        hostinfo = config['HOST_DETAILS'][host]
+        hostinfo = config['HOST_DETAILS'][request['host']]
         fqdn = hostinfo['fqdn']
         cert = crypto.X509()
         subject = cert.get_subject()
@@ -116,14 +488,18 @@ def generate_ssl_cert(config, host, service, ssl_key_file, ssl_cert_file):
         subject.L = config['CONFIG_SELFSIGN_CACERT_SUBJECT_L']
         subject.O = config['CONFIG_SELFSIGN_CACERT_SUBJECT_O']
         subject.OU = config['CONFIG_SELFSIGN_CACERT_SUBJECT_OU']
-        subject.CN = "%s/%s" % (service, fqdn)
+        subject.CN = "%s/%s" % (request['service'], fqdn)
         subject.emailAddress = mail
 
+        # EC keys are used for key agreement, not for key transport
+        usage = (k.type() == crypto.TYPE_RSA and
+                 "nonRepudiation,digitalSignature,keyEncipherment" or
+                 "nonRepudiation,digitalSignature,keyAgreement")
         cert.add_extensions([
             crypto.X509Extension(
                 "keyUsage".encode('ascii'),
                 False,
-                "nonRepudiation,digitalSignature,keyEncipherment".encode('ascii')),
+                usage.encode('ascii')),
             crypto.X509Extension(
                 "extendedKeyUsage".encode('ascii'),
                 False,
@@ -136,25 +512,78 @@ def generate_ssl_cert(config, host, service, ssl_key_file, ssl_cert_file):
         cert.set_pubkey(k)
         serial = int(time())
         cert.set_serial_number(serial)
-        cert.sign(ca_key, 'sha1')
+        cert.sign(ca_key, signature_digest(ca_key))
 
         final_cert = crypto.dump_certificate(crypto.FILETYPE_PEM, cert)
         final_key = crypto.dump_privatekey(crypto.FILETYPE_PEM, k)
-        deliver_ssl_file(ca_file, config['CONFIG_SSL_CACERT'], host)
-        deliver_ssl_file(final_cert, ssl_cert_file, host)
-        deliver_ssl_file(final_key, ssl_key_file, host)
+        return final_cert, final_key
 
-        with open(local_cert_path, 'w') as f:
-            f.write(final_cert)
+    def flush(self, config):
+        """
+        Signs all requested certificates, stores them in CONFIG_SSL_CERT_DIR
+        and delivers all scheduled files to hosts. Nothing is delivered
+        during dry run.
+        """
+        pending, self._pending = self._pending, utils.SortedDict()
+        files, self._files = self._files, utils.SortedDict()
+        try:
+            if config.get('DRY_RUN'):
+                return
+            if pending:
+                from OpenSSL import crypto
+
+                ca_file = open(config['CONFIG_SSL_CACERT_FILE'], 'rt').read()
+                ca_key_file = open(config['CONFIG_SSL_CACERT_KEY_FILE'],
+                                   'rt').read()
+                ca_key = crypto.load_privatekey(crypto.FILETYPE_PEM,
+                                                ca_key_file)
+                ca = crypto.load_certificate(crypto.FILETYPE_PEM, ca_file)
+            for local_cert_path, request in pending.items():
+                final_cert, final_key = self._sign(config, request, ca,
+                                                   ca_key)
+                host = request['host']
+                host_files = files.setdefault(host, utils.SortedDict())
+                host_files[config['CONFIG_SSL_CACERT']] = ca_file
+                host_files[request['cert_file']] = final_cert
+                host_files[request['key_file']] = final_key
+                with open(local_cert_path, 'w') as f:
+                    f.write(final_cert)
+        finally:
+            self.keys.close()
+
+        def deliver(host):
+            server = utils.ScriptRunner(host)
+            for path, content in files[host].items():
+                server.append("grep -- '{content}' {path} || "
+                              "echo '{content}' > {path} ".format(
+                                  content=content,
+                                  path=path))
+            server.execute()
+
+        utils.run_on_hosts(deliver, files.keys(),
+                           limit=config.get('MAX_PARALLEL'))
+
+
+cert_factory = CertificateFactory()
+
+
+def generate_ssl_cert(config, host, service, ssl_key_file, ssl_cert_file):
+    """
+    Wrapper on top of openssl
+    """
+    cert_factory.request(config, host, service, ssl_key_file, ssl_cert_file)
 
 
 def deliver_ssl_file(content, path, host):
-    server = utils.ScriptRunner(host)
-    server.append("grep -- '{content}' {path} || "
-                  "echo '{content}' > {path} ".format(
-                      content=content,
-                      path=path))
-    server.execute()
+    cert_factory.deliver(content, path, host)
+
+
+def deliver_ssl_files(config, messages):
+    """
+    Step function signing requested certificates and delivering them
+    together with other SSL files to hosts.
+    """
+    cert_factory.flush(config)
 
 
 def gethostlist(CONF):
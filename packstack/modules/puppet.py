@@ -12,26 +12,31 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
+import json
 import logging
+import mmap
 import os
 import re
 
 from packstack.installer.exceptions import PuppetError
+from packstack.installer.utils import execute
 
 
 # TODO: Fill logger name when logging system will be refactored
 logger = logging.getLogger()
 
 re_color = re.compile('\x1b.*?\d\dm')
-re_error = re.compile(
-    'err:|Syntax error at|^Duplicate definition:|^Invalid tag|'
-    '^No matching value for selector param|^Parameter name failed:|Error:|'
-    '^Invalid parameter|^Duplicate declaration:|^Could not find resource|'
-    '^Could not parse for|^/usr/bin/puppet:\d+: .+|.+\(LoadError\)|'
-    '^Could not autoload|'
-    '^\/usr\/bin\/env\: jruby\: No such file or directory|'
-    'failed to execute puppet'
+error_patterns = (
+    'err:', 'Syntax error at', '^Duplicate definition:', '^Invalid tag',
+    '^No matching value for selector param', '^Parameter name failed:',
+    'Error:', '^Invalid parameter', '^Duplicate declaration:',
+    '^Could not find resource', '^Could not parse for',
+    '^/usr/bin/puppet:\d+: .+', '.+\(LoadError\)', '^Could not autoload',
+    '^\/usr\/bin\/env\: jruby\: No such file or directory',
+    'failed to execute puppet',
 )
+re_error = re.compile('|'.join(error_patterns))
 re_ignore = re.compile(
     # Puppet preloads a provider using the mysql command before it is installed
     'Command mysql is missing|'
@@ -49,6 +54,15 @@ re_notice = re.compile(r"notice: .*Notify\[packstack_info\]"
                        "\/message: defined \'message\' as "
                        "\'(?P<message>.*)\'")
 
+# Matches every line which might contain error or notice. Patterns are not
+# anchored and leading or trailing '.+' is dropped, so that whole log can be
+# searched at once instead of line by line without backtracking
+re_candidate = re.compile(
+    '|'.join([re.sub(r'^\^|^\.\+|\.\+$', '', i) for i in error_patterns] +
+             [r'Notify\[packstack_info\]']),
+    re.MULTILINE
+)
+
 surrogates = [
     # Value in /etc/sysctl.conf cannot be changed
     ('Sysctl::Value\[.*\]\/Sysctl\[(?P<arg1>.*)\].*Field \'val\' is required',
@@ -65,46 +79,119 @@ surrogates = [
 ]
 
 
-def validate_logfile(logpath):
+re_surrogates = [(re.compile(regex), surrogate)
+                 for regex, surrogate in surrogates]
+
+
+class LogAnalyzer(object):
     """
-    Check given Puppet log file for errors and raise PuppetError if there is
-    any error
+    Checks Puppet log for errors and packstack notices in a single pass.
+    Log can be fed in chunks of any size while it is being written or it
+    can be analyzed at once by analyze_logfile. Results are stored in
+    attributes errors (list of (line, message) tuples, where message is
+    rewritten by matching surrogates), ignored (list of expected error
+    lines) and notices (list of packstack_info/packstack_warn messages).
     """
-    manifestpath = os.path.splitext(logpath)[0]
-    manifestfile = os.path.basename(manifestpath)
-    with open(logpath) as logfile:
-        for line in logfile:
-            line = line.strip()
+    def __init__(self, logpath):
+        self.logpath = logpath
+        self.manifestfile = os.path.basename(os.path.splitext(logpath)[0])
+        self.errors = []
+        self.ignored = []
+        self.notices = []
+        self._partial = ''
 
-            if re_error.search(line) is None:
-                continue
+    @property
+    def error(self):
+        """
+        PuppetError describing the first error found or None.
+        """
+        if not self.errors:
+            return None
+        message = ('Error appeared during Puppet run: %s\n%s\n'
+                   'You will find full trace in log %s' %
+                   (self.manifestfile, self.errors[0][1], self.logpath))
+        return PuppetError(message)
+
+    def feed(self, data):
+        data = self._partial + data
+        end = data.rfind('\n') + 1
+        self._partial = data[end:]
+        self.scan(data, end)
+
+    def close(self):
+        """
+        Scans the last line if it was not terminated by new line.
+        """
+        if self._partial:
+            self.scan(self._partial, len(self._partial))
+            self._partial = ''
 
-            error = re_color.sub('', line)  # remove colors
-            if re_ignore.search(line):
-                msg = ('Ignoring expected error during Puppet run %s: %s' %
-                       (manifestfile, error))
-                logger.debug(msg)
+    def scan(self, buf, end):
+        """
+        Scans complete lines in buf[:end], buf can be string or mmap.
+        """
+        pos = 0
+        while pos < end:
+            match = re_candidate.search(buf, pos, end)
+            if match is None:
+                break
+            start = buf.rfind('\n', 0, match.start()) + 1
+            pos = buf.find('\n', match.end(), end)
+            pos = end if pos < 0 else pos + 1
+            self._line(buf[start:pos])
+
+    def _line(self, line):
+        match = re_notice.search(line)
+        if match:
+            self.notices.append(match.group('message'))
+
+        line = line.strip()
+        if re_error.search(line) is None:
+            return
+
+        error = re_color.sub('', line)  # remove colors
+        if re_ignore.search(line):
+            msg = ('Ignoring expected error during Puppet run %s: %s' %
+                   (self.manifestfile, error))
+            logger.debug(msg)
+            self.ignored.append(line)
+            return
+
+        for regex, surrogate in re_surrogates:
+            match = regex.search(error)
+            if match is None:
                 continue
+            args = dict([('arg%d' % num, group)
+                         for num, group in enumerate(match.groups(), 1)])
+            error = surrogate % args
+        self.errors.append((line, error))
 
-            for regex, surrogate in surrogates:
-                match = re.search(regex, error)
-                if match is None:
-                    continue
 
-                args = {}
-                num = 1
-                while True:
-                    try:
-                        args['arg%d' % num] = match.group(num)
-                        num += 1
-                    except IndexError:
-                        break
-                error = surrogate % args
+def analyze_logfile(logpath):
+    """
+    Returns LogAnalyzer containing results of analysis of given Puppet log
+    file. Non-empty files are memory-mapped.
+    """
+    analyzer = LogAnalyzer(logpath)
+    with open(logpath, 'rb') as logfile:
+        size = os.fstat(logfile.fileno()).st_size
+        if size:
+            buf = mmap.mmap(logfile.fileno(), size, access=mmap.ACCESS_READ)
+            try:
+                analyzer.scan(buf, size)
+            finally:
+                buf.close()
+    return analyzer
 
-            message = ('Error appeared during Puppet run: %s\n%s\n'
-                       'You will find full trace in log %s' %
-                       (manifestfile, error, logpath))
-            raise PuppetError(message)
+
+def validate_logfile(logpath):
+    """
+    Check given Puppet log file for errors and raise PuppetError if there is
+    any error
+    """
+    error = analyze_logfile(logpath).error
+    if error:
+        raise error
 
 
 def scan_logfile(logpath):
@@ -112,10 +199,111 @@ def scan_logfile(logpath):
     Returns list of packstack_info/packstack_warn notices parsed from
     given puppet log file.
     """
-    output = []
-    with open(logpath) as logfile:
-        for line in logfile:
-            match = re_notice.search(line)
-            if match:
-                output.append(match.group('message'))
-    return output
+    return analyze_logfile(logpath).notices
+
+
+def modules_digest(module_dir, modules, cache_file=None):
+    """
+    Returns SHA-1 hex digest of content of given Puppet modules in
+    module_dir. Files are read only if the stat signature (paths, modes,
+    sizes and modification times) of the tree differs from the one stored
+    in cache_file together with the previously computed digest.
+    """
+    entries = []
+    for module in sorted(modules):
+        path = os.path.join(module_dir, module)
+        for root, dirs, files in os.walk(path, followlinks=True):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    # broken symlink
+                    continue
+                entries.append((os.path.relpath(path, module_dir),
+                                stat.st_mode, stat.st_size, stat.st_mtime))
+    signature = hashlib.sha1(repr(entries)).hexdigest()
+
+    cached = {}
+    if cache_file and os.path.exists(cache_file):
+        try:
+            with open(cache_file) as fp:
+                cached = json.load(fp)
+        except ValueError:
+            logger.debug('Ignoring corrupted module digest cache %s'
+                         % cache_file)
+    if cached.get('signature') == signature:
+        return cached['digest']
+
+    digest = hashlib.sha1()
+    for relpath, mode, size, mtime in entries:
+        content = hashlib.sha1()
+        with open(os.path.join(module_dir, relpath), 'rb') as fp:
+            for chunk in iter(lambda: fp.read(65536), ''):
+                content.update(chunk)
+        digest.update('%s\0%o\0%s\n' % (relpath, mode, content.hexdigest()))
+    digest = digest.hexdigest()
+
+    if cache_file:
+        with open(cache_file, 'w') as fp:
+            json.dump({'signature': signature, 'digest': digest}, fp)
+    return digest
+
+
+RPM_NEVRA_FORMAT = '%{NAME} %{EPOCHNUM}:%{VERSION}-%{RELEASE}.%{ARCH}\\n'
+RPM_REQUIRES_FORMAT = '##packstack-requires %{NAME}\\n[%{REQUIRENAME}\\n]'
+re_requires_ignore = re.compile('^(rpmlib|/|perl)')
+
+
+def modules_requires(packages, cache_file=None):
+    """
+    Returns sorted list of requirements of given Puppet modules packages
+    installed locally, packages which are not installed are skipped.
+    Installed versions of all packages are queried by single rpm call,
+    requirements are queried by another one only for package versions
+    which are not present in cache_file yet.
+    """
+    rc, out = execute(['rpm', '-q', '--qf', RPM_NEVRA_FORMAT] +
+                      list(packages), can_fail=False, log=False)
+    installed = {}
+    for line in out.splitlines():
+        name, sep, nevra = line.strip().partition(' ')
+        if name in packages and nevra and ' ' not in nevra:
+            installed[name] = nevra
+
+    cached = {}
+    if cache_file and os.path.exists(cache_file):
+        try:
+            with open(cache_file) as fp:
+                cached = json.load(fp)
+        except ValueError:
+            logger.debug('Ignoring corrupted requirements cache %s'
+                         % cache_file)
+    missing = [name for name, nevra in sorted(installed.items())
+               if nevra not in cached]
+    if missing:
+        rc, out = execute(['rpm', '-q', '--qf', RPM_REQUIRES_FORMAT] +
+                          missing, can_fail=False, log=False)
+        requires = dict((name, []) for name in missing)
+        current = None
+        for line in out.splitlines():
+            line = line.strip()
+            if line.startswith('##packstack-requires '):
+                current = requires.get(line.split(' ', 1)[1])
+            elif current is not None and line:
+                current.append(line)
+        for name in missing:
+            cached[installed[name]] = requires[name]
+        if cache_file:
+            # only currently installed versions are worth keeping
+            current_cache = dict((nevra, cached[nevra])
+                                 for nevra in installed.values())
+            with open(cache_file, 'w') as fp:
+                json.dump(current_cache, fp)
+
+    result = set()
+    for nevra in installed.values():
+        result.update(req for req in cached[nevra]
+                      if not re_requires_ignore.match(req))
+    return sorted(result)
@@ -98,23 +98,22 @@ def create_manifest(config, messages):
 
 
 def create_nrpe_manifests(config, messages):
+    # Only the Nagios host is allowed to talk to nrpe
+    fw_details = dict()
+    key = "nagios_nrpe"
+    fw_details.setdefault(key, {})
+    fw_details[key]['host'] = "%s" % config['CONFIG_CONTROLLER_HOST']
+    fw_details[key]['service_name'] = "nagios-nrpe"
+    fw_details[key]['chain'] = "INPUT"
+    fw_details[key]['ports'] = ['5666']
+    fw_details[key]['proto'] = "tcp"
+    config['FIREWALL_NAGIOS_NRPE_RULES'] = fw_details
+
+    # manifest is the same for all hosts
+    manifestdata = getManifestTemplate("nagios_nrpe")
+    manifestdata += createFirewallResources('FIREWALL_NAGIOS_NRPE_RULES')
     for hostname in filtered_hosts(config):
-        config['CONFIG_NRPE_HOST'] = hostname
         manifestfile = "%s_nagios_nrpe.pp" % hostname
-        manifestdata = getManifestTemplate("nagios_nrpe")
-
-        # Only the Nagios host is allowed to talk to nrpe
-        fw_details = dict()
-        key = "nagios_nrpe"
-        fw_details.setdefault(key, {})
-        fw_details[key]['host'] = "%s" % config['CONFIG_CONTROLLER_HOST']
-        fw_details[key]['service_name'] = "nagios-nrpe"
-        fw_details[key]['chain'] = "INPUT"
-        fw_details[key]['ports'] = ['5666']
-        fw_details[key]['proto'] = "tcp"
-        config['FIREWALL_NAGIOS_NRPE_RULES'] = fw_details
-
-        manifestdata += createFirewallResources('FIREWALL_NAGIOS_NRPE_RULES')
         appendManifestFile(manifestfile, manifestdata)
 
     messages.append("To use Nagios, browse to "
@@ -30,6 +30,7 @@ from packstack.modules.ospluginutils import appendManifestFile
 from packstack.modules.ospluginutils import createFirewallResources
 from packstack.modules.ospluginutils import getManifestTemplate
 from packstack.modules.ospluginutils import generate_ssl_cert
+from packstack.modules.ospluginutils import setHostHieraValue
 
 # ------------- Neutron Packstack Plugin Initialization --------------
 
@@ -670,21 +671,18 @@ def create_manifests(config, messages):
                 msg = output_messages.WARN_IPV6_OVS
                 messages.append(utils.color_text(msg % host, 'red'))
 
+            # tunnel rules of the host are kept in its own hieradata, so
+            # they do not make its manifest differ from other hosts
+            fw_details = dict()
             if (config['CONFIG_NEUTRON_OVS_TUNNEL_SUBNETS']):
                 tunnel_subnets = map(
                     str.strip,
                     config['CONFIG_NEUTRON_OVS_TUNNEL_SUBNETS'].split(',')
                 )
                 for subnet in tunnel_subnets:
-                    cf_fw_nt_key = ("FIREWALL_NEUTRON_TUNNEL_RULES_%s_%s"
-                                    % (host, subnet))
-                    config[cf_fw_nt_key] = tunnel_fw_details(config,
-                                                             host, subnet)
-                    manifest_data += createFirewallResources(cf_fw_nt_key)
+                    fw_details.update(tunnel_fw_details(config, host, subnet))
             else:
                 for n_host in network_hosts | compute_hosts:
-                    cf_fw_nt_key = ("FIREWALL_NEUTRON_TUNNEL_RULES_%s_%s"
-                                    % (host, n_host))
                     if config['CONFIG_NEUTRON_OVS_TUNNEL_IF']:
                         if config['CONFIG_USE_SUBNETS'] == 'y':
                             iface = common.cidr_to_ifname(
@@ -701,9 +699,13 @@ def create_manifests(config, messages):
                                            (iface, n_host))
                     else:
                         src_host = n_host
-                    config[cf_fw_nt_key] = tunnel_fw_details(config,
-                                                             host, src_host)
-                    manifest_data += createFirewallResources(cf_fw_nt_key)
+                    fw_details.update(tunnel_fw_details(config, host,
+                                                        src_host))
+            setHostHieraValue(host, 'FIREWALL_NEUTRON_TUNNEL_RULES',
+                              fw_details)
+            manifest_data += createFirewallResources(
+                'FIREWALL_NEUTRON_TUNNEL_RULES'
+            )
 
             appendManifestFile(manifest_file, manifest_data, 'neutron')
 
@@ -871,7 +873,9 @@ def create_l2_agent_manifests(config, messages):
 
     for host in network_hosts | compute_hosts:
         manifestfile = "%s_neutron.pp" % (host,)
-        manifestdata = "$cfg_neutron_ovs_host = '%s'\n" % host
+        setHostHieraValue(host, 'CONFIG_NEUTRON_OVS_HOST', host)
+        manifestdata = ("$cfg_neutron_ovs_host = "
+                        "hiera('CONFIG_NEUTRON_OVS_HOST')\n")
         if host in network_hosts:
             manifestdata += "$create_bridges = true\n"
         else:
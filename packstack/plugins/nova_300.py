@@ -16,9 +16,10 @@
 Installs and configures Nova
 """
 
+import base64
 import os
 import platform
-import socket
+import struct
 
 from packstack.installer import basedefs
 from packstack.installer import exceptions
@@ -35,6 +36,7 @@ from packstack.modules.ospluginutils import deliver_ssl_file
 from packstack.modules.ospluginutils import getManifestTemplate
 from packstack.modules.ospluginutils import generate_ssl_cert
 from packstack.modules.ospluginutils import manifestfiles
+from packstack.modules.ospluginutils import setHostHieraValue
 
 # ------------- Nova Packstack Plugin Initialization --------------
 
@@ -497,14 +499,53 @@ def create_ssh_keys(config, messages):
     config['NOVA_MIGRATION_KEY_SECRET'] = secret
 
 
+# facts of host's public SSH keys, key type is taken from the key data
+SSH_KEY_FACTS = ('sshrsakey', 'sshdsakey', 'sshecdsakey', 'sshed25519key')
+
+
+def host_keys_from_facts(host, facts):
+    """
+    Returns public SSH keys of host found in its facts in ssh-keyscan
+    output format.
+    """
+    keys = []
+    for fact in SSH_KEY_FACTS:
+        data = facts.get(fact)
+        if not data:
+            continue
+        try:
+            blob = base64.b64decode(data)
+            length = struct.unpack('>I', blob[:4])[0]
+            key_type = blob[4:4 + length]
+        except (TypeError, struct.error):
+            continue
+        if key_type:
+            keys.append('%s %s %s' % (host, key_type, data))
+    return keys
+
+
 def gather_host_keys(config, messages):
     global compute_hosts
 
+    # keys known from host discovery do not need to be scanned
+    details = config.get('HOST_DETAILS', {})
+    keys = {}
     for host in compute_hosts:
+        keys[host] = host_keys_from_facts(host, details.get(host, {}))
+
+    # all the other hosts are scanned by single ssh-keyscan run
+    missing = sorted(host for host in compute_hosts if not keys[host])
+    if missing:
         local = utils.ScriptRunner()
-        local.append('ssh-keyscan %s' % host)
-        retcode, hostkey = local.execute()
-        config['HOST_KEYS_%s' % host] = hostkey
+        local.append('ssh-keyscan %s' % ' '.join(missing))
+        retcode, out = local.execute()
+        for line in out.split('\n'):
+            parts = line.split()
+            if len(parts) == 3 and parts[0] in keys:
+                keys[parts[0]].append(line.strip())
+
+    for host in compute_hosts:
+        config['HOST_KEYS_%s' % host] = '\n'.join(keys[host])
 
 
 def create_api_manifest(config, messages):
@@ -582,11 +623,10 @@ def create_compute_manifest(config, messages):
     ssh_hostkeys = ''
 
     ssh_keys_details = {}
+    names = common.for_each_host(config, utils.reverse_lookup,
+                                 hosts=sorted(compute_hosts))
     for host in compute_hosts:
-        try:
-            hostname, aliases, addrs = socket.gethostbyaddr(host)
-        except socket.herror:
-            hostname, aliases, addrs = (host, [], [])
+        hostname, aliases, addrs = names[host]
 
         for hostkey in config['HOST_KEYS_%s' % host].split('\n'):
             hostkey = hostkey.strip()
@@ -623,15 +663,41 @@ def create_compute_manifest(config, messages):
                 vcenters = len(compute_hosts) * [vcenters[0]]
         vmware_clusters = dict(zip(compute_hosts, vcenters))
 
-    for host in compute_hosts:
-        if config['CONFIG_IRONIC_INSTALL'] == 'y':
-            cm = 'ironic.nova.compute.manager.ClusteredComputeManager'
-            config['CONFIG_NOVA_COMPUTE_MANAGER'] = cm
+    if config['CONFIG_IRONIC_INSTALL'] == 'y':
+        cm = 'ironic.nova.compute.manager.ClusteredComputeManager'
+        config['CONFIG_NOVA_COMPUTE_MANAGER'] = cm
 
-        manifestdata = getManifestTemplate("nova_compute")
+    if (config['CONFIG_CEILOMETER_INSTALL'] == 'y' and
+            config['CONFIG_AMQP_ENABLE_SSL'] == 'y'):
+        config['CONFIG_CEILOMETER_SSL_CERT'] = (
+            '/etc/pki/tls/certs/ssl_amqp_ceilometer.crt'
+        )
+        config['CONFIG_CEILOMETER_SSL_KEY'] = (
+            '/etc/pki/tls/private/ssl_amqp_ceilometer.key'
+        )
 
+    fw_details = dict()
+    key = "nova_compute"
+    fw_details.setdefault(key, {})
+    fw_details[key]['host'] = "%s" % config['CONFIG_CONTROLLER_HOST']
+    fw_details[key]['service_name'] = "nova compute"
+    fw_details[key]['chain'] = "INPUT"
+    fw_details[key]['ports'] = ['5900-5999']
+    fw_details[key]['proto'] = "tcp"
+    config['FIREWALL_NOVA_COMPUTE_RULES'] = fw_details
+
+    # compute node has to wait only for services it talks to
+    requires = ['%s_amqp.pp' % config['CONFIG_AMQP_HOST'],
+                '%s_mariadb.pp' % config['CONFIG_MARIADB_HOST'],
+                '%s_keystone.pp' % config['CONFIG_CONTROLLER_HOST'],
+                '%s_api_nova.pp' % config['CONFIG_CONTROLLER_HOST'],
+                '%s_nova.pp' % config['CONFIG_CONTROLLER_HOST']]
+
+    # compute hosts differ only in values kept in their own hieradata, so
+    # manifest is rendered once per role, i.e. with or without flat network
+    roles = {}
+    for host in compute_hosts:
         fw_details = dict()
-        cf_fw_qemu_mig_key = "FIREWALL_NOVA_QEMU_MIG_RULES_%s" % host
         for c_host in compute_hosts:
             key = "nova_qemu_migration_%s_%s" % (host, c_host)
             fw_details.setdefault(key, {})
@@ -640,33 +706,13 @@ def create_compute_manifest(config, messages):
             fw_details[key]['chain'] = "INPUT"
             fw_details[key]['ports'] = ['16509', '49152-49215']
             fw_details[key]['proto'] = "tcp"
-
-        config[cf_fw_qemu_mig_key] = fw_details
-        manifestdata += createFirewallResources(cf_fw_qemu_mig_key)
+        setHostHieraValue(host, 'FIREWALL_NOVA_QEMU_MIG_RULES', fw_details)
 
         if config['CONFIG_VMWARE_BACKEND'] == 'y':
-            manifestdata += ("\n$nova_vcenter_cluster_name = '%s'\n" %
-                             vmware_clusters[host])
-            manifestdata += getManifestTemplate("nova_compute_vmware.pp")
-        elif config['CONFIG_IRONIC_INSTALL'] == 'y':
-            manifestdata += getManifestTemplate("nova_compute_ironic.pp")
-        else:
-            manifestdata += getManifestTemplate("nova_compute_libvirt.pp")
-
-        if (config['CONFIG_VMWARE_BACKEND'] != 'y' and
-                config['CONFIG_CINDER_INSTALL'] == 'y' and
-                'gluster' in config['CONFIG_CINDER_BACKEND']):
-            manifestdata += getManifestTemplate("nova_gluster")
-        if (config['CONFIG_VMWARE_BACKEND'] != 'y' and
-                config['CONFIG_CINDER_INSTALL'] == 'y' and
-                'nfs' in config['CONFIG_CINDER_BACKEND']):
-            manifestdata += getManifestTemplate("nova_nfs")
-        manifestfile = "%s_nova.pp" % host
+            setHostHieraValue(host, 'CONFIG_NOVA_COMPUTE_VCENTER_CLUSTER',
+                              vmware_clusters[host])
 
         if config['CONFIG_NEUTRON_INSTALL'] != 'y':
-            if host not in network_hosts:
-                manifestdata += getManifestTemplate('nova_compute_flat')
-
             key = 'CONFIG_NOVA_COMPUTE_PRIVIF'
             if not config[key].strip():
                 config[key] = dummy_interface(host)
@@ -683,38 +729,60 @@ def create_compute_manifest(config, messages):
                 # just warn user to do it by himself
                 messages.append(str(ex))
 
-        if config['CONFIG_CEILOMETER_INSTALL'] == 'y':
-            if config['CONFIG_AMQP_ENABLE_SSL'] == 'y':
-                ssl_cert_file = config['CONFIG_CEILOMETER_SSL_CERT'] = (
-                    '/etc/pki/tls/certs/ssl_amqp_ceilometer.crt'
-                )
-                ssl_key_file = config['CONFIG_CEILOMETER_SSL_KEY'] = (
-                    '/etc/pki/tls/private/ssl_amqp_ceilometer.key'
-                )
-                ssl_host = config['CONFIG_CONTROLLER_HOST']
-                service = 'ceilometer'
-                generate_ssl_cert(config, host, service, ssl_key_file,
-                                  ssl_cert_file)
+        if (config['CONFIG_CEILOMETER_INSTALL'] == 'y' and
+                config['CONFIG_AMQP_ENABLE_SSL'] == 'y'):
+            generate_ssl_cert(config, host, 'ceilometer',
+                              config['CONFIG_CEILOMETER_SSL_KEY'],
+                              config['CONFIG_CEILOMETER_SSL_CERT'])
+
+        role = (config['CONFIG_NEUTRON_INSTALL'] != 'y' and
+                host not in network_hosts)
+        if role not in roles:
+            roles[role] = create_compute_role_manifest(config, role,
+                                                       ssh_hostkeys)
+        manifestfile = "%s_nova.pp" % host
+        appendManifestFile(manifestfile, roles[role], requires=requires)
 
-            mq_template = get_mq(config, "nova_ceilometer")
-            manifestdata += getManifestTemplate(mq_template)
-            manifestdata += getManifestTemplate("nova_ceilometer")
 
-        fw_details = dict()
-        key = "nova_compute"
-        fw_details.setdefault(key, {})
-        fw_details[key]['host'] = "%s" % config['CONFIG_CONTROLLER_HOST']
-        fw_details[key]['service_name'] = "nova compute"
-        fw_details[key]['chain'] = "INPUT"
-        fw_details[key]['ports'] = ['5900-5999']
-        fw_details[key]['proto'] = "tcp"
-        config['FIREWALL_NOVA_COMPUTE_RULES'] = fw_details
-
-        manifestdata += "\n" + createFirewallResources(
-            'FIREWALL_NOVA_COMPUTE_RULES'
-            )
-        manifestdata += "\n" + ssh_hostkeys
-        appendManifestFile(manifestfile, manifestdata)
+def create_compute_role_manifest(config, flat, ssh_hostkeys):
+    """
+    Returns manifest shared by compute hosts, flat network manifest is
+    included if flat is True.
+    """
+    manifestdata = getManifestTemplate("nova_compute")
+    manifestdata += createFirewallResources('FIREWALL_NOVA_QEMU_MIG_RULES')
+
+    if config['CONFIG_VMWARE_BACKEND'] == 'y':
+        manifestdata += ("\n$nova_vcenter_cluster_name = "
+                         "hiera('CONFIG_NOVA_COMPUTE_VCENTER_CLUSTER')\n")
+        manifestdata += getManifestTemplate("nova_compute_vmware.pp")
+    elif config['CONFIG_IRONIC_INSTALL'] == 'y':
+        manifestdata += getManifestTemplate("nova_compute_ironic.pp")
+    else:
+        manifestdata += getManifestTemplate("nova_compute_libvirt.pp")
+
+    if (config['CONFIG_VMWARE_BACKEND'] != 'y' and
+            config['CONFIG_CINDER_INSTALL'] == 'y' and
+            'gluster' in config['CONFIG_CINDER_BACKEND']):
+        manifestdata += getManifestTemplate("nova_gluster")
+    if (config['CONFIG_VMWARE_BACKEND'] != 'y' and
+            config['CONFIG_CINDER_INSTALL'] == 'y' and
+            'nfs' in config['CONFIG_CINDER_BACKEND']):
+        manifestdata += getManifestTemplate("nova_nfs")
+
+    if flat:
+        manifestdata += getManifestTemplate('nova_compute_flat')
+
+    if config['CONFIG_CEILOMETER_INSTALL'] == 'y':
+        mq_template = get_mq(config, "nova_ceilometer")
+        manifestdata += getManifestTemplate(mq_template)
+        manifestdata += getManifestTemplate("nova_ceilometer")
+
+    manifestdata += "\n" + createFirewallResources(
+        'FIREWALL_NOVA_COMPUTE_RULES'
+        )
+    manifestdata += "\n" + ssh_hostkeys
+    return manifestdata
 
 
 def create_network_manifest(config, messages):
@@ -818,43 +886,42 @@ def create_common_manifest(config, messages):
     dbacces_hosts = set([config.get('CONFIG_CONTROLLER_HOST')])
     dbacces_hosts |= network_hosts
 
-    for manifestfile, marker in manifestfiles.getFiles():
+    for manifestfile in manifestfiles.getNamedFiles("nova.pp"):
         pw_in_sqlconn = False
-        if manifestfile.endswith("_nova.pp"):
-            host, manifest = manifestfile.split('_', 1)
-            host = host.strip()
-
-            if host in compute_hosts and host not in dbacces_hosts:
-                # we should omit password in case we are installing only
-                # nova-compute to the host
-                perms = "nova"
-                pw_in_sqlconn = False
-            else:
-                perms = "nova:%s" % config['CONFIG_NOVA_DB_PW']
-                pw_in_sqlconn = True
+        host, manifest = manifestfile.split('_', 1)
+        host = host.strip()
+
+        if host in compute_hosts and host not in dbacces_hosts:
+            # we should omit password in case we are installing only
+            # nova-compute to the host
+            perms = "nova"
+            pw_in_sqlconn = False
+        else:
+            perms = "nova:%s" % config['CONFIG_NOVA_DB_PW']
+            pw_in_sqlconn = True
 
-            mariadb_host_url = config['CONFIG_MARIADB_HOST_URL']
-            sqlconn = "mysql+pymysql://%s@%s/nova" % (perms, mariadb_host_url)
-            if pw_in_sqlconn:
-                config['CONFIG_NOVA_SQL_CONN_PW'] = sqlconn
-            else:
-                config['CONFIG_NOVA_SQL_CONN_NOPW'] = sqlconn
+        mariadb_host_url = config['CONFIG_MARIADB_HOST_URL']
+        sqlconn = "mysql+pymysql://%s@%s/nova" % (perms, mariadb_host_url)
+        if pw_in_sqlconn:
+            config['CONFIG_NOVA_SQL_CONN_PW'] = sqlconn
+        else:
+            config['CONFIG_NOVA_SQL_CONN_NOPW'] = sqlconn
 
-            # for nova-network in multihost mode each compute host is metadata
-            # host otherwise we use api host
-            if (network_type == 'nova' and network_multi and
-                    host in compute_hosts):
-                metadata = host
-            else:
-                metadata = config['CONFIG_CONTROLLER_HOST']
-            config['CONFIG_NOVA_METADATA_HOST'] = metadata
+        # for nova-network in multihost mode each compute host is metadata
+        # host otherwise we use api host
+        if (network_type == 'nova' and network_multi and
+                host in compute_hosts):
+            metadata = host
+        else:
+            metadata = config['CONFIG_CONTROLLER_HOST']
+        config['CONFIG_NOVA_METADATA_HOST'] = metadata
 
-            data = getManifestTemplate(get_mq(config, "nova_common"))
-            if pw_in_sqlconn:
-                data += getManifestTemplate("nova_common_pw")
-            else:
-                data += getManifestTemplate("nova_common_nopw")
-            appendManifestFile(os.path.split(manifestfile)[1], data)
+        data = getManifestTemplate(get_mq(config, "nova_common"))
+        if pw_in_sqlconn:
+            data += getManifestTemplate("nova_common_pw")
+        else:
+            data += getManifestTemplate("nova_common_nopw")
+        appendManifestFile(os.path.split(manifestfile)[1], data)
 
     if config['CONFIG_AMQP_ENABLE_SSL'] == 'y':
         nova_hosts = compute_hosts
@@ -882,7 +949,6 @@ def create_neutron_manifest(config, messages):
         virt_driver = 'nova.virt.libvirt.vif.LibvirtGenericVIFDriver'
         config['CONFIG_NOVA_LIBVIRT_VIF_DRIVER'] = virt_driver
 
-    for manifestfile, marker in manifestfiles.getFiles():
-        if manifestfile.endswith("_nova.pp"):
-            data = getManifestTemplate("nova_neutron")
-            appendManifestFile(os.path.split(manifestfile)[1], data)
+    for manifestfile in manifestfiles.getNamedFiles("nova.pp"):
+        data = getManifestTemplate("nova_neutron")
+        appendManifestFile(os.path.split(manifestfile)[1], data)
@@ -16,12 +16,15 @@
 Plugin responsible for setting OpenStack global options
 """
 
+import errno
 import os
 import re
 import logging
 import platform
 import glob
+import json
 import os
+import time
 import uuid
 
 from packstack.installer import basedefs
@@ -31,10 +34,13 @@ from packstack.installer import utils
 from packstack.installer import validators
 
 from packstack.modules.common import filtered_hosts
+from packstack.modules.common import for_each_host
 from packstack.modules.common import is_all_in_one
 from packstack.modules.documentation import update_params_usage
 from packstack.modules.ospluginutils import appendManifestFile
 from packstack.modules.ospluginutils import getManifestTemplate
+from packstack.modules.ospluginutils import setHostHieraValue
+from packstack.modules.puppet import modules_requires
 
 # ------------- Prescript Packstack Plugin Initialization --------------
 
@@ -558,6 +564,31 @@ def initConfig(controller):
              "USE_DEFAULT": False,
              "NEED_CONFIRM": False,
              "CONDITION": False},
+
+            {"CMD_OPTION": "package-cache",
+             "PROMPT": ("To let servers fetch packages through a package "
+                        "cache on this host enter \"y\""),
+             "OPTION_LIST": ["y", "n"],
+             "VALIDATORS": [validators.validate_options],
+             "DEFAULT_VALUE": "n",
+             "MASK_INPUT": False,
+             "LOOSE_VALIDATION": True,
+             "CONF_NAME": "CONFIG_PACKAGE_CACHE",
+             "USE_DEFAULT": False,
+             "NEED_CONFIRM": False,
+             "CONDITION": False},
+
+            {"CMD_OPTION": "package-cache-port",
+             "PROMPT": "Enter the port on which the package cache listens",
+             "OPTION_LIST": [],
+             "VALIDATORS": [validators.validate_port],
+             "DEFAULT_VALUE": "3142",
+             "MASK_INPUT": False,
+             "LOOSE_VALIDATION": False,
+             "CONF_NAME": "CONFIG_PACKAGE_CACHE_PORT",
+             "USE_DEFAULT": True,
+             "NEED_CONFIRM": False,
+             "CONDITION": False},
         ],
 
         "RHEL": [
@@ -1226,6 +1257,8 @@ def install_keys_on_host(hostname, sshkeydata):
 
 
 def install_keys(config, messages):
+    if config.get('DRY_RUN'):
+        return
     with open(config["CONFIG_SSH_KEY"]) as fp:
         sshkeydata = fp.read().strip()
 
@@ -1235,10 +1268,117 @@ def install_keys(config, messages):
     if is_all_in_one(config) and os.getuid() == 0:
         install_keys_on_host(None, sshkeydata)
     else:
-        for hostname in filtered_hosts(config):
-            if '/' in hostname:
-                hostname = hostname.split('/')[0]
-            install_keys_on_host(hostname, sshkeydata)
+        hosts = set([i.split('/')[0] for i in filtered_hosts(config)])
+        for_each_host(config,
+                      lambda host: install_keys_on_host(host, sshkeydata),
+                      hosts=sorted(hosts))
+
+
+# Facter 3 hides legacy facts (like ipaddress_<interface>) unless asked for
+# them, older versions do not know --show-legacy and the oldest ones do not
+# support JSON output at all
+FACTS_MARKER = '##packstack-facts-%s'
+FACTS_SCRIPT = ('echo "%(json)s"; '
+                'facter -p -j --show-legacy 2> /dev/null || '
+                'facter -p -j 2> /dev/null || '
+                '{ echo "%(text)s"; facter -p ; }'
+                % {'json': FACTS_MARKER % 'json',
+                   'text': FACTS_MARKER % 'text'})
+
+
+def _fact_value(value):
+    # values are kept in the same form as in facter's text output, so that
+    # they can be used in manifests and dumped to hiera without python tags
+    if isinstance(value, dict):
+        return dict([(_fact_value(k), _fact_value(v))
+                     for k, v in value.items()])
+    if isinstance(value, list):
+        return [_fact_value(i) for i in value]
+    if isinstance(value, bool):
+        return value and 'true' or 'false'
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def parse_facts(output):
+    """
+    Returns dict of facts parsed from output of FACTS_SCRIPT.
+    """
+    facts = {}
+    json_marker = FACTS_MARKER % 'json'
+    text_marker = FACTS_MARKER % 'text'
+    if text_marker in output:
+        for line in output.split(text_marker, 1)[1].split('\n'):
+            try:
+                key, value = line.split('=>', 1)
+            except ValueError:
+                # this line is probably some warning, so let's skip it
+                continue
+            else:
+                facts[key.strip()] = value.strip()
+    elif json_marker in output:
+        data = output.rsplit(json_marker, 1)[1]
+        try:
+            facts = _fact_value(json.loads(data))
+        except ValueError:
+            raise exceptions.ScriptRuntimeError(
+                'Failed to parse facts:\n%s' % data
+            )
+    return facts
+
+
+PROVIDES_SCRIPT = 'rpm -q --whatprovides --qf "%%{NAME}\\n" %s || true'
+re_not_provided = re.compile('^no package provides (\S+)$', re.MULTILINE)
+REQUIRES_CACHE = os.path.join(basedefs.PACKSTACK_VAR_DIR, 'requires.json')
+
+
+def parse_provides(output, capabilities):
+    """
+    Parses output of PROVIDES_SCRIPT and returns dict with bool for each
+    of queried capabilities saying whether any installed package provides
+    it.
+    """
+    missing = set(re_not_provided.findall(output))
+    return dict((cap, cap not in missing) for cap in capabilities)
+
+
+# Discovered facts are cached on disk and reused until the cache expires or
+# the host is rebooted (its boot id changes)
+FACTS_CACHE_DIR = os.path.join(basedefs.PACKSTACK_VAR_DIR, 'facts')
+BOOT_ID_MARKER = '##packstack-boot-id'
+
+
+def load_cached_facts(hostname, ttl=None):
+    """
+    Returns tuple (boot id, facts) cached for given host or None if there
+    are no facts cached or if they are older than ttl seconds.
+    """
+    path = os.path.join(FACTS_CACHE_DIR, '%s.json' % hostname)
+    try:
+        with open(path) as fp:
+            cached = json.load(fp)
+    except (IOError, ValueError):
+        return None
+    if ttl is not None and time.time() - cached['timestamp'] > ttl:
+        return None
+    return cached['boot_id'], _fact_value(cached['facts'])
+
+
+def store_cached_facts(hostname, boot_id, facts):
+    # hosts are discovered in parallel, so the directory can be created
+    # by another worker in the meantime
+    try:
+        os.mkdir(FACTS_CACHE_DIR, 0o700)
+    except OSError as ex:
+        if ex.errno != errno.EEXIST:
+            raise
+    path = os.path.join(FACTS_CACHE_DIR, '%s.json' % hostname)
+    with open(path, 'w') as fp:
+        json.dump({'timestamp': time.time(), 'boot_id': boot_id,
+                   'facts': facts}, fp)
 
 
 def preinstall_and_discover(config, messages):
@@ -1246,80 +1386,114 @@ def preinstall_and_discover(config, messages):
     modules' package and discovers information about all hosts.
     """
     config['HOST_LIST'] = list(filtered_hosts(config))
+    dry_run = config.get('DRY_RUN')
 
-    all_deps = ''
-    for pkg in basedefs.PUPPET_MODULES_PKGS:
-        local = utils.ScriptRunner()
-        local.append(
-            'rpm -q --requires %s | egrep -v "^(rpmlib|\/|perl)"' % pkg
-        )
-        # this can fail if there are no dependencies other than those
-        # filtered out by the egrep expression.
-        rc, pkg_deps = local.execute(can_fail=False)
-        errmsg = '%s is not installed' % pkg
-        if errmsg in pkg_deps:
-            # modules package might not be installed if we are running
-            # from source; in this case we assume user knows what (s)he's
-            # doing and we don't install modules dependencies
-            continue
-        all_deps += ' ' + pkg_deps.strip()
+    details = {}
+    hosts = config['HOST_LIST']
+    if dry_run:
+        # during dry run cached facts are used, only hosts without them are
+        # discovered
+        hosts = []
+        for hostname in config['HOST_LIST']:
+            cached = load_cached_facts(hostname)
+            if cached is None:
+                hosts.append(hostname)
+                continue
+            details[hostname] = cached[1]
+            details[hostname]['tmpdir'] = os.path.join(
+                basedefs.PACKSTACK_VAR_DIR, uuid.uuid4().hex
+            )
+        if not hosts:
+            config['HOST_DETAILS'] = details
+            return
 
+    # modules packages might not be installed if we are running from
+    # source; in this case we assume user knows what (s)he's doing and
+    # we don't install modules dependencies
     deps = list(basedefs.PUPPET_DEPENDENCIES)
-    deps.extend([i.strip() for i in all_deps.split() if i.strip()])
+    deps.extend(dep for dep in modules_requires(
+        basedefs.PUPPET_MODULES_PKGS, cache_file=REQUIRES_CACHE
+    ) if dep not in deps)
 
-    details = {}
-    for hostname in config['HOST_LIST']:
-        # install Puppet and it's dependencies
+    def discover(hostname):
+        # everything is done by one script, so that there is only one round
+        # trip per host
         server = utils.ScriptRunner(hostname)
+        # install Puppet and it's dependencies
         packages = ' '.join(deps)
         server.append('yum install -y %s' % packages)
         server.append('yum update -y %s' % packages)
         # yum does not fail if one of the packages is missing
-        for package in deps:
-            server.append('rpm -q --whatprovides %s' % package)
-        server.execute()
+        server.append(PROVIDES_SCRIPT % packages)
 
         # create the packstack tmp directory
-        server.clear()
         server.append('mkdir -p %s' % basedefs.PACKSTACK_VAR_DIR)
-        # Separately create the tmp directory for this packstack run, this will
-        # fail if the directory already exists
         host_dir = os.path.join(basedefs.PACKSTACK_VAR_DIR, uuid.uuid4().hex)
-        server.append('mkdir --mode 0700 %s' % host_dir)
-        for i in ('modules', 'resources'):
-            server.append('mkdir --mode 0700 %s' % os.path.join(host_dir, i))
-        server.execute()
-        details.setdefault(hostname, {})['tmpdir'] = host_dir
+        if not dry_run:
+            # Separately create the tmp directory for this packstack run, this
+            # will fail if the directory already exists
+            server.append('mkdir --mode 0700 %s' % host_dir)
+            # modules directory is linked to the module cache later
+            server.append('mkdir --mode 0700 %s'
+                          % os.path.join(host_dir, 'resources'))
+
+            # create a symbolic link to /etc/hiera.yaml to avoid warning
+            # messages such as "Warning: Config file /etc/puppet/hiera.yaml
+            # not found, using Hiera defaults"
+            server.append('[[ ! -L /etc/puppet/hiera.yaml ]] && '
+                          'ln -s /etc/hiera.yaml /etc/puppet/hiera.yaml || '
+                          'echo "hiera.yaml symlink already created"')
+            server.append("sed -i 's;:datadir:.*;:datadir: "
+                          "%s/hieradata;g' /etc/puppet/hiera.yaml" % host_dir)
 
         # discover other host info; Facter is installed as Puppet dependency,
-        # so we let it do the work
-        server.clear()
-        server.append('facter -p')
+        # so we let it do the work unless we have facts of the host cached
+        ttl = config.get('FACTS_CACHE_TTL')
+        cached = ttl and load_cached_facts(hostname, ttl)
+        server.append('boot_id=$(cat /proc/sys/kernel/random/boot_id)')
+        server.append('echo "%s $boot_id"' % BOOT_ID_MARKER)
+        if cached:
+            server.append('[ "$boot_id" == "%s" ] || { %s ; }'
+                          % (cached[0], FACTS_SCRIPT))
+        else:
+            server.append(FACTS_SCRIPT)
         rc, stdout = server.execute()
-        for line in stdout.split('\n'):
-            try:
-                key, value = line.split('=>', 1)
-            except ValueError:
-                # this line is probably some warning, so let's skip it
-                continue
-            else:
-                details[hostname][key.strip()] = value.strip()
-
-        # create a symbolic link to /etc/hiera.yaml to avoid warning messages
-        # such as "Warning: Config file /etc/puppet/hiera.yaml not found,
-        # using Hiera defaults"
-        server.clear()
-        server.append('[[ ! -L /etc/puppet/hiera.yaml ]] && '
-                      'ln -s /etc/hiera.yaml /etc/puppet/hiera.yaml || '
-                      'echo "hiera.yaml symlink already created"')
-        server.append("sed -i 's;:datadir:.*;:datadir: "
-                      "%s/hieradata;g' /etc/puppet/hiera.yaml"
-                      % details[hostname]['tmpdir'])
-        server.execute()
+
+        status = parse_provides(stdout, deps)
+        missing = [dep for dep, provided in status.items() if not provided]
+        if missing:
+            raise exceptions.ScriptRuntimeError(
+                'Failed to install package(s) %s on host %s'
+                % (', '.join(sorted(missing)), hostname), stdout=stdout
+            )
+
+        match = re.search('^%s (\S+)' % BOOT_ID_MARKER, stdout, re.MULTILINE)
+        boot_id = match and match.group(1)
+        if cached and boot_id == cached[0]:
+            details = cached[1]
+        else:
+            details = parse_facts(stdout)
+            if boot_id and details:
+                store_cached_facts(hostname, boot_id, details)
+        details['tmpdir'] = host_dir
+        return details
+
+    details.update(for_each_host(config, discover, hosts=hosts))
     config['HOST_DETAILS'] = details
 
 
+PACKAGE_CACHE_DIR = os.path.join(basedefs.PACKSTACK_VAR_DIR, 'packages')
+
+
 def server_prep(config, messages):
+    if config.get('DRY_RUN'):
+        return
+    cache_url = None
+    if config.get('CONFIG_PACKAGE_CACHE') == 'y':
+        cache_url = utils.package_cache.start(
+            utils.get_localhost_ip(), config['CONFIG_PACKAGE_CACHE_PORT'],
+            PACKAGE_CACHE_DIR
+        )
     rh_username = None
     sat_url = None
     sat6_server = None
@@ -1328,8 +1502,6 @@ def server_prep(config, messages):
         rh_password = config.get("CONFIG_RH_PW")
         sat6_server = config.get("CONFIG_RH_SAT6_SERVER")
 
-        sat_registered = set()
-
         sat_url = config["CONFIG_SATELLITE_URL"].strip()
         if sat_url:
             flag_list = config["CONFIG_SATELLITE_FLAGS"].split(',')
@@ -1348,7 +1520,18 @@ def server_prep(config, messages):
                 'flags': sat_flags
             }
 
-    for hostname in filtered_hosts(config):
+    def prepare(hostname):
+        # Let Puppet fetch packages through the package cache if it is
+        # enabled and reachable, yum gets the proxy in options of each run
+        if cache_url:
+            utils.package_cache.add_client(hostname)
+            server = utils.ScriptRunner(hostname)
+            server.append(utils.package_cache.yum_check_command())
+            rc, out = server.execute()
+            if utils.package_cache.is_usable(out):
+                setHostHieraValue(hostname, 'PACKAGE_CACHE_YUM_OPTIONS',
+                                  utils.package_cache.yum_options())
+
         # Subscribe to Red Hat Repositories if configured
         if rh_username or sat6_server:
             run_rhsm_reg(hostname, rh_username, rh_password,
@@ -1362,9 +1545,8 @@ def server_prep(config, messages):
                          sat6_key=config.get('CONFIG_RH_SAT6_KEY'))
 
         # Subscribe to RHN Satellite if configured
-        if sat_url and hostname not in sat_registered:
+        if sat_url:
             run_rhn_reg(hostname, sat_url, **sat_args)
-            sat_registered.add(hostname)
 
         server = utils.ScriptRunner(hostname)
         server.append('rpm -q --whatprovides yum-utils || '
@@ -1397,6 +1579,8 @@ def server_prep(config, messages):
         server.append("yum clean metadata")
         server.execute()
 
+    for_each_host(config, prepare)
+
 
 def create_manifest(config, messages):
     key = 'CONFIG_DEBUG_MODE'
@@ -1413,7 +1597,8 @@ def create_manifest(config, messages):
     for hostname in filtered_hosts(config):
         manifestfile = "%s_prescript.pp" % hostname
         manifestdata = getManifestTemplate("prescript")
-        appendManifestFile(manifestfile, manifestdata)
+        # prescript does not depend on any other host
+        appendManifestFile(manifestfile, manifestdata, requires=[])
 
 
 def create_ntp_manifest(config, messages):
@@ -1437,10 +1622,10 @@ def create_ntp_manifest(config, messages):
             manifestdata = getManifestTemplate('chrony')
             appendManifestFile('%s_chrony.pp' % hostname,
                                manifestdata,
-                               marker=marker)
+                               marker=marker, requires=[])
         # For previous versions, configure ntpd
         else:
             manifestdata = getManifestTemplate('ntpd')
             appendManifestFile('%s_ntpd.pp' % hostname,
                                manifestdata,
-                               marker=marker)
+                               marker=marker, requires=[])
@@ -19,7 +19,12 @@ Installs and configures Puppet
 import sys
 import logging
 import os
+import Queue
+import threading
 import time
+import uuid
+
+from distutils.spawn import find_executable
 
 from packstack.installer import utils
 from packstack.installer import basedefs
@@ -27,10 +32,14 @@ from packstack.installer.exceptions import PuppetError
 from packstack.installer.exceptions import ScriptRuntimeError
 
 from packstack.modules.common import filtered_hosts
+from packstack.modules.common import for_each_host
+from packstack.modules.ospluginutils import deliver_ssl_files
 from packstack.modules.ospluginutils import generateHieraDataFile
+from packstack.modules.ospluginutils import hiera_data_dir
 from packstack.modules.ospluginutils import manifestfiles
-from packstack.modules.puppet import validate_logfile
-from packstack.modules.puppet import scan_logfile
+from packstack.modules.puppet import LogAnalyzer
+from packstack.modules.puppet import analyze_logfile
+from packstack.modules.puppet import modules_digest
 
 
 # ------------- Puppet Packstack Plugin Initialization --------------
@@ -42,6 +51,22 @@ PLUGIN_NAME_COLORED = utils.color_text(PLUGIN_NAME, 'blue')
 PUPPET_DIR = os.environ.get('PACKSTACK_PUPPETDIR',
                             '/usr/share/openstack-puppet/')
 MODULE_DIR = os.path.join(PUPPET_DIR, 'modules')
+# module caches on hosts and digest of local modules tree
+MODULE_CACHE_DIR = os.path.join(basedefs.PACKSTACK_VAR_DIR, 'modules')
+MODULE_CACHE_KEEP = 3
+# file created in module cache once it is completely extracted
+MODULE_CACHE_MARKER = '.complete'
+MODULE_DIGEST_CACHE = os.path.join(basedefs.PACKSTACK_VAR_DIR,
+                                   'modules.digest')
+OS_MODULES = ('aodh', 'apache', 'ceilometer', 'certmonger',
+              'cinder', 'concat', 'firewall', 'glance',
+              'heat', 'horizon', 'inifile', 'ironic', 'keystone',
+              'manila', 'memcached', 'mongodb', 'mysql',
+              'neutron', 'nova', 'nssdb', 'openstack',
+              'openstacklib', 'packstack', 'rabbitmq',
+              'redis', 'remote', 'rsync', 'sahara', 'ssh',
+              'stdlib', 'swift', 'sysctl', 'tempest', 'trove',
+              'vcsrepo', 'vlan', 'vswitch', 'xinetd', )
 
 
 def initConfig(controller):
@@ -61,6 +86,8 @@ def initSequences(controller):
     controller.insertSequence("Clean Up", [], [], puppetpresteps, index=0)
 
     puppetsteps = [
+        {'title': 'Delivering SSL certificates',
+            'functions': [deliver_ssl_files]},
         {'title': 'Copying Puppet modules and manifests',
             'functions': [copy_puppet_modules]},
         {'title': 'Applying Puppet manifests',
@@ -73,62 +100,285 @@ def initSequences(controller):
 
 # ------------------------- helper functions -------------------------
 
-def wait_for_puppet(currently_running, messages):
+# how often (in seconds) are polled hosts on which puppet runs can't be
+# followed
+POLL_INTERVAL = 3
+
+
+def compressor():
+    """
+    Returns command used for compressing bundles. Multi-threaded pigz is
+    preferred when available, its output can be decompressed by gzip.
+    """
+    return find_executable('pigz') and 'pigz' or 'gzip'
+
+
+def build_bundles(hosts, modules=True):
+    """
+    Creates gzipped tarballs of manifests, of hieradata of each of given
+    hosts and, if modules is True, Puppet modules in VAR_DIR and returns
+    dict of their paths. Hieradata bundles are keyed by 'hieradata-<host>'.
+    """
+    bundle_dir = os.path.join(basedefs.VAR_DIR, 'bundles')
+    if not os.path.isdir(bundle_dir):
+        os.mkdir(bundle_dir, 0o700)
+    compress = compressor()
+    bundles = {}
+    server = utils.ScriptRunner()
+    contents = [('manifests', basedefs.PUPPET_MANIFEST_DIR,
+                 '--dereference ../manifests'),
+                ('modules', MODULE_DIR,
+                 '--dereference %s' % ' '.join(OS_MODULES))]
+    # common.yaml is kept as symlink to defaults.yaml
+    contents.extend([('hieradata-%s' % host, hiera_data_dir(host), '.')
+                     for host in hosts])
+    for name, workdir, paths in contents:
+        if name == 'modules' and not modules:
+            continue
+        bundles[name] = os.path.join(bundle_dir, '%s.tar.gz' % name)
+        server.append("cd %s" % workdir)
+        server.append("tar -cpf - %s | %s > %s"
+                      % (paths, compress, bundles[name]))
+    server.execute()
+    return bundles
+
+
+def has_cached_modules(hostname, module_cache):
+    """
+    Returns True if given host has Puppet modules cached in module_cache,
+    caches which were not extracted completely are not used.
+    """
+    server = utils.ScriptRunner(hostname)
+    server.append("[ -f %s ] && echo cached || echo missing"
+                  % os.path.join(module_cache, MODULE_CACHE_MARKER))
+    rc, out = server.execute(log=False)
+    return out.strip() == 'cached'
+
+
+def local_log_path(finished_logfile):
+    """
+    Returns path of local copy of given puppet log file.
+    """
+    log = os.path.join(basedefs.PUPPET_MANIFEST_DIR,
+                       os.path.basename(finished_logfile))
+    return log.replace(".finished", ".log")
+
+
+def fetch_puppet_log(hostname, finished_logfile):
+    """
+    Retrieves log of finished puppet run from given host. Raises
+    ScriptRuntimeError if the run has not finished yet.
+    """
+    log = local_log_path(finished_logfile)
+    utils.get_transport(hostname).get_file(hostname, finished_logfile, log)
+    return log
+
+
+class LogStream(object):
+    """
+    Streams log of running puppet apply from host to local file and checks
+    it with LogAnalyzer as it grows. Stream ends once the puppet run ends,
+    attribute complete is then True if whole log has been received.
+    """
+    # log file is opened before it can be renamed to .finished, tail then
+    # follows the open file until the puppet run process exits
+    _cmd = ('{ exec 3< %(running)s ; } 2> /dev/null || '
+            'exec 3< %(finished)s || exit 1; '
+            'tail -c +1 --pid=$(cat %(pidfile)s) -f /dev/fd/3')
+
+    def __init__(self, hostname, running_logfile, finished_logfile,
+                 pidfile, queue):
+        self.hostname = hostname
+        self.path = local_log_path(finished_logfile)
+        self.scanner = LogAnalyzer(self.path)
+        self.running = False
+        self.complete = False
+        self.queue = queue
+        self._cmd = self._cmd % {'running': running_logfile,
+                                 'finished': finished_logfile,
+                                 'pidfile': pidfile}
+        self._proc = None
+
+    def start(self):
+        self._proc = utils.get_transport(self.hostname).spawn(
+            self.hostname, self._cmd
+        )
+        # nothing is sent to tail
+        self._proc.stdin.close()
+        self.running = True
+        reader = threading.Thread(target=self._read)
+        reader.daemon = True
+        reader.start()
+
+    def _read(self):
+        try:
+            with open(self.path, 'w') as log:
+                for line in iter(self._proc.stdout.readline, ''):
+                    log.write(line)
+                    self.scanner.feed(line)
+                received = log.tell()
+            self.scanner.close()
+            if utils.get_transport(self.hostname).remote:
+                utils.timing.count_ssh(self.hostname, received=received,
+                                       round_trips=0)
+            self.complete = self._proc.wait() == 0
+        finally:
+            self.running = False
+            # wake up waiting for puppet
+            self.queue.put((self.hostname, None))
+
+    def stop(self):
+        if self.running and self._proc.poll() is None:
+            self._proc.terminate()
+
+
+class CompletionWatcher(object):
+    """
+    Collects completion events of puppet runs. Each puppet run appends path
+    of its finished log file to events file in its host's tmpdir and every
+    events file is followed by one long-lived ssh channel.
+    """
+    def __init__(self):
+        self.events = Queue.Queue()
+        self.followers = {}
+        self.finished = set()
+        self.logs = {}
+
+    def follow(self, hostname, events_file):
+        if hostname not in self.followers:
+            follower = utils.RemoteFollower(hostname, events_file,
+                                            self.events)
+            follower.start()
+            self.followers[hostname] = follower
+
+    def stream_log(self, hostname, running_logfile, finished_logfile,
+                   pidfile):
+        stream = LogStream(hostname, running_logfile, finished_logfile,
+                           pidfile, self.events)
+        stream.start()
+        self.logs[finished_logfile] = stream
+
+    def is_followed(self, hostname):
+        follower = self.followers.get(hostname)
+        return follower is not None and follower.alive
+
+    def wait(self, timeout):
+        """
+        Blocks until any event arrives or timeout expires.
+        """
+        try:
+            event = self.events.get(timeout=timeout)
+        except Queue.Empty:
+            return
+        while event:
+            hostname, finished_logfile = event
+            if finished_logfile:
+                self.finished.add(finished_logfile)
+            try:
+                event = self.events.get_nowait()
+            except Queue.Empty:
+                event = None
+
+    def stop(self):
+        for follower in self.followers.values():
+            follower.stop()
+        self.followers = {}
+        for stream in self.logs.values():
+            stream.stop()
+        self.logs = {}
+
+
+def wait_for_puppet(currently_running, messages, watcher=None,
+                    wait_all=True):
+    """
+    Waits until all puppet runs in currently_running are finished or, if
+    wait_all is False, until at least one of them is finished. Returns list
+    of finished runs, which are removed from currently_running. Runs
+    on hosts followed by watcher are checked as soon as they report their
+    completion, runs on other hosts are polled every POLL_INTERVAL seconds.
+    """
+    watcher = watcher or CompletionWatcher()
+    finished = []
     log_len = 0
     twirl = ["-", "\\", "|", "/"]
     while currently_running:
-        for hostname, finished_logfile in currently_running:
+        polled = False
+        for hostname, finished_logfile in list(currently_running):
             log_file = os.path.splitext(os.path.basename(finished_logfile))[0]
             if len(log_file) > log_len:
                 log_len = len(log_file)
-            if hasattr(sys.stdout, "isatty") and sys.stdout.isatty():
-                twirl = twirl[-1:] + twirl[:-1]
-                sys.stdout.write(("\rTesting if puppet apply is finished: %s"
-                                 % log_file).ljust(40 + log_len))
-                sys.stdout.write("[ %s ]" % twirl[0])
+            stream = watcher.logs.get(finished_logfile)
+            # completion has to be read before the error, the stream can
+            # scan the rest of the log in between
+            complete = stream is not None and stream.complete
+            if stream and stream.scanner.error:
+                # streamed log shows error even before the run has finished
+                sys.stdout.write('\r')
+                state = utils.state_message('%s:' % log_file, 'ERROR', 'red')
+                sys.stdout.write('%s\n' % state)
                 sys.stdout.flush()
-            try:
-                # Once a remote puppet run has finished, we retrieve the log
-                # file and check it for errors
-                local_server = utils.ScriptRunner()
-                log = os.path.join(basedefs.PUPPET_MANIFEST_DIR,
-                                   os.path.basename(finished_logfile))
-                log = log.replace(".finished", ".log")
-                local_server.append('scp -o StrictHostKeyChecking=no '
-                                    '-o UserKnownHostsFile=/dev/null '
-                                    'root@[%s]:%s %s'
-                                    % (hostname, finished_logfile, log))
-                # To not pollute logs we turn of logging of command execution
-                local_server.execute(log=False)
-
-                # If we got to this point the puppet apply has finished
-                currently_running.remove((hostname, finished_logfile))
-
-                # clean off the last "testing apply" msg
-                if hasattr(sys.stdout, "isatty") and sys.stdout.isatty():
-                    sys.stdout.write(("\r").ljust(45 + log_len))
-
-            except ScriptRuntimeError:
-                # the test raises an exception if the file doesn't exist yet
-                # TO-DO: We need to start testing 'e' for unexpected exceptions
-                time.sleep(3)
+                raise stream.scanner.error
+
+            if complete:
+                # whole log has been streamed, so the run has finished
+                notices = stream.scanner.notices
+                error = stream.scanner.error
+            elif stream and stream.running:
+                # end of the stream will wake us up
                 continue
+            elif (watcher.is_followed(hostname) and
+                    finished_logfile not in watcher.finished):
+                continue
+            else:
+                if hasattr(sys.stdout, "isatty") and sys.stdout.isatty():
+                    twirl = twirl[-1:] + twirl[:-1]
+                    sys.stdout.write(("\rTesting if puppet apply is "
+                                      "finished: %s"
+                                      % log_file).ljust(40 + log_len))
+                    sys.stdout.write("[ %s ]" % twirl[0])
+                    sys.stdout.flush()
+                try:
+                    # Once a remote puppet run has finished, we retrieve the
+                    # log file and check it for errors
+                    log = fetch_puppet_log(hostname, finished_logfile)
+                except ScriptRuntimeError:
+                    # the test raises an exception if the file doesn't exist
+                    # yet
+                    # TO-DO: We need to start testing 'e' for unexpected
+                    # exceptions
+                    polled = True
+                    continue
+
+                # check log file for relevant notices and for errors
+                analyzer = analyze_logfile(log)
+                notices, error = analyzer.notices, analyzer.error
+
+            # If we got to this point the puppet apply has finished
+            currently_running.remove((hostname, finished_logfile))
+            finished.append((hostname, finished_logfile))
+
+            # clean off the last "testing apply" msg
+            if hasattr(sys.stdout, "isatty") and sys.stdout.isatty():
+                sys.stdout.write(("\r").ljust(45 + log_len))
 
-            # check log file for relevant notices
-            messages.extend(scan_logfile(log))
-
-            # check the log file for errors
+            messages.extend(notices)
             sys.stdout.write('\r')
-            try:
-                validate_logfile(log)
+            if error is None:
                 state = utils.state_message('%s:' % log_file, 'DONE', 'green')
                 sys.stdout.write('%s\n' % state)
                 sys.stdout.flush()
-            except PuppetError:
+            else:
                 state = utils.state_message('%s:' % log_file, 'ERROR', 'red')
                 sys.stdout.write('%s\n' % state)
                 sys.stdout.flush()
-                raise
+                raise error
+
+        if not currently_running or (finished and not wait_all):
+            break
+        # sleep until any followed run finishes or until it is time to poll
+        # hosts which are not followed
+        watcher.wait(POLL_INTERVAL if polled else 1)
+    return finished
 
 
 # -------------------------- step functions --------------------------
@@ -140,116 +390,193 @@ def run_cleanup(config, messages):
 
 
 def copy_puppet_modules(config, messages):
-    os_modules = ' '.join(('aodh', 'apache', 'ceilometer', 'certmonger',
-                           'cinder', 'concat', 'firewall', 'glance',
-                           'heat', 'horizon', 'inifile', 'ironic', 'keystone',
-                           'manila', 'memcached', 'mongodb', 'mysql',
-                           'neutron', 'nova', 'nssdb', 'openstack',
-                           'openstacklib', 'packstack', 'rabbitmq',
-                           'redis', 'remote', 'rsync', 'sahara', 'ssh',
-                           'stdlib', 'swift', 'sysctl', 'tempest', 'trove',
-                           'vcsrepo', 'vlan', 'vswitch', 'xinetd', ))
-
     # write puppet manifest to disk
     manifestfiles.writeManifests()
-    # write hieradata file to disk
-    generateHieraDataFile()
+    # write hieradata files to disk, each host gets only values used
+    # in its manifests
+    hosts = sorted(filtered_hosts(config))
+    generateHieraDataFile(hosts)
+    if config.get('DRY_RUN'):
+        return
 
-    server = utils.ScriptRunner()
-    for hostname in filtered_hosts(config):
+    # Puppet modules are kept on hosts in directories named by digest of
+    # their content, so they are transferred only when they have changed
+    digest = modules_digest(MODULE_DIR, OS_MODULES,
+                            cache_file=MODULE_DIGEST_CACHE)
+    module_cache = os.path.join(MODULE_CACHE_DIR, digest)
+    cached = for_each_host(
+        config, lambda hostname: has_cached_modules(hostname, module_cache)
+    )
+
+    # every bundle is built only once and then streamed to all hosts
+    bundles = build_bundles(hosts, modules=not all(cached.values()))
+
+    def copy(hostname):
+        transport = utils.get_transport(hostname)
         host_dir = config['HOST_DETAILS'][hostname]['tmpdir']
-        # copy hiera defaults.yaml file
-        server.append("cd %s" % basedefs.HIERADATA_DIR)
-        server.append("tar --dereference -cpzf - ../hieradata | "
-                      "ssh -o StrictHostKeyChecking=no "
-                      "-o UserKnownHostsFile=/dev/null "
-                      "root@%s tar -C %s -xpzf -" % (hostname, host_dir))
-
-        # copy Packstack manifests
-        server.append("cd %s/puppet" % basedefs.DIR_PROJECT_DIR)
-        server.append("cd %s" % basedefs.PUPPET_MANIFEST_DIR)
-        server.append("tar --dereference -cpzf - ../manifests | "
-                      "ssh -o StrictHostKeyChecking=no "
-                      "-o UserKnownHostsFile=/dev/null "
-                      "root@%s tar -C %s -xpzf -" % (hostname, host_dir))
+        # copy host's hiera defaults.yaml file and Packstack manifests
+        hiera_dir = os.path.join(host_dir, basedefs.HIERADATA_FILE_RELATIVE)
+        commands = [(bundles['hieradata-%s' % hostname],
+                     'mkdir -p %s && tar -C %s -xpzf -'
+                     % (hiera_dir, hiera_dir)),
+                    (bundles['manifests'], 'tar -C %s -xpzf -' % host_dir)]
+
+        # copy Puppet modules required by Packstack, unpacked modules are
+        # marked complete and moved to the cache atomically, replacing any
+        # incomplete cache left behind
+        if not cached[hostname]:
+            partial = os.path.join(MODULE_CACHE_DIR,
+                                   '.%s.%s' % (digest, uuid.uuid4().hex))
+            commands.append((bundles['modules'],
+                             "mkdir -p --mode 0700 %s && "
+                             "tar -C %s -xpzf - && touch %s && "
+                             "rm -rf %s && "
+                             "{ mv -T %s %s || rm -rf %s ; }"
+                             % (partial, partial,
+                                os.path.join(partial, MODULE_CACHE_MARKER),
+                                module_cache, partial, module_cache,
+                                partial)))
+
+        for path, command in commands:
+            with open(path, 'rb') as bundle:
+                rc, out, err = transport.put_stream(hostname, command, bundle)
+            if rc:
+                raise ScriptRuntimeError(
+                    'Failed to copy %s to %s: %s' % (path, hostname, err),
+                    stdout=out, stderr=err
+                )
 
         # copy resources
         resources = config.get('RESOURCES', {})
         for path, localname in resources.get(hostname, []):
-            server.append("scp -o StrictHostKeyChecking=no "
-                          "-o UserKnownHostsFile=/dev/null "
-                          "%s root@[%s]:%s/resources/%s" %
-                          (path, hostname, host_dir, localname))
-
-        # copy Puppet modules required by Packstack
-        server.append("cd %s" % MODULE_DIR)
-        server.append("tar --dereference -cpzf - %s | "
-                      "ssh -o StrictHostKeyChecking=no "
-                      "-o UserKnownHostsFile=/dev/null "
-                      "root@%s tar -C %s -xpzf -" %
-                      (os_modules, hostname,
-                       os.path.join(host_dir, 'modules')))
-    server.execute()
+            transport.put_file(hostname, path, '%s/resources/%s'
+                               % (host_dir, localname))
+
+        server = utils.ScriptRunner(hostname)
+        server.append("ln -sfn %s %s"
+                      % (module_cache, os.path.join(host_dir, 'modules')))
+        # drop all but the most recently used module caches
+        server.append("touch %s %s"
+                      % (module_cache,
+                         os.path.join(module_cache, MODULE_CACHE_MARKER)))
+        server.append("ls -1dt %s/* | tail -n +%d | xargs -r rm -rf"
+                      % (MODULE_CACHE_DIR, MODULE_CACHE_KEEP + 1))
+        server.execute()
+
+    for_each_host(config, copy)
 
 
 def apply_puppet_manifest(config, messages):
     if config.get("DRY_RUN"):
         return
-    currently_running = []
-    lastmarker = None
     loglevel = ''
     logcmd = False
     if logging.root.level <= logging.DEBUG:
         loglevel = '--debug'
         logcmd = True
+    watcher = CompletionWatcher()
+    try:
+        _apply_manifests(config, messages, loglevel, logcmd, watcher)
+    finally:
+        watcher.stop()
+
+
+def _apply_manifests(config, messages, loglevel, logcmd, watcher):
+    hosts = filtered_hosts(config)
+    dependencies = manifestfiles.getDependencies()
+    pending = []
+    applied = set()
     for manifest, marker in manifestfiles.getFiles():
-        # if the marker has changed then we don't want to proceed until
-        # all of the previous puppet runs have finished
-        if lastmarker is not None and lastmarker != marker:
-            wait_for_puppet(currently_running, messages)
-        lastmarker = marker
-
-        for hostname in filtered_hosts(config):
-            if "%s_" % hostname not in manifest:
+        hostname = manifestfiles.getHost(manifest)
+        if hostname in hosts:
+            pending.append((hostname, manifest))
+        else:
+            # manifests of excluded hosts are never applied
+            applied.add(manifest)
+
+    # each manifest is applied as soon as all manifests it depends on are
+    # applied, puppet runs on the same host are serialized by ps.lock
+    currently_running = []
+    running = {}
+    started = {}
+    while pending or currently_running:
+        for hostname, manifest in list(pending):
+            if not dependencies[manifest] <= applied:
                 continue
-
-            host_dir = config['HOST_DETAILS'][hostname]['tmpdir']
-            print("Applying %s" % manifest)
-            server = utils.ScriptRunner(hostname)
-
-            man_path = os.path.join(config['HOST_DETAILS'][hostname]['tmpdir'],
-                                    basedefs.PUPPET_MANIFEST_RELATIVE,
-                                    manifest)
-
-            running_logfile = "%s.running" % man_path
-            finished_logfile = "%s.finished" % man_path
+            pending.remove((hostname, manifest))
+            started[manifest] = time.time()
+            finished_logfile = _run_puppet(config, hostname, manifest,
+                                           loglevel, logcmd, watcher)
             currently_running.append((hostname, finished_logfile))
-
-            server.append("touch %s" % running_logfile)
-            server.append("chmod 600 %s" % running_logfile)
-            server.append("export PACKSTACK_VAR_DIR=%s" % host_dir)
-            cmd = ("( flock %s/ps.lock "
-                   "puppet apply %s --modulepath %s/modules %s > %s "
-                   "2>&1 < /dev/null ; "
-                   "mv %s %s ) > /dev/null 2>&1 < /dev/null &"
-                   % (host_dir, loglevel, host_dir, man_path, running_logfile,
-                      running_logfile, finished_logfile))
-            server.append(cmd)
-            server.execute(log=logcmd)
-
-    # wait for outstanding puppet runs befor exiting
-    wait_for_puppet(currently_running, messages)
+            running[finished_logfile] = manifest
+
+        if not currently_running:
+            raise PuppetError(
+                'Unable to apply manifest(s) %s, dependencies cannot be '
+                'satisfied.' % ', '.join([i[1] for i in pending])
+            )
+        for hostname, finished_logfile in wait_for_puppet(
+                currently_running, messages, watcher, wait_all=False):
+            manifest = running.pop(finished_logfile)
+            utils.timing.add(manifest, 'puppet', started[manifest],
+                             time.time(), host=hostname,
+                             lane='puppet %s' % hostname)
+            applied.add(manifest)
+
+
+def _run_puppet(config, hostname, manifest, loglevel, logcmd, watcher):
+    """
+    Starts puppet run of given manifest in the background and returns path
+    to the log file which will exist on the host once the run is finished.
+    """
+    host_dir = config['HOST_DETAILS'][hostname]['tmpdir']
+    print("Applying %s" % manifest)
+    server = utils.ScriptRunner(hostname)
+
+    man_path = os.path.join(host_dir, basedefs.PUPPET_MANIFEST_RELATIVE,
+                            manifest)
+
+    running_logfile = "%s.running" % man_path
+    finished_logfile = "%s.finished" % man_path
+    pidfile = "%s.pid" % man_path
+    events_file = os.path.join(host_dir, 'ps.events')
+    watcher.follow(hostname, events_file)
+
+    server.append("touch %s" % running_logfile)
+    server.append("chmod 600 %s" % running_logfile)
+    server.append("export PACKSTACK_VAR_DIR=%s" % host_dir)
+    cmd = ("( flock %s/ps.lock "
+           "puppet apply %s --modulepath %s/modules %s > %s "
+           "2>&1 < /dev/null ; "
+           "mv %s %s ; echo %s >> %s ) "
+           "> /dev/null 2>&1 < /dev/null & echo $! > %s"
+           % (host_dir, loglevel, host_dir, man_path, running_logfile,
+              running_logfile, finished_logfile, finished_logfile,
+              events_file, pidfile))
+    server.append(cmd)
+    server.execute(log=logcmd)
+    # log is streamed back while puppet is running
+    watcher.stream_log(hostname, running_logfile, finished_logfile, pidfile)
+    return finished_logfile
 
 
 def finalize(config, messages):
-    for hostname in filtered_hosts(config):
+    if config.get('DRY_RUN'):
+        return
+
+    def check_kernel(hostname):
         server = utils.ScriptRunner(hostname)
         server.append("installed=$(rpm -q kernel --last | head -n1 | "
                       "sed 's/kernel-\([a-z0-9\.\_\-]*\).*/\\1/g')")
         server.append("loaded=$(uname -r | head -n1)")
         server.append('[ "$loaded" == "$installed" ]')
         try:
-            rc, out = server.execute()
+            server.execute()
         except ScriptRuntimeError:
+            return False
+        return True
+
+    for hostname, uptodate in for_each_host(config, check_kernel).items():
+        if not uptodate:
             messages.append('Because of the kernel update the host %s '
                             'requires reboot.' % hostname)
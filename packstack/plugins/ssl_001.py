@@ -17,14 +17,18 @@ Plugin responsible for managing SSL options
 """
 import os
 
-from OpenSSL import crypto
 from socket import gethostname
 
 from packstack.installer import basedefs
 from packstack.installer import utils
 from packstack.installer import validators
+from packstack.installer.setup_controller import Controller
 
 from packstack.modules.documentation import update_params_usage
+from packstack.modules.ospluginutils import cert_factory
+from packstack.modules.ospluginutils import generate_key
+from packstack.modules.ospluginutils import signature_digest
+from packstack.modules.ospluginutils import ssl_key_params
 
 # ------------- SSL Packstack Plugin Initialization --------------
 
@@ -86,6 +90,46 @@ def initConfig(controller):
              "CONF_NAME": 'CONFIG_SSL_CACERT_SELFSIGN',
              "USE_DEFAULT": False,
              "NEED_CONFIRM": False,
+             "CONDITION": False},
+
+            {"CMD_OPTION": "ssl-key-algorithm",
+             "PROMPT": ("Enter the algorithm of generated SSL keys, rsa or "
+                        "ec (ECDSA)"),
+             "OPTION_LIST": ["rsa", "ec"],
+             "VALIDATORS": [validators.validate_options],
+             "DEFAULT_VALUE": "rsa",
+             "MASK_INPUT": False,
+             "LOOSE_VALIDATION": False,
+             "CONF_NAME": 'CONFIG_SSL_KEY_ALGORITHM',
+             "USE_DEFAULT": True,
+             "NEED_CONFIRM": False,
+             "CONDITION": False},
+
+            {"CMD_OPTION": "ssl-key-size",
+             "PROMPT": ("Enter the size of generated SSL keys in bits, "
+                        "empty for 4096 with rsa and 256 with ec"),
+             "OPTION_LIST": [],
+             "VALIDATORS": [validators.validate_integer,
+                            validate_key_size],
+             "DEFAULT_VALUE": "",
+             "MASK_INPUT": False,
+             "LOOSE_VALIDATION": False,
+             "CONF_NAME": 'CONFIG_SSL_KEY_SIZE',
+             "USE_DEFAULT": True,
+             "NEED_CONFIRM": False,
+             "CONDITION": False},
+
+            {"CMD_OPTION": "ssl-key-pregen",
+             "PROMPT": ("Enter the number of SSL keys to generate in "
+                        "advance while hosts are being prepared"),
+             "OPTION_LIST": [],
+             "VALIDATORS": [validators.validate_integer],
+             "DEFAULT_VALUE": 0,
+             "MASK_INPUT": False,
+             "LOOSE_VALIDATION": False,
+             "CONF_NAME": 'CONFIG_SSL_KEY_PREGEN',
+             "USE_DEFAULT": True,
+             "NEED_CONFIRM": False,
              "CONDITION": False}
         ],
 
@@ -197,6 +241,18 @@ def initConfig(controller):
 
 
 def initSequences(controller):
+    config = controller.CONF
+    if (config['CONFIG_AMQP_ENABLE_SSL'] == 'y' or
+            config['CONFIG_HORIZON_SSL'] == 'y'):
+        cert_factory.keys.configure(*ssl_key_params(config))
+        # worker processes have to be forked before any step starts
+        # threads, keys are generated while hosts are discovered and
+        # prepared
+        count = 0
+        if not config.get('DRY_RUN'):
+            count = int(config['CONFIG_SSL_KEY_PREGEN'])
+        cert_factory.keys.prewarm(count)
+
     ssl_steps = [
         {'title': 'Setting up CACERT',
          'functions': [create_self_signed_cert]}
@@ -207,10 +263,25 @@ def initSequences(controller):
 
 # ------------------------- helper functions -------------------------
 
+def validate_key_size(param, options=None):
+    """
+    Raises ParamValidationError if given key size is not usable with
+    CONFIG_SSL_KEY_ALGORITHM, which is validated before the size.
+    """
+    if not param:
+        return
+    config = Controller().CONF
+    ssl_key_params({
+        'CONFIG_SSL_KEY_ALGORITHM': config.get('CONFIG_SSL_KEY_ALGORITHM'),
+        'CONFIG_SSL_KEY_SIZE': param,
+    })
+
+
 def create_self_signed_cert(config, messages):
     """
     OpenSSL wrapper to create selfsigned CA.
     """
+    from OpenSSL import crypto
 
     # for now hardcoded place for landing CACert file on servers
     config['CONFIG_SSL_CACERT'] = '/etc/pki/tls/certs/packstack_cacert.crt'
@@ -243,8 +314,8 @@ def create_self_signed_cert(config, messages):
     )
     if not os.path.exists(CERT_FILE) or not os.path.exists(KEY_FILE):
         # create a key pair
-        k = crypto.PKey()
-        k.generate_key(crypto.TYPE_RSA, 4096)
+        k = crypto.load_privatekey(crypto.FILETYPE_PEM,
+                                   generate_key(*ssl_key_params(config)))
 
         # create a self-signed cert
         mail = config['CONFIG_SELFSIGN_CACERT_SUBJECT_MAIL']
@@ -280,7 +351,7 @@ def create_self_signed_cert(config, messages):
                 "keyid:always".encode('ascii'), issuer=cert)
         ])
 
-        cert.sign(k, 'sha1')
+        cert.sign(k, signature_digest(k))
 
         open((CERT_FILE), "wt").write(
             crypto.dump_certificate(crypto.FILETYPE_PEM, cert))
@@ -19,7 +19,6 @@ Installs and configures Swift
 import os
 import re
 import uuid
-import netaddr
 
 from packstack.installer import basedefs
 from packstack.installer import validators
@@ -182,6 +181,8 @@ def parse_devices(config):
     """
     Returns dict containing information about Swift storage devices.
     """
+    import netaddr
+
     devices = []
     device_number = 0
     num_zones = int(config["CONFIG_SWIFT_STORAGE_ZONES"])
@@ -345,7 +346,6 @@ def create_storage_manifest(config, messages):
 
 
 def create_common_manifest(config, messages):
-    for manifestfile, marker in manifestfiles.getFiles():
-        if manifestfile.endswith("_swift.pp"):
-            data = getManifestTemplate("swift_common")
-            appendManifestFile(os.path.split(manifestfile)[1], data)
+    for manifestfile in manifestfiles.getNamedFiles("swift.pp"):
+        data = getManifestTemplate("swift_common")
+        appendManifestFile(os.path.split(manifestfile)[1], data)
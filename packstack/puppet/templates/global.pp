@@ -6,3 +6,6 @@ $use_subnets = $use_subnets_value ? {
 }
 
 Exec { timeout => hiera('DEFAULT_EXEC_TIMEOUT') }
+
+# packages are fetched through the package cache if it is used
+Package { install_options => hiera('PACKAGE_CACHE_YUM_OPTIONS', []) }
@@ -13,7 +13,6 @@
 # limitations under the License.
 
 import os
-import pkg_resources
 
 from .installer.utils import execute
 
@@ -69,6 +68,8 @@ def vr_from_git():
 
 def vr_from_setuptools():
     """Returns VR string fetched from setuptools."""
+    import pkg_resources
+
     requirement = pkg_resources.Requirement.parse('packstack')
     provider = pkg_resources.get_provider(requirement)
     return provider.version
@@ -76,9 +76,10 @@ class CommandLineTestCase(PackstackTestCaseMixin, TestCase):
                                      'openstack-icehouse',
                                      stdout='[openstack-icehouse]\nenabled=1')
 
-        FakePopen.register_as_script(
+        FakePopen.register_script_pattern(
             'facter -p',
-            stdout='operatingsystem => Fedora\noperatingsystemmajrelease => 21'
+            stdout='##packstack-facts-json\n{"operatingsystem": "Fedora", '
+                   '"operatingsystemmajrelease": "21"}'
         )
 
         # required by packstack.plugins.nova_300.gather_host_keys
@@ -97,6 +98,12 @@ class CommandLineTestCase(PackstackTestCaseMixin, TestCase):
         makefile(os.path.join(basedefs.VAR_DIR, 'nova_migration_key.pub'),
                  'ssh-rsa keydata')
 
+        # bundles streamed to hosts are created by faked tar
+        bundle_dir = os.path.join(basedefs.VAR_DIR, 'bundles')
+        os.mkdir(bundle_dir)
+        for name in ('hieradata-127.0.0.1', 'manifests', 'modules'):
+            makefile(os.path.join(bundle_dir, '%s.tar.gz' % name), '')
+
         # Save sys.argv and replace it with the args we want optparse to use
         orig_argv = sys.argv
         sys.argv = ['packstack', '--debug',
@@ -110,6 +117,8 @@ class CommandLineTestCase(PackstackTestCaseMixin, TestCase):
         orig_validate_logfile = puppet.validate_logfile
         puppet.validate_logfile = lambda a: None
         puppet.scan_logfile = lambda a: []
+        orig_analyze_logfile = puppet.analyze_logfile
+        puppet.analyze_logfile = lambda a: puppet.LogAnalyzer(a)
 
         # If there is a error in a plugin sys.exit() gets called, this masks
         # the actual error that should be reported, so we replace it to
@@ -124,6 +133,7 @@ class CommandLineTestCase(PackstackTestCaseMixin, TestCase):
         finally:
             sys.argv = orig_argv
             ospluginutils.validate_puppet_logfile = orig_validate_logfile
+            puppet.analyze_logfile = orig_analyze_logfile
             sys.exit = orig_sys_exit
             try:
                 shutil.rmtree(basedefs.VAR_DIR)
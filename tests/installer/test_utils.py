@@ -19,15 +19,29 @@
 Test cases for packstack.installer.utils module.
 """
 
+import json
+import os
+import Queue
 import shutil
+import SimpleHTTPServer
+import socket
+import SocketServer
+import StringIO
+import subprocess
 import tempfile
+import threading
+import urllib2
 from unittest import TestCase
 
 from ..test_base import FakePopen
 from ..test_base import PackstackTestCaseMixin
 from packstack.installer.utils import *
+from packstack.installer.utils import pkgcache
+from packstack.installer.utils import transport
 from packstack.installer.utils.strings import STR_MASK
 from packstack.installer.exceptions import ExecuteRuntimeError
+from packstack.installer.exceptions import MultiHostError
+from packstack.installer.exceptions import ScriptRuntimeError
 
 
 cnt = 0
@@ -115,3 +129,252 @@ class ParameterTestCase(PackstackTestCaseMixin, TestCase):
         hostlist = list(hosts(conf))
         hostlist.sort()
         self.assertEqual(['1.1.1.1', '2.2.2.2', '3.3.3.3'], hostlist)
+
+    def test_run_on_hosts(self):
+        """Test packstack.installer.utils.parallel.run_on_hosts."""
+        hostlist = ['3.3.3.3', '1.1.1.1', '2.2.2.2']
+        result = run_on_hosts(lambda host: host.split('.')[0], hostlist,
+                              limit=2)
+        self.assertEqual(result.keys(), hostlist)
+        self.assertEqual(result.values(), ['3', '1', '2'])
+
+        def fail(host):
+            if host != '1.1.1.1':
+                raise ValueError('failed on %s' % host)
+            return host
+        try:
+            run_on_hosts(fail, hostlist)
+        except MultiHostError as ex:
+            self.assertEqual(ex.errors.keys(), ['3.3.3.3', '2.2.2.2'])
+            self.assertEqual(ex.results.keys(), ['1.1.1.1'])
+        else:
+            self.fail('MultiHostError was not raised')
+        self.assertRaises(ValueError, run_on_hosts, fail, hostlist, limit=-1)
+        self.assertRaises(ValueError, run_on_hosts, fail, hostlist, limit=0)
+
+
+class SshConnectionPoolTestCase(PackstackTestCaseMixin, TestCase):
+    def test_options(self):
+        """Test packstack.installer.utils.transport.SshConnectionPool."""
+        pool = SshConnectionPool(check_interval=0)
+        opts = pool.options('1.2.3.4')
+        self.assertEqual(opts, ['-o', 'ControlPath=%s'
+                                % pool.control_path('1.2.3.4')])
+        self.assertNotEqual(pool.control_path('1.2.3.4'),
+                            pool.control_path('1.2.3.5'))
+        # failed health check restarts the master connection
+        FakePopen.register(['ssh', '-o', 'ControlPath=%s'
+                            % pool.control_path('1.2.3.4'),
+                            '-O', 'check', 'root@1.2.3.4'], returncode=255)
+        self.assertFalse(pool.check('1.2.3.4'))
+        self.assertEqual(pool.options('1.2.3.4'), opts)
+        pool.close_all()
+        self.assertFalse(pool.check('1.2.3.4'))
+
+
+class RemoteFollowerTestCase(PackstackTestCaseMixin, TestCase):
+    def test_follower(self):
+        """Test packstack.installer.utils.shell.RemoteFollower."""
+        events = Queue.Queue()
+        follower = RemoteFollower('1.2.3.4', '/tmp/ps.events', events)
+        cmd = (["ssh", "-o", "StrictHostKeyChecking=no",
+                "-o", "UserKnownHostsFile=/dev/null"] +
+               ssh_pool.options('1.2.3.4') +
+               ["root@1.2.3.4", follower._cmd % {'path': '/tmp/ps.events'}])
+        FakePopen.register(cmd, stdout='first\n\nsecond\n')
+        follower.start()
+        self.assertEqual(events.get(timeout=5), ('1.2.3.4', 'first'))
+        self.assertEqual(events.get(timeout=5), ('1.2.3.4', 'second'))
+        self.assertEqual(events.get(timeout=5), ('1.2.3.4', None))
+        self.assertFalse(follower.alive)
+        follower.stop()
+        ssh_pool.close_all()
+
+
+class TransportTestCase(PackstackTestCaseMixin, TestCase):
+    def test_local(self):
+        """Test packstack.installer.utils.transport.LocalTransport."""
+        subprocess.Popen = self._Popen
+        transport = LocalTransport()
+        rc, out, err = transport.run_script('1.2.3.4', 'echo test')
+        self.assertEqual((rc, out), (0, 'test\n'))
+
+        path = os.path.join(self.tempdir, 'data')
+        rc, out, err = transport.put_stream('1.2.3.4', 'cat > %s' % path,
+                                            StringIO.StringIO('data\n'))
+        self.assertEqual(rc, 0)
+        copy = os.path.join(self.tempdir, 'copy')
+        transport.put_file('1.2.3.4', path, copy)
+        fetched = os.path.join(self.tempdir, 'fetched')
+        transport.get_file('1.2.3.4', copy, fetched)
+        with open(fetched) as fp:
+            self.assertEqual(fp.read(), 'data\n')
+
+        missing = os.path.join(self.tempdir, 'missing')
+        self.assertRaises(ScriptRuntimeError, transport.get_file,
+                          '1.2.3.4', missing, fetched)
+        self.assertFalse(os.path.exists(fetched))
+
+    def test_select(self):
+        """Test packstack.installer.utils.transport.set_transport."""
+        self.assertIsInstance(get_transport(), LocalTransport)
+        self.assertIsInstance(get_transport('1.2.3.4'), OpenSshTransport)
+        self.assertRaises(ValueError, set_transport, 'telnet')
+        FakePopen.register(['ip', '-o', 'addr'], stdout=(
+            '1: lo    inet 127.0.0.1/8 scope host lo\\       valid_lft\n'
+            '2: eth0    inet 192.0.2.10/24 brd 192.0.2.255 scope global '
+            'eth0\\       valid_lft forever\n'
+            '2: eth0    inet6 fe80::1/64 scope link \\       valid_lft\n'
+        ))
+        transport._local_hosts.clear()
+        transport._local_addresses = None
+        self.assertTrue(is_local_host('127.0.0.1'))
+        self.assertTrue(is_local_host('192.0.2.10'))
+        self.assertTrue(is_local_host('fe80::1'))
+        # addresses which only could be bound to are not local
+        self.assertFalse(is_local_host('192.0.2.1'))
+        transport._local_hosts.clear()
+        transport._local_addresses = None
+        set_transport('openssh', local_shortcut=False)
+        self.assertIsInstance(get_transport('127.0.0.1'), OpenSshTransport)
+        set_transport('local')
+        try:
+            self.assertIsInstance(get_transport('1.2.3.4'), LocalTransport)
+        finally:
+            set_transport('openssh')
+
+
+class PackageCacheTestCase(PackstackTestCaseMixin, TestCase):
+    def setUp(self):
+        super(PackageCacheTestCase, self).setUp()
+        self.upstream_dir = tempfile.mkdtemp()
+        self.cache_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.upstream_dir, 'repo', 'repodata'))
+        for name in ('repo/test-1.0-1.noarch.rpm',
+                     'repo/repodata/repomd.xml'):
+            with open(os.path.join(self.upstream_dir, name), 'w') as fp:
+                fp.write(name)
+
+        upstream_dir = self.upstream_dir
+
+        class Handler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+            def translate_path(self, path):
+                return os.path.join(upstream_dir, path.lstrip('/'))
+
+            def log_message(self, *args):
+                pass
+
+        self.upstream = SocketServer.TCPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=self.upstream.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.base = ('http://127.0.0.1:%d/repo/'
+                     % self.upstream.server_address[1])
+        self.cache = PackageCache()
+        url = self.cache.start('127.0.0.1', 0, self.cache_dir)
+        self.cache.add_client('127.0.0.1')
+        self.opener = urllib2.build_opener(urllib2.ProxyHandler({'http': url}))
+
+    def tearDown(self):
+        self.cache.stop()
+        self.upstream.shutdown()
+        self.upstream.server_close()
+        shutil.rmtree(self.upstream_dir)
+        shutil.rmtree(self.cache_dir)
+        super(PackageCacheTestCase, self).tearDown()
+
+    def test_cache(self):
+        """Test packstack.installer.utils.pkgcache.PackageCache."""
+        package = self.base + 'test-1.0-1.noarch.rpm'
+        for i in range(2):
+            data = self.opener.open(package).read()
+            self.assertEqual(data, 'repo/test-1.0-1.noarch.rpm')
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        self.assertTrue(os.path.isfile(self.cache.cache_path(package)))
+
+        # package is served from cache even when upstream lost it
+        os.unlink(os.path.join(self.upstream_dir, 'repo',
+                               'test-1.0-1.noarch.rpm'))
+        self.assertEqual(self.opener.open(package).read(),
+                         'repo/test-1.0-1.noarch.rpm')
+
+        # repository metadata are not cached
+        metadata = self.base + 'repodata/repomd.xml'
+        self.assertIsNone(self.cache.cache_path(metadata))
+        self.assertEqual(self.opener.open(metadata).read(),
+                         'repo/repodata/repomd.xml')
+        try:
+            self.opener.open(self.base + 'missing-1.0-1.noarch.rpm')
+        except urllib2.HTTPError as ex:
+            self.assertEqual(ex.code, 404)
+        else:
+            self.fail('HTTPError was not raised')
+        self.assertIn(self.cache.url, self.cache.yum_check_command())
+        self.assertTrue(self.cache.is_usable(
+            'curl output\n%s\n' % pkgcache.YUM_PROXY_MARKER))
+        self.assertFalse(self.cache.is_usable(
+            'Package cache %s is not reachable\n' % self.cache.url))
+        self.assertEqual(self.cache.yum_options(),
+                         ['--setopt=proxy=%s' % self.cache.url])
+
+    def test_cache_clients(self):
+        """Test PackageCache serves only deployment hosts."""
+        # tunnels are allowed only to HTTPS port
+        sock = socket.create_connection(self.cache._server.server_address)
+        try:
+            sock.sendall('CONNECT 127.0.0.1:22 HTTP/1.0\r\n\r\n')
+            # whole response is read, so the server does not write to
+            # a closed connection
+            response = sock.makefile().read()
+            self.assertIn(' 403 ', response.split('\r\n')[0])
+        finally:
+            sock.close()
+
+        self.cache.addresses.clear()
+        try:
+            self.opener.open(self.base + 'test-1.0-1.noarch.rpm')
+        except urllib2.HTTPError as ex:
+            self.assertEqual(ex.code, 403)
+        else:
+            self.fail('HTTPError was not raised')
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 0))
+
+
+class TimingTestCase(PackstackTestCaseMixin, TestCase):
+    def test_timing(self):
+        """Test packstack.installer.utils.timing.Timing."""
+        timer = Timing()
+        with timer.span('Preparing servers', 'step'):
+            timer.add('nova.pp', 'puppet', timer.origin, timer.origin + 2,
+                      host='1.1.1.1', lane='puppet 1.1.1.1')
+        try:
+            with timer.span('Failing step', 'step'):
+                raise ValueError('failed')
+        except ValueError:
+            pass
+        timer.count_ssh('1.1.1.1', sent=10, received=20)
+        timer.count_ssh('1.1.1.1', received=5, round_trips=0)
+
+        report = timer.report()
+        self.assertEqual([i['name'] for i in report['spans']],
+                         ['nova.pp', 'Preparing servers', 'Failing step'])
+        self.assertEqual(report['spans'][2]['args'], {'status': 'error'})
+        self.assertAlmostEqual(report['totals']['puppet'], 2)
+        self.assertEqual(report['ssh'], {'1.1.1.1': {'round_trips': 1,
+                                                     'bytes_sent': 10,
+                                                     'bytes_received': 25}})
+
+        events = timer.chrome_trace()['traceEvents']
+        lanes = [i['args']['name'] for i in events if i['ph'] == 'M']
+        self.assertEqual(lanes, ['puppet 1.1.1.1', 'MainThread'])
+        puppet = [i for i in events if i['name'] == 'nova.pp'][0]
+        self.assertEqual((puppet['ts'], puppet['dur']), (0, 2000000))
+        self.assertEqual(puppet['args'], {'host': '1.1.1.1'})
+
+        tempdir = tempfile.mkdtemp()
+        try:
+            for path in timer.write(tempdir):
+                with open(path) as fp:
+                    self.assertTrue(json.load(fp))
+        finally:
+            shutil.rmtree(tempdir)
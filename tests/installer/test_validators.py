@@ -100,6 +100,15 @@ class ValidatorsTestCase(PackstackTestCaseMixin, TestCase):
         self.assertRaises(ParamValidationError, validate_ssh,
                           '255.255.255.255')
 
+    def test_validate_multi_ssh(self):
+        """Test packstack.installer.validators.validate_multi_ssh."""
+        try:
+            validate_multi_ssh('255.255.255.255, 256.1.1.1')
+        except ParamValidationError as ex:
+            self.assertIn('255.255.255.255, 256.1.1.1', str(ex))
+        else:
+            self.fail('ParamValidationError was not raised')
+
     def test_validate_float(self):
         """Test packstack.installer.validators.validate_float."""
         validate_float('5.3')
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import os
+from unittest import TestCase
+
+from ..test_base import PackstackTestCaseMixin
+from packstack.modules.documentation import parse_usage
+
+
+RST = '''=========
+Packstack
+=========
+
+SYNOPSIS
+========
+
+packstack [options]
+
+OPTIONS
+=======
+
+Global Options
+--------------
+
+**CONFIG_A**
+    First option.
+
+**CONFIG_B**
+    Second option%s.
+'''
+
+
+class DocumentationTestCase(PackstackTestCaseMixin, TestCase):
+    def test_parse_usage_cache(self):
+        path = os.path.join(self.tempdir, 'packstack.rst')
+        cache_file = os.path.join(self.tempdir, 'usage.json')
+        with open(path, 'w') as fp:
+            fp.write(RST % '')
+        usage = {'CONFIG_A': 'First option.', 'CONFIG_B': 'Second option.'}
+        self.assertEqual(parse_usage(path, cache_file=cache_file), usage)
+        with open(cache_file) as fp:
+            self.assertEqual(json.load(fp)['usage'], usage)
+        self.assertEqual(parse_usage(path, cache_file=cache_file), usage)
+
+        # changed rst file is parsed again
+        with open(path, 'w') as fp:
+            fp.write(RST % ' changed')
+        usage['CONFIG_B'] = 'Second option changed.'
+        self.assertEqual(parse_usage(path, cache_file=cache_file), usage)
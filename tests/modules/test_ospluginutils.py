@@ -15,10 +15,23 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import os
 from unittest import TestCase
 
+from OpenSSL import crypto
+
 from ..test_base import PackstackTestCaseMixin
+from packstack.modules.ospluginutils import CertificateFactory
+from packstack.modules.ospluginutils import generate_key
+from packstack.modules import ospluginutils
 from packstack.modules.ospluginutils import gethostlist
+from packstack.modules.ospluginutils import KeyPool
+from packstack.modules.ospluginutils import ssl_key_params
+from packstack.modules.ospluginutils import ManifestFiles
+from packstack.modules.ospluginutils import TemplateCache
+from packstack.installer import basedefs
+from packstack.installer.exceptions import ParamValidationError
+from packstack.installer.utils import timing
 
 
 class OSPluginUtilsTestCase(PackstackTestCaseMixin, TestCase):
@@ -28,3 +41,170 @@ class OSPluginUtilsTestCase(PackstackTestCaseMixin, TestCase):
         hosts = gethostlist(conf)
         hosts.sort()
         self.assertEqual(['1.1.1.1', '2.2.2.2', '3.3.3.3'], hosts)
+
+    def test_manifest_dependencies(self):
+        manifests = ManifestFiles()
+        manifests.addFile('1.1.1.1_prescript.pp', 'a', requires=[])
+        manifests.addFile('2.2.2.2_prescript.pp', 'a', requires=[])
+        manifests.addFile('1.1.1.1_keystone.pp', 'b')
+        manifests.addFile('2.2.2.2_nova.pp', 'c',
+                          requires=['1.1.1.1_keystone.pp', '3.3.3.3_x.pp'])
+        manifests.addFile('2.2.2.2_nova.pp', 'd', requires=['1.1.1.1_y.pp'])
+        manifests.addFile('1.1.1.1_nova.pp', 'c')
+        deps = manifests.getDependencies()
+        self.assertEqual(deps['1.1.1.1_prescript.pp'], set())
+        self.assertEqual(deps['1.1.1.1_keystone.pp'],
+                         set(['1.1.1.1_prescript.pp', '2.2.2.2_prescript.pp']))
+        self.assertEqual(deps['2.2.2.2_nova.pp'],
+                         set(['2.2.2.2_prescript.pp', '1.1.1.1_keystone.pp']))
+        self.assertEqual(deps['1.1.1.1_nova.pp'],
+                         set(['1.1.1.1_prescript.pp', '2.2.2.2_prescript.pp',
+                              '1.1.1.1_keystone.pp']))
+
+    def test_manifest_indexes(self):
+        manifests = ManifestFiles()
+        manifests.addFile('1.1.1.1_nova.pp', 'a', 'one')
+        manifests.addFile('1.1.1.1_api_nova.pp', 'b')
+        manifests.addFile('2.2.2.2_nova.pp', 'b')
+        manifests.addFile('1.1.1.1_nova.pp', 'c', 'two')
+        self.assertEqual(manifests.data['1.1.1.1_nova.pp'], ['one', 'two'])
+        self.assertEqual(manifests.getHostFiles('1.1.1.1'),
+                         ['1.1.1.1_nova.pp', '1.1.1.1_api_nova.pp'])
+        self.assertEqual(manifests.getNamedFiles('nova.pp'),
+                         ['1.1.1.1_nova.pp', '1.1.1.1_api_nova.pp',
+                          '2.2.2.2_nova.pp'])
+        self.assertEqual(manifests.getMarkerFiles('b'),
+                         ['1.1.1.1_api_nova.pp', '2.2.2.2_nova.pp'])
+        self.assertEqual(manifests.getHost('1.1.1.1_api_nova.pp'), '1.1.1.1')
+
+    def test_hiera_data(self):
+        manifests = ManifestFiles()
+        manifests.global_data = "$x = hiera('CONFIG_GLOBAL')"
+        manifests.addFile('1.1.1.1_nova.pp', 'a',
+                          "hiera_array('CONFIG_A')\nhiera('CONFIG_MISSING')")
+        manifests.addFile('2.2.2.2_nova.pp', 'a', "hiera('CONFIG_B', {})")
+        config = {'CONFIG_GLOBAL': 'g', 'CONFIG_A': ['a'], 'CONFIG_B': 'b',
+                  'CONFIG_IP_VERSION': 'ipv4', 'HOST_DETAILS': {}}
+        orig_manifestfiles = ospluginutils.manifestfiles
+        ospluginutils.manifestfiles = manifests
+        try:
+            self.assertEqual(ospluginutils.hiera_data('1.1.1.1', config),
+                             {'CONFIG_GLOBAL': 'g', 'CONFIG_A': ['a'],
+                              'CONFIG_IP_VERSION': 'ipv4'})
+        finally:
+            ospluginutils.manifestfiles = orig_manifestfiles
+
+    def test_shared_manifests(self):
+        manifests = ManifestFiles()
+        manifests.global_data = "$x = hiera('CONFIG_GLOBAL')"
+        for host in ('1.1.1.1', '2.2.2.2'):
+            manifests.addFile('%s_nova.pp' % host, 'a', "hiera('HOST_X')")
+            manifests.setHostHiera(host, 'HOST_X', host)
+        manifests.addFile('3.3.3.3_nova.pp', 'a', 'other')
+        config = {'CONFIG_GLOBAL': 'g', 'HOST_X': 'ignored',
+                  'CONFIG_IP_VERSION': 'ipv4', 'HOST_DETAILS': {}}
+        orig_manifestfiles = ospluginutils.manifestfiles
+        orig_manifest_dir = basedefs.PUPPET_MANIFEST_DIR
+        ospluginutils.manifestfiles = manifests
+        basedefs.PUPPET_MANIFEST_DIR = os.path.join(self.tempdir, 'manifests')
+        try:
+            manifests.writeManifests()
+            self.assertEqual(ospluginutils.hiera_data('2.2.2.2', config),
+                             {'CONFIG_GLOBAL': 'g', 'HOST_X': '2.2.2.2',
+                              'CONFIG_IP_VERSION': 'ipv4'})
+            inodes = dict(
+                (name, os.stat(os.path.join(basedefs.PUPPET_MANIFEST_DIR,
+                                            name)).st_ino)
+                for name in manifests.data
+            )
+        finally:
+            ospluginutils.manifestfiles = orig_manifestfiles
+            basedefs.PUPPET_MANIFEST_DIR = orig_manifest_dir
+        self.assertEqual(inodes['1.1.1.1_nova.pp'], inodes['2.2.2.2_nova.pp'])
+        self.assertNotEqual(inodes['1.1.1.1_nova.pp'],
+                            inodes['3.3.3.3_nova.pp'])
+
+    def test_template_cache(self):
+        with open(os.path.join(self.tempdir, 'test.pp'), 'w') as fp:
+            fp.write("$a = '%(CONFIG_A)s'\n$b = '%%(CONFIG_B)s %(CONFIG_C)s'")
+        cache = TemplateCache(self.tempdir)
+        timing.reset()
+        config = {'CONFIG_A': 'a', 'CONFIG_C': 'c'}
+        for i in range(3):
+            self.assertEqual(cache.render('test.pp', config),
+                             "$a = 'a'\n$b = '%(CONFIG_B)s c'")
+        self.assertEqual(cache.get('test.pp')[1], ['CONFIG_A', 'CONFIG_C'])
+        self.assertEqual(timing.counters, {'template_cache_misses': 1,
+                                           'template_cache_hits': 3})
+
+    def test_ssl_key_params(self):
+        def params(algorithm, size):
+            return ssl_key_params({'CONFIG_SSL_KEY_ALGORITHM': algorithm,
+                                   'CONFIG_SSL_KEY_SIZE': size})
+        self.assertEqual(params('rsa', ''), ('rsa', 4096))
+        self.assertEqual(params('rsa', '2048'), ('rsa', 2048))
+        self.assertEqual(params('ec', '384'), ('ec', 384))
+        self.assertRaises(ParamValidationError, params, 'rsa', '256')
+        self.assertRaises(ParamValidationError, params, 'ec', '300')
+
+    def test_key_pool_start(self):
+        pool = KeyPool()
+        pool.prewarm(0)
+        try:
+            self.assertIsNotNone(pool._workers)
+            self.assertEqual(len(pool._ready), 0)
+        finally:
+            pool.close()
+        self.assertIsNone(pool._workers)
+
+    def test_certificate_factory(self):
+        self._test_certificate_factory('rsa', 1024)
+
+    def test_certificate_factory_ec(self):
+        self._test_certificate_factory('ec', 256)
+
+    def _test_certificate_factory(self, algorithm, size):
+        key = crypto.load_privatekey(crypto.FILETYPE_PEM,
+                                     generate_key(algorithm, size))
+        ca = crypto.X509()
+        ca.get_subject().CN = 'ca'
+        ca.set_issuer(ca.get_subject())
+        ca.set_pubkey(key)
+        ca.set_serial_number(1)
+        ca.gmtime_adj_notBefore(0)
+        ca.gmtime_adj_notAfter(3600)
+        ca.sign(key, 'sha256')
+        config = {'CONFIG_SSL_CERT_DIR': self.tempdir,
+                  'CONFIG_SSL_CACERT': '/etc/pki/tls/certs/ca.crt',
+                  'CONFIG_SSL_CACERT_FILE': os.path.join(self.tempdir,
+                                                         'ca.crt'),
+                  'CONFIG_SSL_CACERT_KEY_FILE': os.path.join(self.tempdir,
+                                                             'ca.key'),
+                  'HOST_DETAILS': {'1.1.1.1': {'fqdn': 'host.example'}}}
+        for name in ('ST', 'L', 'O', 'OU', 'MAIL'):
+            config['CONFIG_SELFSIGN_CACERT_SUBJECT_%s' % name] = 'test'
+        config['CONFIG_SELFSIGN_CACERT_SUBJECT_C'] = '--'
+        with open(config['CONFIG_SSL_CACERT_FILE'], 'w') as fp:
+            fp.write(crypto.dump_certificate(crypto.FILETYPE_PEM, ca))
+        with open(config['CONFIG_SSL_CACERT_KEY_FILE'], 'w') as fp:
+            fp.write(crypto.dump_privatekey(crypto.FILETYPE_PEM, key))
+        os.mkdir(os.path.join(self.tempdir, 'certs'))
+
+        factory = CertificateFactory()
+        factory.keys.configure(algorithm, size)
+        factory.keys.prewarm(1)
+        for i in range(2):
+            factory.request(config, '1.1.1.1', 'nova', '/tmp/ssl_nova.key',
+                            '/tmp/ssl_nova.crt')
+        factory.request(config, '1.1.1.1', 'amqp', '/tmp/ssl_amqp.key',
+                        '/tmp/ssl_amqp.crt')
+        factory.flush(config)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.tempdir,
+                                                        'certs'))),
+                         ['1.1.1.1ssl_amqp.crt', '1.1.1.1ssl_nova.crt'])
+        with open(os.path.join(self.tempdir, 'certs',
+                               '1.1.1.1ssl_nova.crt')) as fp:
+            cert = crypto.load_certificate(crypto.FILETYPE_PEM, fp.read())
+        self.assertEqual(cert.get_subject().CN, 'nova/host.example')
+        self.assertEqual(cert.get_issuer().CN, 'ca')
+        self.assertEqual(cert.get_pubkey().bits(), size)
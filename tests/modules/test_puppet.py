@@ -18,9 +18,15 @@
 import os
 
 from unittest import TestCase
+from ..test_base import FakePopen
 from ..test_base import PackstackTestCaseMixin
 
 from packstack.installer.exceptions import PuppetError
+from packstack.modules import puppet
+from packstack.modules.puppet import LogAnalyzer
+from packstack.modules.puppet import analyze_logfile
+from packstack.modules.puppet import modules_digest
+from packstack.modules.puppet import modules_requires
 from packstack.modules.puppet import validate_logfile
 
 
@@ -60,3 +66,93 @@ class PuppetTestCase(PackstackTestCaseMixin, TestCase):
             sr_msg = ("Package openvswitch has not been found in enabled Yum "
                       "repos")
             assert sr_msg in ex_msg
+
+    def test_log_analyzer(self):
+        """Test packstack.modules.LogAnalyzer."""
+        analyzer = LogAnalyzer('/tmp/test.log')
+        notice = ("notice: /Stage[main]/Packstack/Notify[packstack_info]"
+                  "/message: defined 'message' as 'info message'\n")
+        analyzer.feed(notice[:20])
+        analyzer.feed(notice[20:] + "Everything went ok\nerr: Could not ")
+        self.assertEqual(analyzer.notices, ['info message'])
+        self.assertIsNone(analyzer.error)
+        analyzer.feed("prefetch database_grant provider 'mysql': /root/.my.cnf")
+        analyzer.close()
+        self.assertIsNone(analyzer.error)
+        self.assertEqual(len(analyzer.ignored), 1)
+        analyzer.feed("Error: Syntax error at line 1\n  Invalid tag x\n")
+        analyzer.close()
+        self.assertIsInstance(analyzer.error, PuppetError)
+        self.assertIn('Syntax error at line 1', str(analyzer.error))
+        self.assertEqual([i[0] for i in analyzer.errors],
+                         ['Error: Syntax error at line 1', 'Invalid tag x'])
+
+        # analysis of whole file gives the same results
+        filename = os.path.join(self.tempdir, 'test.log')
+        with open(filename, 'w') as fp:
+            fp.write(notice + "Everything went ok\nerr: Could not prefetch "
+                     "database_grant provider 'mysql': /root/.my.cnf\n"
+                     "Error: Syntax error at line 1\n  Invalid tag x")
+        result = analyze_logfile(filename)
+        self.assertEqual(result.notices, analyzer.notices)
+        self.assertEqual(result.ignored, analyzer.ignored)
+        self.assertEqual(result.errors, analyzer.errors)
+        # empty file can't be memory-mapped
+        open(filename, 'w').close()
+        self.assertEqual(analyze_logfile(filename).errors, [])
+
+    def test_modules_digest(self):
+        """Test packstack.modules.modules_digest."""
+        module_dir = os.path.join(self.tempdir, 'modules')
+        cache = os.path.join(self.tempdir, 'modules.digest')
+        for module in ('nova', 'stdlib', 'unused'):
+            os.makedirs(os.path.join(module_dir, module, 'manifests'))
+            path = os.path.join(module_dir, module, 'manifests', 'init.pp')
+            with open(path, 'w') as fp:
+                fp.write('class %s {}' % module)
+        digest = modules_digest(module_dir, ['stdlib', 'nova'], cache)
+        self.assertEqual(len(digest), 40)
+        self.assertTrue(os.path.exists(cache))
+        # unused modules do not affect digest
+        path = os.path.join(module_dir, 'unused', 'manifests', 'init.pp')
+        with open(path, 'w') as fp:
+            fp.write('changed')
+        self.assertEqual(modules_digest(module_dir, ['nova', 'stdlib']),
+                         digest)
+        # changed content changes digest
+        path = os.path.join(module_dir, 'nova', 'manifests', 'init.pp')
+        with open(path, 'w') as fp:
+            fp.write('class nova { }')
+        self.assertNotEqual(modules_digest(module_dir, ['nova', 'stdlib'],
+                                           cache), digest)
+
+    def test_modules_requires(self):
+        """Test packstack.modules.modules_requires."""
+        cache = os.path.join(self.tempdir, 'requires.json')
+        packages = ['modules', 'packstack', 'missing']
+        nevra_cmd = ['rpm', '-q', '--qf', puppet.RPM_NEVRA_FORMAT]
+        requires_cmd = ['rpm', '-q', '--qf', puppet.RPM_REQUIRES_FORMAT]
+        FakePopen.register(nevra_cmd + packages,
+                           stdout='modules 0:1.0-1.noarch\n'
+                                  'packstack 0:2.0-1.noarch\n'
+                                  'package missing is not installed\n',
+                           returncode=1)
+        FakePopen.register(requires_cmd + ['modules', 'packstack'],
+                           stdout='##packstack-requires modules\n'
+                                  'rubygem-json\n/bin/sh\nrpmlib(X)\n'
+                                  '##packstack-requires packstack\n'
+                                  'rubygem-json\nopenssl\n')
+        self.assertEqual(modules_requires(packages, cache),
+                         ['openssl', 'rubygem-json'])
+        # requirements of already seen package versions are not queried
+        FakePopen.register(requires_cmd + ['modules', 'packstack'],
+                           stdout='')
+        self.assertEqual(modules_requires(packages, cache),
+                         ['openssl', 'rubygem-json'])
+        FakePopen.register(nevra_cmd + packages,
+                           stdout='modules 0:1.0-2.noarch\n'
+                                  'packstack 0:2.0-1.noarch\n')
+        FakePopen.register(requires_cmd + ['modules'],
+                           stdout='##packstack-requires modules\nlsof\n')
+        self.assertEqual(modules_requires(packages, cache),
+                         ['lsof', 'openssl', 'rubygem-json'])
@@ -15,11 +15,15 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import re
 import shutil
+import StringIO
 import tempfile
 import subprocess
 import logging
 
+from packstack.installer.utils import network
+
 
 LOG = logging.getLogger(__name__)
 
@@ -34,6 +38,7 @@ class FakePopen(object):
 
     cmd_registry = {}
     script_registry = {}
+    script_patterns = []
 
     @classmethod
     def register(cls, args, stdout='', stderr='', returncode=0):
@@ -55,10 +60,21 @@ class FakePopen(object):
                                      'stderr': stderr,
                                      'returncode': returncode}
 
+    @classmethod
+    def register_script_pattern(cls, pattern, stdout='', stderr='',
+                                returncode=0):
+        '''Register a fake script matching the given regular expression.'''
+        cls.script_patterns.append((re.compile(pattern),
+                                    {'stdout': stdout,
+                                     'stderr': stderr,
+                                     'returncode': returncode}))
+
     def __init__(self, args, **kwargs):
         script = ["ssh", "-o", "StrictHostKeyChecking=no",
                   "-o", "UserKnownHostsFile=/dev/null"]
-        if args[-1] == "bash -x" and args[:5] == script:
+        # scripts for the local host are run without ssh
+        if (args[-1] == "bash -x" and args[:5] == script or
+                list(args) == ["bash", "-x"]):
             self._init_as_script(args, **kwargs)
         else:
             self._init_as_cmd(args, **kwargs)
@@ -76,25 +92,45 @@ class FakePopen(object):
         else:
             LOG.warning('call to unregistered command: %s', cmd)
             this = {'stdout': '', 'stderr': '', 'returncode': 0}
-
-        self.stdout = this['stdout']
-        self.stderr = this['stderr']
-        self.returncode = this['returncode']
+        self._set_result(this)
 
     def _init_as_script(self, args, **kwargs):
         self._is_script = True
+        self._set_result({'stdout': '', 'stderr': '', 'returncode': None})
+
+    def _set_result(self, this):
+        self._stdout = this['stdout']
+        self._stderr = this['stderr']
+        self.returncode = this['returncode']
+        # file-like objects for callers which do not use communicate
+        self.stdin = StringIO.StringIO()
+        self.stdout = StringIO.StringIO(self._stdout)
+        self.stderr = StringIO.StringIO(self._stderr)
 
     def communicate(self, input=None):
         if self._is_script:
             if input in self.script_registry:
                 this = self.script_registry[input]
             else:
-                LOG.warning('call to unregistered script: %s', input)
-                this = {'stdout': '', 'stderr': '', 'returncode': 0}
-            self.stdout = this['stdout']
-            self.stderr = this['stderr']
-            self.returncode = this['returncode']
-        return self.stdout, self.stderr
+                for pattern, this in self.script_patterns:
+                    if pattern.search(input):
+                        break
+                else:
+                    LOG.warning('call to unregistered script: %s', input)
+                    this = {'stdout': '', 'stderr': '', 'returncode': 0}
+            self._set_result(this)
+        return self._stdout, self._stderr
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self):
+        return self.returncode
+
+    def terminate(self):
+        pass
+
+    kill = terminate
 
 
 class PackstackTestCaseMixin(object):
@@ -109,6 +145,8 @@ class PackstackTestCaseMixin(object):
         # some plugins call popen, we're replacing it for tests
         self._Popen = subprocess.Popen
         self.fake_popen = subprocess.Popen = FakePopen
+        # local IP address is discovered using commands faked by tests
+        del network._localhost_ip[:]
 
     def tearDown(self):
         # remove the temp directory
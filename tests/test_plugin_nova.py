@@ -0,0 +1,39 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import base64
+import struct
+from unittest import TestCase
+
+from test_base import FakePopen
+from test_base import PackstackTestCaseMixin
+from packstack.plugins import nova_300
+
+
+class NovaPluginTestCase(PackstackTestCaseMixin, TestCase):
+    def test_gather_host_keys(self):
+        """Test packstack.plugins.nova_300.gather_host_keys."""
+        rsakey = base64.b64encode(struct.pack('>I', 7) + 'ssh-rsa' + 'key')
+        config = {'HOST_DETAILS': {'1.1.1.1': {'sshrsakey': rsakey},
+                                   '1.1.1.2': {'sshrsakey': 'broken'}}}
+        FakePopen.register_as_script(
+            'ssh-keyscan 1.1.1.2 1.1.1.3',
+            stdout='1.1.1.2 ssh-rsa key2\n# comment\n1.1.1.3 ssh-dss key3\n'
+        )
+        nova_300.compute_hosts = set(['1.1.1.1', '1.1.1.2', '1.1.1.3'])
+        nova_300.gather_host_keys(config, [])
+        self.assertEqual(config['HOST_KEYS_1.1.1.1'],
+                         '1.1.1.1 ssh-rsa %s' % rsakey)
+        self.assertEqual(config['HOST_KEYS_1.1.1.2'], '1.1.1.2 ssh-rsa key2')
+        self.assertEqual(config['HOST_KEYS_1.1.1.3'], '1.1.1.3 ssh-dss key3')
@@ -14,8 +14,10 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import os
 from unittest import TestCase
 
+from test_base import FakePopen
 from test_base import PackstackTestCaseMixin
 from packstack.plugins import prescript_000
 
@@ -54,3 +56,36 @@ class OSPluginUtilsTestCase(PackstackTestCaseMixin, TestCase):
         self.assertNotEqual(
             self.fake_popen.data.find('--password="%s"' % password), -1
         )
+
+    def test_dry_run_discovers_uncached_hosts(self):
+        """Make sure dry run discovers hosts without cached facts."""
+        cache_dir = prescript_000.FACTS_CACHE_DIR
+        prescript_000.FACTS_CACHE_DIR = os.path.join(self.tempdir, 'facts')
+        requires_cache = prescript_000.REQUIRES_CACHE
+        prescript_000.REQUIRES_CACHE = os.path.join(self.tempdir, 'req.json')
+        patterns = FakePopen.script_patterns[:]
+        del FakePopen.script_patterns[:]
+        try:
+            prescript_000.store_cached_facts(
+                '127.0.0.1', 'boot', {'osfamily': 'Cached'}
+            )
+            # the run directory must not be created on hosts during dry run
+            FakePopen.register_script_pattern('mkdir --mode', returncode=1)
+            FakePopen.register_script_pattern(
+                'facter',
+                stdout='%s boot\n%s\nosfamily => Discovered\n'
+                       % (prescript_000.BOOT_ID_MARKER,
+                          prescript_000.FACTS_MARKER % 'text')
+            )
+            config = {'DRY_RUN': True,
+                      'CONFIG_CONTROLLER_HOST': '127.0.0.1',
+                      'CONFIG_COMPUTE_HOSTS': '127.0.0.2'}
+            prescript_000.preinstall_and_discover(config, [])
+        finally:
+            FakePopen.script_patterns[:] = patterns
+            prescript_000.FACTS_CACHE_DIR = cache_dir
+            prescript_000.REQUIRES_CACHE = requires_cache
+
+        details = config['HOST_DETAILS']
+        self.assertEqual(details['127.0.0.1']['osfamily'], 'Cached')
+        self.assertEqual(details['127.0.0.2']['osfamily'], 'Discovered')
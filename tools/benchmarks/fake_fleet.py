@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark of Packstack orchestration overhead on a fleet of fake hosts.
+
+Full run_setup deployment is run against synthetic hosts, whose ssh and
+scp are replaced by local stand-ins. Each host is mapped to a sandbox
+directory; /etc, /var/tmp/packstack and home directory of the host are
+redirected there, home directory of Packstack user is sandboxed too.
+Remote package management, facter and puppet are stubbed, stub puppet
+apply sleeps for given time. Reported are end-to-end time, CPU time and
+peak memory of the Packstack process, CPU time of the whole process tree
+including the stand-ins, number of processes spawned by Packstack itself
+and number of processes created on the box.
+
+Usage: python tools/benchmarks/fake_fleet.py [-p PUPPET_SECONDS]
+                                             [-k] [HOSTS ...]
+       (default host counts are 1 10 100 500)
+"""
+
+import json
+import optparse
+import os
+import resource
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+
+
+FAKE_SSH = r'''#!/bin/bash
+# stand-in for ssh running commands in local sandbox of the host
+while [ $# -gt 0 ]; do
+    case "$1" in
+        # connection masters are not needed, control commands succeed
+        -N|-O) exit 0 ;;
+        -o|-p|-i|-l|-F) shift 2 ;;
+        -*) shift ;;
+        *) break ;;
+    esac
+done
+host=${1#*@}; host=${host#[}; host=${host%]}; shift
+root="$FAKE_FLEET_DIR/hosts/$host"
+rewrite() {
+    sed -e "s#/var/tmp/packstack#$root/var/tmp/packstack#g" \
+        -e "s#/etc/#$root/etc/#g"
+}
+cmd=$(printf '%s' "$*" | rewrite)
+export HOME="$root/root" FAKE_HOST="$host"
+export PATH="$FAKE_FLEET_DIR/remote-bin:$PATH"
+cd "$root"
+if [ "$cmd" == "bash -x" ]; then
+    rewrite | bash -x
+else
+    exec bash -c "$cmd"
+fi
+'''
+
+FAKE_SCP = r'''#!/bin/bash
+# stand-in for scp copying files from/to local sandbox of the host
+paths=()
+while [ $# -gt 0 ]; do
+    case "$1" in
+        -o|-P|-i|-l|-F) shift 2 ;;
+        -*) shift ;;
+        *) paths+=("$1"); shift ;;
+    esac
+done
+for i in "${!paths[@]}"; do
+    spec=${paths[$i]#*@}
+    [ "$spec" == "${paths[$i]}" ] && continue
+    if [[ "$spec" == \[* ]]; then
+        host=${spec#[}; host=${host%%]*}; path=${spec#*]:}
+    else
+        host=${spec%%:*}; path=${spec#*:}
+    fi
+    paths[$i]="$FAKE_FLEET_DIR/hosts/$host$path"
+done
+exec cp -r "${paths[@]}"
+'''
+
+FAKE_KEYSCAN = r'''#!/bin/bash
+for host; do
+    [[ "$host" == -* ]] && continue
+    echo "$host ssh-rsa AAAAB3NzaC1yc2EAAAADAQABAAABAQDfake$host"
+done
+'''
+
+FAKE_NOOP = '#!/bin/bash\nexit 0\n'
+
+# packages are not installed locally, as when running from source
+FAKE_LOCAL_RPM = r'''#!/bin/bash
+for pkg; do
+    [[ "$pkg" == -* || "$pkg" == *%* ]] || echo "package $pkg is not installed"
+done
+exit 1
+'''
+
+FAKE_REMOTE = r'''#!/bin/bash
+# stub of remote commands, behaviour is chosen by name it is called by
+case "$(basename $0)" in
+    facter)
+        cat <<EOF
+{"operatingsystem": "CentOS", "operatingsystemmajrelease": "7",
+ "osfamily": "RedHat", "hostname": "host-$FAKE_HOST",
+ "fqdn": "host-$FAKE_HOST.example.com", "interfaces": "eth0,lo",
+ "ipaddress": "$FAKE_HOST", "ipaddress_eth0": "$FAKE_HOST",
+ "netmask_eth0": "255.255.0.0", "ipaddress_lo": "127.0.0.1",
+ "netmask_lo": "255.0.0.0", "processorcount": 4,
+ "memorysize_mb": "7822.34"}
+EOF
+        ;;
+    puppet)
+        sleep "${FAKE_PUPPET_SECONDS:-0}"
+        echo "Notice: Compiled catalog for host-$FAKE_HOST in environment"
+        echo "Notice: Finished catalog run in ${FAKE_PUPPET_SECONDS:-0} seconds"
+        ;;
+    python)
+        echo "centos,7.2.1511"
+        ;;
+    rpm)
+        provides=0; qf=0
+        for arg; do
+            if [ $qf == 1 ]; then qf=0; continue; fi
+            case "$arg" in
+                --whatprovides) provides=1 ;;
+                --qf) qf=1 ;;
+                -*) ;;
+                *) [ $provides == 1 ] && echo "$arg" || echo "$arg-1.0-1.noarch" ;;
+            esac
+        done
+        ;;
+    yum-config-manager)
+        while [ $# -gt 0 ]; do
+            case "$1" in
+                --enable) echo -e "[$2]\nenabled = 1"; shift ;;
+                --disable) echo -e "[$2]\nenabled = 0"; shift ;;
+            esac
+            shift
+        done
+        ;;
+esac
+exit 0
+'''
+
+REMOTE_COMMANDS = ('facter', 'puppet', 'python', 'rpm', 'yum',
+                   'yum-config-manager', 'systemctl', 'service',
+                   'restorecon', 'vgdisplay', 'subscription-manager',
+                   'setenforce', 'curl')
+
+HOST_FILES = {
+    'etc/yum.conf': '[main]\ncachedir=/var/cache/yum\n',
+    'etc/hiera.yaml': '---\n:backends:\n  - yaml\n:yaml:\n  :datadir: /\n',
+    'etc/redhat-release': 'CentOS Linux release 7.2.1511 (Core)\n',
+}
+HOST_DIRS = ('etc/puppet', 'etc/yum.repos.d', 'root/.ssh',
+             'var/tmp/packstack')
+
+
+def write_script(path, content):
+    with open(path, 'w') as fp:
+        fp.write(content)
+    os.chmod(path, stat.S_IRWXU)
+
+
+def prepare_sandbox(sandbox, hosts):
+    local_bin = os.path.join(sandbox, 'bin')
+    remote_bin = os.path.join(sandbox, 'remote-bin')
+    os.makedirs(local_bin)
+    os.makedirs(remote_bin)
+    write_script(os.path.join(local_bin, 'ssh'), FAKE_SSH)
+    write_script(os.path.join(local_bin, 'scp'), FAKE_SCP)
+    write_script(os.path.join(local_bin, 'ssh-keyscan'), FAKE_KEYSCAN)
+    write_script(os.path.join(local_bin, 'rpm'), FAKE_LOCAL_RPM)
+    write_script(os.path.join(local_bin, 'restorecon'), FAKE_NOOP)
+    stub = os.path.join(remote_bin, 'stub')
+    write_script(stub, FAKE_REMOTE)
+    for name in REMOTE_COMMANDS:
+        os.symlink(stub, os.path.join(remote_bin, name))
+
+    for host in hosts:
+        root = os.path.join(sandbox, 'hosts', host)
+        for directory in HOST_DIRS:
+            os.makedirs(os.path.join(root, directory))
+        for path, content in HOST_FILES.items():
+            with open(os.path.join(root, path), 'w') as fp:
+                fp.write(content)
+
+    # home of the user running Packstack, which gets answer file,
+    # certificates and, on all-in-one runs, also the authorized key
+    os.makedirs(os.path.join(sandbox, 'home', '.ssh'))
+    pubkey = os.path.join(sandbox, 'id_rsa.pub')
+    with open(pubkey, 'w') as fp:
+        fp.write('ssh-rsa AAAAB3NzaC1yc2EAAAADAQABAAABAQDfake bench\n')
+    return local_bin, pubkey
+
+
+def fake_hosts(count):
+    # 198.18.0.0/15 is reserved for benchmarking
+    return ['198.18.%d.%d' % (i // 250, i % 250 + 1) for i in range(count)]
+
+
+def system_forks():
+    with open('/proc/stat') as fp:
+        for line in fp:
+            if line.startswith('processes '):
+                return int(line.split()[1])
+    return 0
+
+
+def deploy(sandbox, hosts, pubkey, result_file):
+    """
+    Runs Packstack deployment in this process, meant to be run as a child
+    of the benchmark.
+    """
+    if not os.path.isdir('/usr/share/openstack-puppet/modules'):
+        # running from source without modules package, so let's deploy
+        # empty modules
+        puppet_dir = os.path.join(sandbox, 'puppet')
+        os.environ.setdefault('PACKSTACK_PUPPETDIR', puppet_dir)
+        from packstack.plugins.puppet_950 import OS_MODULES
+        for module in OS_MODULES:
+            manifests = os.path.join(puppet_dir, 'modules', module,
+                                     'manifests')
+            os.makedirs(manifests)
+            with open(os.path.join(manifests, 'init.pp'), 'w') as fp:
+                fp.write('class %s {}\n' % module)
+
+    from packstack.installer import run_setup
+    from packstack.installer import validators
+
+    # fake hosts do not listen on SSH port
+    validators.validate_ssh = lambda param, options=None: None
+
+    spawned = [0]
+    popen_init = subprocess.Popen.__init__
+
+    def counting_init(self, *args, **kwargs):
+        spawned[0] += 1
+        popen_init(self, *args, **kwargs)
+    subprocess.Popen.__init__ = counting_init
+
+    sys.argv = ['packstack', '--install-hosts=%s' % ','.join(hosts),
+                '--ssh-public-key=%s' % pubkey,
+                '--default-password=benchmark', '--os-swift-install=y']
+    rc = 0
+    try:
+        run_setup.main()
+    except SystemExit as ex:
+        rc = ex.code or 0
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    with open(result_file, 'w') as fp:
+        json.dump({'rc': rc, 'spawned': spawned[0],
+                   'cpu': usage.ru_utime + usage.ru_stime,
+                   'maxrss': usage.ru_maxrss}, fp)
+
+
+def run(count, puppet_seconds, keep=False):
+    sandbox = tempfile.mkdtemp(prefix='packstack-fleet-')
+    hosts = fake_hosts(count)
+    local_bin, pubkey = prepare_sandbox(sandbox, hosts)
+    result_file = os.path.join(sandbox, 'result.json')
+    output = os.path.join(sandbox, 'packstack.out')
+
+    env = dict(os.environ)
+    env['PATH'] = '%s:%s' % (local_bin, env.get('PATH', ''))
+    env['HOME'] = os.path.join(sandbox, 'home')
+    env['FAKE_FLEET_DIR'] = sandbox
+    env['FAKE_PUPPET_SECONDS'] = str(puppet_seconds)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.getcwd()] + [i for i in [env.get('PYTHONPATH')] if i]
+    )
+
+    forks = system_forks()
+    start = time.time()
+    with open(output, 'w') as out:
+        proc = subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                                 '--deploy', sandbox, '--result',
+                                 result_file, '--pubkey', pubkey] + hosts,
+                                stdin=open(os.devnull), stdout=out,
+                                stderr=subprocess.STDOUT, env=env)
+        pid, status, usage = os.wait4(proc.pid, 0)
+    elapsed = time.time() - start
+    forks = system_forks() - forks
+
+    try:
+        with open(result_file) as fp:
+            result = json.load(fp)
+    except (IOError, ValueError):
+        result = {'rc': status, 'spawned': 0, 'cpu': 0, 'maxrss': 0}
+    result.update({'hosts': count, 'time': elapsed, 'forks': forks,
+                   'total_cpu': usage.ru_utime + usage.ru_stime})
+    if result['rc']:
+        with open(output) as fp:
+            result['output'] = fp.read()[-2000:]
+    if keep:
+        result['sandbox'] = sandbox
+    else:
+        shutil.rmtree(sandbox, ignore_errors=True)
+    return result
+
+
+def main():
+    parser = optparse.OptionParser(usage=__doc__.strip().split('\n\n')[-1])
+    parser.add_option('-p', '--puppet-seconds', type='float', default=1.0,
+                      help='time spent by each stub puppet apply')
+    parser.add_option('-k', '--keep', action='store_true', default=False,
+                      help='keep sandboxes of fake hosts')
+    parser.add_option('--deploy', help=optparse.SUPPRESS_HELP)
+    parser.add_option('--result', help=optparse.SUPPRESS_HELP)
+    parser.add_option('--pubkey', help=optparse.SUPPRESS_HELP)
+    options, args = parser.parse_args()
+
+    if options.deploy:
+        deploy(options.deploy, args, options.pubkey, options.result)
+        return 0
+
+    counts = [int(i) for i in args] or [1, 10, 100, 500]
+    print('%6s %9s %12s %12s %10s %8s %8s'
+          % ('hosts', 'time [s]', 'ctl cpu [s]', 'all cpu [s]',
+             'rss [MB]', 'spawned', 'forks'))
+    failed = False
+    for count in counts:
+        result = run(count, options.puppet_seconds, keep=options.keep)
+        print('%6d %9.1f %12.1f %12.1f %10.1f %8d %8d'
+              % (result['hosts'], result['time'], result['cpu'],
+                 result['total_cpu'], result['maxrss'] / 1024.0,
+                 result['spawned'], result['forks']))
+        if result.get('sandbox'):
+            print('       sandbox: %s' % result['sandbox'])
+        if result['rc']:
+            failed = True
+            print('Deployment failed:\n%s' % result['output'])
+        sys.stdout.flush()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
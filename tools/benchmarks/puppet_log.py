@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark of Puppet log analysis on synthetic debug logs.
+
+Usage: python tools/benchmarks/puppet_log.py [size in MB, default 100]
+"""
+
+import os
+import re
+import sys
+import tempfile
+import time
+
+from packstack.modules import puppet
+
+
+DEBUG_LINES = (
+    "Debug: Executing '/usr/bin/rpm -q openstack-nova-compute --nosignature "
+    "--nodigest --qf %{NAME} %|EPOCH?{%{EPOCH}}:{0}| %{VERSION} %{RELEASE} "
+    "%{ARCH}\\n'\n",
+    "Debug: /Stage[main]/Nova::Compute/Nova_config[DEFAULT/compute_driver]"
+    ": The container Class[Nova::Compute] will propagate my refresh event\n",
+    "Debug: Prefetching parsed resources for ssh_authorized_key\n",
+    "Notice: /Stage[main]/Nova/Package[python-nova]/ensure: created\n",
+    "Debug: Puppet::Type::Package::ProviderYum: Executing '/usr/bin/yum -d "
+    "0 -e 0 -y install openstack-nova-common'\n",
+)
+RARE_LINES = (
+    "notice: /Stage[main]/Packstack/Notify[packstack_info]/message: "
+    "defined 'message' as 'Some message for the user'\n",
+    "err: Could not prefetch database_grant provider 'mysql': Execution of "
+    "'/usr/bin/mysql --defaults-file=/root/.my.cnf' returned 1\n",
+)
+
+
+def generate(path, size):
+    chunk = ''.join(DEBUG_LINES * 200)
+    written = 0
+    with open(path, 'w') as fp:
+        while written < size:
+            fp.write(chunk)
+            fp.write(RARE_LINES[(written // len(chunk)) % len(RARE_LINES)])
+            written += len(chunk)
+
+
+def legacy(path):
+    # two passes with per-line matching, as done by former
+    # scan_logfile and validate_logfile
+    notices = []
+    with open(path) as logfile:
+        for line in logfile:
+            match = puppet.re_notice.search(line)
+            if match:
+                notices.append(match.group('message'))
+    with open(path) as logfile:
+        for line in logfile:
+            line = line.strip()
+            if puppet.re_error.search(line) is None:
+                continue
+            error = puppet.re_color.sub('', line)
+            if puppet.re_ignore.search(line):
+                continue
+            for regex, surrogate in puppet.surrogates:
+                re.search(regex, error)
+    return notices
+
+
+def mapped(path):
+    return puppet.analyze_logfile(path).notices
+
+
+def streamed(path):
+    analyzer = puppet.LogAnalyzer(path)
+    with open(path) as logfile:
+        for chunk in iter(lambda: logfile.read(1 << 20), ''):
+            analyzer.feed(chunk)
+    analyzer.close()
+    return analyzer.notices
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    fd, path = tempfile.mkstemp(suffix='.log')
+    os.close(fd)
+    try:
+        generate(path, size << 20)
+        megabytes = os.path.getsize(path) / float(1 << 20)
+        print('Analyzing %.1f MB of synthetic Puppet debug log' % megabytes)
+        results = []
+        for name, func in (('legacy two-pass', legacy),
+                           ('single-pass mmap', mapped),
+                           ('single-pass streamed', streamed)):
+            start = time.time()
+            notices = func(path)
+            elapsed = time.time() - start
+            results.append(len(notices))
+            print('%-22s %8.2f s %8.1f MB/s'
+                  % (name, elapsed, megabytes / elapsed))
+        if len(set(results)) != 1:
+            print('Results differ: %s' % results)
+            return 1
+    finally:
+        os.unlink(path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
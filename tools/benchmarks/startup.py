@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark of Packstack CLI startup.
+
+Commands which do not deploy anything (--version, --help and
+--gen-answer-file) are run repeatedly, each in a fresh interpreter with
+home directory redirected to a sandbox. Reported are best and median
+end-to-end wall time, time spent in Packstack itself (imports included)
+and heavy libraries which got imported. With --cold the cache of option
+texts parsed from packstack.rst is removed before each run.
+
+Usage: python tools/benchmarks/startup.py [-n RUNS] [--cold] [COMMANDS ...]
+       (default commands are version help gen-answer-file)
+"""
+
+import json
+import optparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+# libraries which should be imported only by commands which need them
+HEAVY_MODULES = ('OpenSSL', 'cryptography', 'docutils', 'multiprocessing',
+                 'netaddr', 'paramiko', 'pkg_resources', 'yaml')
+COMMANDS = {
+    'version': ['--version'],
+    'help': ['--help'],
+    'gen-answer-file': ['--gen-answer-file=%(sandbox)s/answers.txt',
+                        '--ssh-public-key=%(sandbox)s/id_rsa.pub'],
+}
+
+
+def start(args, result_file):
+    """
+    Runs Packstack with given arguments in this process, meant to be run
+    as a child of the benchmark.
+    """
+    started = time.time()
+    from packstack.installer import run_setup
+    from packstack.installer import validators
+
+    # answer file is generated also on hosts which do not run SSH server
+    validators.validate_ssh = lambda param, options=None: None
+
+    sys.argv = ['packstack'] + args
+    rc = 0
+    try:
+        run_setup.main()
+    except SystemExit as ex:
+        rc = ex.code or 0
+    loaded = sorted(name for name in HEAVY_MODULES if name in sys.modules)
+    with open(result_file, 'w') as fp:
+        json.dump({'rc': rc, 'packstack': time.time() - started,
+                   'modules': loaded}, fp)
+
+
+def run_once(sandbox, command, cold=False):
+    if cold:
+        from packstack.modules.documentation import USAGE_CACHE
+        if os.path.exists(USAGE_CACHE):
+            os.unlink(USAGE_CACHE)
+    result_file = os.path.join(sandbox, 'result.json')
+    env = dict(os.environ)
+    env['HOME'] = os.path.join(sandbox, 'home')
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.getcwd()] + [i for i in [env.get('PYTHONPATH')] if i]
+    )
+    args = [i % {'sandbox': sandbox} for i in COMMANDS[command]]
+
+    start_time = time.time()
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                             '--start', result_file, '--'] + args,
+                            stdin=open(os.devnull), stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, env=env)
+    output = proc.communicate()[0]
+    elapsed = time.time() - start_time
+
+    try:
+        with open(result_file) as fp:
+            result = json.load(fp)
+        os.unlink(result_file)
+    except (IOError, ValueError):
+        result = {'rc': proc.returncode, 'packstack': 0, 'modules': []}
+    result['time'] = elapsed
+    if result['rc']:
+        result['output'] = output[-2000:]
+    return result
+
+
+def run(command, runs, cold=False):
+    sandbox = tempfile.mkdtemp(prefix='packstack-startup-')
+    os.mkdir(os.path.join(sandbox, 'home'), 0o700)
+    with open(os.path.join(sandbox, 'id_rsa.pub'), 'w') as fp:
+        fp.write('ssh-rsa AAAAB3NzaC1yc2E benchmark\n')
+    try:
+        results = [run_once(sandbox, command, cold=cold)
+                   for i in range(runs)]
+    finally:
+        shutil.rmtree(sandbox, ignore_errors=True)
+    times = sorted(i['time'] for i in results)
+    own = sorted(i['packstack'] for i in results)
+    failed = [i for i in results if i['rc']]
+    return {'command': command, 'best': times[0],
+            'median': times[len(times) // 2],
+            'packstack': own[len(own) // 2],
+            'modules': results[-1]['modules'],
+            'rc': failed and failed[0]['rc'] or 0,
+            'output': failed and failed[0]['output'] or ''}
+
+
+def main():
+    parser = optparse.OptionParser(usage=__doc__.strip().split('\n\n')[-1])
+    parser.add_option('-n', '--runs', type='int', default=5,
+                      help='number of runs of each command')
+    parser.add_option('--cold', action='store_true', default=False,
+                      help='remove cached option texts before each run')
+    parser.add_option('--start', help=optparse.SUPPRESS_HELP)
+    options, args = parser.parse_args()
+
+    if options.start:
+        start(args, options.start)
+        return 0
+
+    commands = args or ['version', 'help', 'gen-answer-file']
+    for command in commands:
+        if command not in COMMANDS:
+            parser.error('unknown command %s, use one of: %s'
+                         % (command, ', '.join(sorted(COMMANDS))))
+    print('%-16s %9s %11s %14s  %s'
+          % ('command', 'best [s]', 'median [s]', 'packstack [s]',
+             'heavy modules'))
+    failed = False
+    for command in commands:
+        result = run(command, options.runs, cold=options.cold)
+        print('%-16s %9.3f %11.3f %14.3f  %s'
+              % (command, result['best'], result['median'],
+                 result['packstack'], ', '.join(result['modules']) or '-'))
+        if result['rc']:
+            failed = True
+            print('Command failed:\n%s' % result['output'])
+        sys.stdout.flush()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())